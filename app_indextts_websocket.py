@@ -46,7 +46,10 @@ parser.add_argument("--gui_seg_tokens", type=int, default=120, help="GUI: Max to
 # WebSocket 相关参数
 parser.add_argument("--ws_host", type=str, default=None, help="WebSocket server host (e.g., http://localhost:5001)")
 parser.add_argument("--ws_space", type=str, default=None, help="WebSocket space name to connect to")
+parser.add_argument("--ws_token", type=str, default=os.environ.get("WS_SPACE_TOKEN", ""), help="Space auth token (or set WS_SPACE_TOKEN)")
 parser.add_argument("--ws_only", action="store_true", default=False, help="Only run WebSocket mode, no Gradio UI")
+parser.add_argument("--ws_heartbeat_interval", type=float, default=10.0, help="Seconds between WebSocket heartbeats")
+parser.add_argument("--ws_max_batch_size", type=int, default=1, help="Max requests accepted per inference_batch (1 disables batching)")
 
 cmd_args = parser.parse_args()
 
@@ -131,13 +134,23 @@ if os.path.exists("examples/cases.jsonl"):
 class WebSocketInferenceClient:
     """WebSocket client for remote inference via website."""
     
-    def __init__(self, host, space_name):
+    PROTOCOL_VERSION = 2
+
+    def __init__(self, host, space_name, token='', heartbeat_interval=10.0, max_batch_size=1):
         self.host = host
         self.space_name = space_name
+        self.token = token
+        self.heartbeat_interval = heartbeat_interval
+        self.max_batch_size = max(1, max_batch_size)
         self.sio = None
         self.connected = False
         self.registered = False
         self.running = True
+        self.active_requests = set()
+        self.cancelled_requests = set()
+        # Negotiated with the server in register_result
+        self.capabilities = {}
+        self._heartbeat_thread = None
         
     def start(self):
         """Start WebSocket connection in a separate thread."""
@@ -171,7 +184,17 @@ class WebSocketInferenceClient:
             self.connected = True
             print(f"[WebSocket] ✓ Connected to server")
             print(f"[WebSocket] Registering for space: {self.space_name}")
-            self.sio.emit('register_remote', {'space_name': self.space_name})
+            self.sio.emit('register_remote', {
+                'space_name': self.space_name,
+                'token': self.token,
+                'protocol_version': self.PROTOCOL_VERSION,
+                'capabilities': {
+                    'max_batch_size': self.max_batch_size,
+                    'max_concurrency': 1,
+                    'binary': True,
+                    'heartbeat_interval': self.heartbeat_interval
+                }
+            })
         
         @self.sio.event
         def disconnect():
@@ -183,8 +206,13 @@ class WebSocketInferenceClient:
         def on_register_result(data):
             if data.get('success'):
                 self.registered = True
+                self.capabilities = data.get('capabilities') or {}
+                if self.capabilities.get('heartbeat_interval'):
+                    self.heartbeat_interval = self.capabilities['heartbeat_interval']
                 print(f"[WebSocket] ✓ Successfully registered for space: {self.space_name}")
+                print(f"[WebSocket] Protocol v{data.get('protocol_version', 1)}, capabilities: {self.capabilities}")
                 print(f"[WebSocket] Ready to receive inference requests...")
+                self._start_heartbeat()
             else:
                 print(f"[WebSocket] ✗ Registration failed: {data.get('error')}")
         
@@ -200,6 +228,8 @@ class WebSocketInferenceClient:
             print(f"[WebSocket] Request ID: {request_id}")
             print(f"[WebSocket] User: {user}")
             
+            self.active_requests.add(request_id)
+
             # Process in a thread to avoid blocking WebSocket
             thread = threading.Thread(
                 target=self._process_request,
@@ -207,115 +237,244 @@ class WebSocketInferenceClient:
             )
             thread.daemon = True
             thread.start()
+
+        @self.sio.on('inference_batch')
+        def on_inference_batch(data):
+            """Handle a batch of compatible requests (same reference audio and options)."""
+            batch_id = data.get('batch_id')
+            requests = data.get('requests') or []
+
+            print(f"\n[WebSocket] ═══════════════════════════════════════")
+            print(f"[WebSocket] 收到批量推理请求! Batch ID: {batch_id}, 数量: {len(requests)}")
+
+            for item in requests:
+                self.active_requests.add(item.get('request_id'))
+
+            thread = threading.Thread(
+                target=self._process_batch,
+                args=(batch_id, requests)
+            )
+            thread.daemon = True
+            thread.start()
+
+        @self.sio.on('inference_cancel')
+        def on_inference_cancel(data):
+            """The server gave up on a request (timeout) and re-dispatched it elsewhere."""
+            request_id = data.get('request_id')
+            self.cancelled_requests.add(request_id)
+            print(f"[WebSocket] Request {request_id} was cancelled by the server")
+
+    def _start_heartbeat(self):
+        """Starts the heartbeat thread once; it keeps running across reconnects."""
+        if self._heartbeat_thread and self._heartbeat_thread.is_alive():
+            return
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        while self.running:
+            if self.registered and self.sio and self.sio.connected:
+                try:
+                    self.sio.emit('worker_heartbeat', self._collect_load())
+                except Exception as e:
+                    print(f"[WebSocket] Heartbeat failed: {e}")
+            time.sleep(self.heartbeat_interval)
+
+    def _collect_load(self):
+        """Reports GPU usage and local queue depth to the server."""
+        load = {'queue_depth': len(self.active_requests)}
+        try:
+            import torch
+            if torch.cuda.is_available():
+                free, total = torch.cuda.mem_get_info()
+                load['gpu_memory_total_mb'] = int(total / (1024 * 1024))
+                load['gpu_memory_used_mb'] = int((total - free) / (1024 * 1024))
+                try:
+                    load['gpu_utilization'] = torch.cuda.utilization()
+                except Exception:
+                    pass  # needs pynvml
+        except Exception:
+            pass
+        return load
     
+    def _resolve_prompt_audio(self, request_data):
+        """
+        Returns (path, is_temp) for the reference voice of a request.
+        Uploaded audio is decoded to a temp file; otherwise a bundled prompt is used.
+        """
+        prompt_audio = request_data.get('audio')  # Raw bytes (binary mode) or base64 string
+        if prompt_audio:
+            # Decode audio and save to temp file
+            try:
+                if isinstance(prompt_audio, (bytes, bytearray)):
+                    audio_data = bytes(prompt_audio)
+                else:
+                    # Remove data URL prefix if present
+                    if ',' in prompt_audio:
+                        prompt_audio = prompt_audio.split(',')[1]
+                    audio_data = base64.b64decode(prompt_audio)
+                with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
+                    f.write(audio_data)
+                print(f"[WebSocket] Received reference audio: {len(audio_data)} bytes")
+                return f.name, True
+            except Exception as e:
+                print(f"[WebSocket] Failed to decode audio: {e}")
+
+        # Use default prompt audio if none provided
+        default_prompt = "examples/sample_prompt.wav"
+        if os.path.exists(default_prompt):
+            print(f"[WebSocket] Using default prompt audio")
+            return default_prompt, False
+
+        # Try to find any prompt audio
+        prompts_dir = "prompts"
+        if os.path.exists(prompts_dir):
+            files = [f for f in os.listdir(prompts_dir) if f.endswith('.wav')]
+            if files:
+                prompt_audio_path = os.path.join(prompts_dir, files[0])
+                print(f"[WebSocket] Using prompt: {prompt_audio_path}")
+                return prompt_audio_path, False
+
+        return None, False
+
+    def _run_tts(self, request_id, prompt, prompt_audio_path):
+        """Runs one TTS generation and returns the result payload."""
+        if not prompt_audio_path or not os.path.exists(prompt_audio_path):
+            raise ValueError("No reference audio available for TTS")
+
+        if not prompt or not prompt.strip():
+            raise ValueError("No text provided for TTS")
+
+        print(f"[WebSocket] Text: {prompt[:100]}...")
+
+        # Generate output path
+        output_path = os.path.join("outputs", f"ws_{request_id[:8]}_{int(time.time())}.wav")
+
+        # Run TTS inference
+        print(f"[WebSocket] Running TTS inference...")
+        start_time = time.time()
+
+        output = tts.infer(
+            spk_audio_prompt=prompt_audio_path,
+            text=prompt,
+            output_path=output_path,
+            verbose=cmd_args.verbose,
+            max_text_tokens_per_segment=120
+        )
+
+        elapsed = time.time() - start_time
+        print(f"[WebSocket] ✓ TTS completed in {elapsed:.2f}s")
+
+        # Read generated audio and encode to base64
+        if not output or not os.path.exists(output):
+            raise ValueError("TTS output file not generated")
+
+        with open(output, 'rb') as f:
+            audio_bytes = f.read()
+        print(f"[WebSocket] Audio size: {len(audio_bytes)} bytes")
+
+        if self.capabilities.get('binary'):
+            # Sent as a binary attachment; the server re-encodes it as audio_base64
+            audio_field = {'audio_bytes': audio_bytes}
+        else:
+            audio_field = {'audio_base64': base64.b64encode(audio_bytes).decode('utf-8')}
+
+        return {
+            'type': 'audio',
+            **audio_field,
+            'audio_format': 'wav',
+            'duration_seconds': elapsed,
+            'text_length': len(prompt),
+            'message': f'TTS 生成成功！处理时间: {elapsed:.2f}秒'
+        }
+
+    @staticmethod
+    def _error_payload(request_id, error_msg):
+        return {
+            'request_id': request_id,
+            'success': False,
+            'error': error_msg,
+            # GPU memory pressure is specific to this worker; let the server try another one
+            'retryable': 'out of memory' in error_msg.lower()
+        }
+
     def _process_request(self, request_id, user, request_data):
         """Process TTS inference request."""
+        prompt_audio_path, is_temp = None, False
         try:
-            prompt = request_data.get('prompt', '')
-            prompt_audio_base64 = request_data.get('audio')  # Base64 encoded audio
-            
             print(f"[WebSocket] Processing TTS request...")
-            print(f"[WebSocket] Text: {prompt[:100]}...")
-            
-            # Handle prompt audio (reference voice)
-            prompt_audio_path = None
-            if prompt_audio_base64:
-                # Decode base64 audio and save to temp file
-                try:
-                    # Remove data URL prefix if present
-                    if ',' in prompt_audio_base64:
-                        prompt_audio_base64 = prompt_audio_base64.split(',')[1]
-                    
-                    audio_data = base64.b64decode(prompt_audio_base64)
-                    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-                        f.write(audio_data)
-                        prompt_audio_path = f.name
-                    print(f"[WebSocket] Received reference audio: {len(audio_data)} bytes")
-                except Exception as e:
-                    print(f"[WebSocket] Failed to decode audio: {e}")
-            
-            # Use default prompt audio if none provided
-            if not prompt_audio_path:
-                default_prompt = "examples/sample_prompt.wav"
-                if os.path.exists(default_prompt):
-                    prompt_audio_path = default_prompt
-                    print(f"[WebSocket] Using default prompt audio")
-                else:
-                    # Try to find any prompt audio
-                    prompts_dir = "prompts"
-                    if os.path.exists(prompts_dir):
-                        files = [f for f in os.listdir(prompts_dir) if f.endswith('.wav')]
-                        if files:
-                            prompt_audio_path = os.path.join(prompts_dir, files[0])
-                            print(f"[WebSocket] Using prompt: {prompt_audio_path}")
-            
-            if not prompt_audio_path or not os.path.exists(prompt_audio_path):
-                raise ValueError("No reference audio available for TTS")
-            
-            if not prompt or not prompt.strip():
-                raise ValueError("No text provided for TTS")
-            
-            # Generate output path
-            output_path = os.path.join("outputs", f"ws_{request_id[:8]}_{int(time.time())}.wav")
-            
-            # Run TTS inference
-            print(f"[WebSocket] Running TTS inference...")
-            start_time = time.time()
-            
-            output = tts.infer(
-                spk_audio_prompt=prompt_audio_path,
-                text=prompt,
-                output_path=output_path,
-                verbose=cmd_args.verbose,
-                max_text_tokens_per_segment=120
-            )
-            
-            elapsed = time.time() - start_time
-            print(f"[WebSocket] ✓ TTS completed in {elapsed:.2f}s")
-            
-            # Read generated audio and encode to base64
-            if output and os.path.exists(output):
-                with open(output, 'rb') as f:
-                    audio_bytes = f.read()
-                audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
-                
-                result = {
-                    'type': 'audio',
-                    'audio_base64': audio_base64,
-                    'audio_format': 'wav',
-                    'duration_seconds': elapsed,
-                    'text_length': len(prompt),
-                    'message': f'TTS 生成成功！处理时间: {elapsed:.2f}秒'
-                }
-                
+            prompt_audio_path, is_temp = self._resolve_prompt_audio(request_data)
+            result = self._run_tts(request_id, request_data.get('prompt', ''), prompt_audio_path)
+
+            if request_id in self.cancelled_requests:
+                print(f"[WebSocket] Dropping result for cancelled request {request_id}")
+            else:
                 self.sio.emit('inference_result', {
                     'request_id': request_id,
                     'success': True,
                     'result': result
                 })
-                
-                print(f"[WebSocket] ✓ Result sent! Audio size: {len(audio_bytes)} bytes")
-            else:
-                raise ValueError("TTS output file not generated")
-            
+                print(f"[WebSocket] ✓ Result sent!")
+
         except Exception as e:
             error_msg = str(e)
             print(f"[WebSocket] ✗ Error: {error_msg}")
-            
-            self.sio.emit('inference_result', {
-                'request_id': request_id,
-                'success': False,
-                'error': error_msg
-            })
-        
+            self.sio.emit('inference_result', self._error_payload(request_id, error_msg))
+
         finally:
+            self.active_requests.discard(request_id)
+            self.cancelled_requests.discard(request_id)
             # Cleanup temp files
-            if prompt_audio_path and prompt_audio_path.startswith(tempfile.gettempdir()):
+            if is_temp and prompt_audio_path:
                 try:
                     os.remove(prompt_audio_path)
                 except:
                     pass
-        
+
+        print(f"[WebSocket] ═══════════════════════════════════════\n")
+
+    def _process_batch(self, batch_id, requests):
+        """
+        Process a batch of requests that share everything but the text.
+        The reference audio is decoded once and every item reuses the same
+        path, so IndexTTS2 hits its cached speaker conditioning instead of
+        re-extracting it for each request. Each item's result is sent as an
+        inference_result as soon as it is ready, so finished items don't wait
+        for the rest of the batch.
+        """
+        sent = 0
+        prompt_audio_path, is_temp = None, False
+        try:
+            if requests:
+                prompt_audio_path, is_temp = self._resolve_prompt_audio(requests[0].get('data', {}))
+
+            for item in requests:
+                request_id = item.get('request_id')
+                try:
+                    if request_id in self.cancelled_requests:
+                        continue  # The server already gave up on it; don't spend GPU time
+                    result = self._run_tts(request_id, item.get('data', {}).get('prompt', ''), prompt_audio_path)
+                    if request_id not in self.cancelled_requests:
+                        self.sio.emit('inference_result', {'request_id': request_id, 'success': True, 'result': result})
+                        sent += 1
+                except Exception as e:
+                    error_msg = str(e)
+                    print(f"[WebSocket] ✗ Error for {request_id}: {error_msg}")
+                    self.sio.emit('inference_result', self._error_payload(request_id, error_msg))
+                    sent += 1
+                finally:
+                    self.active_requests.discard(request_id)
+                    self.cancelled_requests.discard(request_id)
+
+            print(f"[WebSocket] ✓ Batch {batch_id} done: {sent} result(s) sent")
+
+        finally:
+            if is_temp and prompt_audio_path:
+                try:
+                    os.remove(prompt_audio_path)
+                except:
+                    pass
+
         print(f"[WebSocket] ═══════════════════════════════════════\n")
     
     def wait(self):
@@ -608,7 +767,10 @@ if __name__ == "__main__":
         print(f"  Space:  {cmd_args.ws_space}")
         print("="*60 + "\n")
         
-        ws_client = WebSocketInferenceClient(cmd_args.ws_host, cmd_args.ws_space)
+        ws_client = WebSocketInferenceClient(cmd_args.ws_host, cmd_args.ws_space,
+                                             token=cmd_args.ws_token,
+                                             heartbeat_interval=cmd_args.ws_heartbeat_interval,
+                                             max_batch_size=cmd_args.ws_max_batch_size)
         
         if ws_client.start():
             # Give time for registration
@@ -6,7 +6,10 @@ This script simulates a remote inference server that connects to the
 website via WebSocket and processes inference requests.
 
 Usage:
-    python mock_remote_app.py --host http://localhost:5001 --spaces my-space-name
+    python mock_remote_app.py --host http://localhost:5001 --spaces my-space-name --token <space auth token>
+
+Run two instances against the same space to exercise failover; start one of
+them with --hang to simulate a stuck GPU process.
 
 """
 import argparse
@@ -14,6 +17,7 @@ import json
 import time
 import random
 import sys
+import threading
 
 try:
     import socketio
@@ -76,18 +80,41 @@ Examples:
         required=True, 
         help='Name of the Space to connect to'
     )
+    parser.add_argument(
+        '--token',
+        default='',
+        help='Space auth token (required if the space has one)'
+    )
     parser.add_argument(
         '--delay',
         type=float,
         default=2.0,
         help='Simulated processing delay in seconds (default: 2.0)'
     )
+    parser.add_argument(
+        '--heartbeat',
+        type=float,
+        default=10.0,
+        help='Seconds between heartbeats, 0 disables them (default: 10.0)'
+    )
+    parser.add_argument(
+        '--batch',
+        type=int,
+        default=1,
+        help='Max requests accepted per inference_batch, 1 disables batching (default: 1)'
+    )
+    parser.add_argument(
+        '--hang',
+        action='store_true',
+        help='Simulate a hung worker: stop heart-beating and never answer requests'
+    )
     
     args = parser.parse_args()
     
     host = args.host.rstrip('/')
     space_name = args.spaces
     processing_delay = args.delay
+    heartbeat_interval = args.heartbeat
     
     print(f"\n{'='*60}")
     print(f"  Mock Remote App for WebSocket Spaces")
@@ -95,6 +122,7 @@ Examples:
     print(f"  Host:  {host}")
     print(f"  Space: {space_name}")
     print(f"  Delay: {processing_delay}s")
+    print(f"  Heartbeat: {heartbeat_interval}s{' (hang mode)' if args.hang else ''}")
     print(f"{'='*60}\n")
     
     # Create Socket.IO client
@@ -106,6 +134,18 @@ Examples:
     
     connected = False
     registered = False
+    busy = threading.Event()
+    
+    def heartbeat_loop():
+        while True:
+            time.sleep(heartbeat_interval)
+            if args.hang:
+                continue
+            if registered and sio.connected:
+                sio.emit('worker_heartbeat', {
+                    'queue_depth': 1 if busy.is_set() else 0,
+                    'gpu_utilization': random.randint(60, 99) if busy.is_set() else random.randint(0, 10)
+                })
     
     @sio.event
     def connect():
@@ -113,7 +153,19 @@ Examples:
         connected = True
         print(f"[✓] Connected to WebSocket server")
         print(f"[...] Registering as remote for space: {space_name}")
-        sio.emit('register_remote', {'space_name': space_name})
+        capabilities = {
+            'max_concurrency': 1,
+            'max_batch_size': max(1, args.batch),
+            'binary': False
+        }
+        if heartbeat_interval > 0:
+            capabilities['heartbeat_interval'] = heartbeat_interval
+        sio.emit('register_remote', {
+            'space_name': space_name,
+            'token': args.token,
+            'protocol_version': 2,
+            'capabilities': capabilities
+        })
     
     @sio.event
     def disconnect():
@@ -130,6 +182,7 @@ Examples:
             registered = True
             print(f"[✓] Successfully registered for space: {data.get('space_name')}")
             print(f"    Message: {data.get('message')}")
+            print(f"    Protocol: v{data.get('protocol_version', 1)}, capabilities: {data.get('capabilities')}")
             print(f"\n[...] Waiting for inference requests...\n")
         else:
             print(f"\n[✗] Registration failed!")
@@ -150,6 +203,11 @@ Examples:
         print(f"    User: {user}")
         print(f"    Data: {json.dumps(request_data, ensure_ascii=False, indent=2)[:200]}...")
         
+        if args.hang:
+            print(f"[!] Hang mode: ignoring request")
+            return
+        
+        busy.set()
         # Simulate processing time
         print(f"[...] Processing (simulating {processing_delay}s delay)...")
         time.sleep(processing_delay)
@@ -176,15 +234,61 @@ Examples:
                 'error': str(e)
             })
         
+        busy.clear()
         print(f"{'─'*50}\n")
         print(f"[...] Waiting for next request...\n")
     
+    @sio.on('inference_batch')
+    def on_inference_batch(data):
+        batch_id = data.get('batch_id')
+        requests = data.get('requests') or []
+        
+        print(f"\n{'─'*50}")
+        print(f"[→] Received inference batch")
+        print(f"    Batch ID: {batch_id}")
+        print(f"    Requests: {len(requests)}")
+        
+        if args.hang:
+            print(f"[!] Hang mode: ignoring batch")
+            return
+        
+        # A batch costs roughly one forward pass, not one per request
+        busy.set()
+        time.sleep(processing_delay)
+        
+        results = []
+        for item in requests:
+            try:
+                results.append({
+                    'request_id': item.get('request_id'),
+                    'success': True,
+                    'result': create_mock_result(item.get('data', {}))
+                })
+            except Exception as e:
+                results.append({
+                    'request_id': item.get('request_id'),
+                    'success': False,
+                    'error': str(e)
+                })
+        
+        sio.emit('inference_batch_result', {'batch_id': batch_id, 'results': results})
+        busy.clear()
+        print(f"[→] Batch results sent to server")
+        print(f"{'─'*50}\n")
+    
+    @sio.on('inference_cancel')
+    def on_inference_cancel(data):
+        print(f"[!] Server cancelled request {data.get('request_id')} (timed out here)")
+    
     # Connect to server
     print(f"[...] Connecting to {host}...")
     
     try:
         sio.connect(host, transports=['websocket', 'polling'])
         
+        if heartbeat_interval > 0:
+            threading.Thread(target=heartbeat_loop, daemon=True).start()
+        
         # Keep running
         print(f"\nPress Ctrl+C to stop the server\n")
         sio.wait()
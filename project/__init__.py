@@ -96,6 +96,17 @@ def create_app(test_config=None):
     socketio = init_socketio(app)
     app.socketio = socketio  # Store reference for run.py
 
+    # Chunked uploads from remote workers (Socket.IO namespace /ws/upload)
+    from . import s3_utils
+    from .ws_upload_handler import create_ws_upload_blueprint, start_expired_upload_cleanup
+    ws_upload_bp, cleanup_expired_uploads = create_ws_upload_blueprint(socketio, s3_utils)
+    app.register_blueprint(ws_upload_bp)
+    start_expired_upload_cleanup(app, socketio, cleanup_expired_uploads)
+
+    # Token usage counters for the chat completions proxy (flushed in batches)
+    from .usage_meter import start_usage_flusher
+    start_usage_flusher(app, socketio)
+
     # Register custom Jinja2 filters
     app.jinja_env.filters['format_datetime'] = format_datetime
 
@@ -15,8 +15,13 @@ from .netmind_config import (
     DEFAULT_NETMIND_RATE_LIMIT_MAX_REQUESTS,
     DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS,
     sanitize_rate_limit_max_requests,
-    sanitize_rate_limit_window
+    sanitize_rate_limit_window,
+    parse_rate_limit_overrides,
+    format_rate_limit_overrides
 )
+from .response_cache import response_cache, get_cache_config
+from .usage_meter import usage_meter, usage_window_start
+from .space_index import invalidate_space_index
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -40,11 +45,13 @@ def ensure_netmind_settings(db):
             'enable_alias_mapping': False,
             'base_url': 'https://api.netmind.ai/inference-api/openai/v1',
             'model_aliases': {},
+            'alias_version': 0,
             'rate_limit_window_seconds': DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS,
             'rate_limit_max_requests': DEFAULT_NETMIND_RATE_LIMIT_MAX_REQUESTS
         }
     else:
         db['netmind_settings'].setdefault('model_aliases', {})
+        db['netmind_settings'].setdefault('alias_version', 0)
         db['netmind_settings'].setdefault('ad_enabled', False)
         db['netmind_settings'].setdefault('enable_alias_mapping', False)
         db['netmind_settings'].setdefault('rate_limit_window_seconds', DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS)
@@ -61,6 +68,12 @@ def ensure_netmind_settings(db):
     )
     return db['netmind_settings']
 
+def _parse_non_negative_int(value, fallback):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return fallback
+
 def sync_netmind_aliases(db):
     settings = ensure_netmind_settings(db)
     alias_map = {}
@@ -71,7 +84,18 @@ def sync_netmind_aliases(db):
         upstream = (space.get('netmind_upstream_model') or alias or '').strip()
         if alias and upstream:
             alias_map[alias] = upstream
-    settings['model_aliases'] = alias_map if settings.get('enable_alias_mapping') else {}
+    alias_map = alias_map if settings.get('enable_alias_mapping') else {}
+    thinking_disabled = sorted(
+        (space.get('netmind_model') or '').strip().lower()
+        for space in db.get('spaces', {}).values()
+        if space.get('card_type') == 'netmind' and space.get('netmind_model')
+        and not space.get('netmind_inject_thinking', True)
+    )
+    if alias_map != settings.get('model_aliases') or thinking_disabled != settings.get('thinking_disabled_models', []):
+        # The proxy recompiles its lookup table only when this version moves
+        settings['model_aliases'] = alias_map
+        settings['thinking_disabled_models'] = thinking_disabled
+        settings['alias_version'] = int(settings.get('alias_version') or 0) + 1
 
 @admin_bp.before_request
 def check_admin():
@@ -315,6 +339,7 @@ def add_edit_space(space_id=None):
             netmind_upstream = netmind_alias
         if not netmind_settings.get('enable_alias_mapping'):
             netmind_upstream = netmind_alias
+        netmind_inject_thinking = request.form.get('netmind_inject_thinking') == 'true'
 
         # WebSocket settings
         ws_enable_prompt = request.form.get('ws_enable_prompt') == 'on'
@@ -326,6 +351,27 @@ def add_edit_space(space_id=None):
                 ws_max_queue_size = 10
         except (ValueError, TypeError):
             ws_max_queue_size = 10
+        try:
+            ws_request_timeout_seconds = int(request.form.get('ws_request_timeout_seconds', 300))
+            if ws_request_timeout_seconds <= 0:
+                ws_request_timeout_seconds = 300
+        except (ValueError, TypeError):
+            ws_request_timeout_seconds = 300
+        try:
+            ws_batch_max_size = int(request.form.get('ws_batch_max_size', 1))
+            if ws_batch_max_size <= 0:
+                ws_batch_max_size = 1
+        except (ValueError, TypeError):
+            ws_batch_max_size = 1
+        try:
+            ws_batch_max_wait_ms = int(request.form.get('ws_batch_max_wait_ms', 50))
+            if ws_batch_max_wait_ms < 0:
+                ws_batch_max_wait_ms = 50
+        except (ValueError, TypeError):
+            ws_batch_max_wait_ms = 50
+        ws_auth_token = request.form.get('ws_auth_token', '').strip()
+        if request.form.get('ws_regenerate_token') == 'on':
+            ws_auth_token = uuid.uuid4().hex
 
         if space: # Editing an existing space
             space['name'] = request.form['name']
@@ -348,24 +394,36 @@ def add_edit_space(space_id=None):
                 space['enable_image_input'] = request.form.get('enable_image_input') == 'true'
                 space['enable_audio_input'] = request.form.get('enable_audio_input') == 'true'
                 space['enable_file_input'] = request.form.get('enable_file_input') == 'true'
+                space['remote_pass_urls'] = request.form.get('remote_pass_urls') == 'true'
+                space['remote_async_jobs'] = request.form.get('remote_async_jobs') == 'true'
             
             if card_type == 'netmind':
                 space['netmind_model'] = netmind_alias
                 space['netmind_upstream_model'] = netmind_upstream or ''
+                space['netmind_inject_thinking'] = netmind_inject_thinking
             else:
                 space.pop('netmind_model', None)
                 space.pop('netmind_upstream_model', None)
+                space.pop('netmind_inject_thinking', None)
             # WebSocket settings
             if card_type == 'websocket':
                 space['ws_enable_prompt'] = ws_enable_prompt
                 space['ws_enable_audio'] = ws_enable_audio
                 space['ws_enable_video'] = ws_enable_video
                 space['ws_max_queue_size'] = ws_max_queue_size
+                space['ws_request_timeout_seconds'] = ws_request_timeout_seconds
+                space['ws_batch_max_size'] = ws_batch_max_size
+                space['ws_batch_max_wait_ms'] = ws_batch_max_wait_ms
+                space['auth_token'] = ws_auth_token
             else:
                 space.pop('ws_enable_prompt', None)
                 space.pop('ws_enable_audio', None)
                 space.pop('ws_enable_video', None)
                 space.pop('ws_max_queue_size', None)
+                space.pop('ws_request_timeout_seconds', None)
+                space.pop('ws_batch_max_size', None)
+                space.pop('ws_batch_max_wait_ms', None)
+                space.pop('auth_token', None)
         else: # Creating a new space
             db['spaces'][new_id] = {
                 'id': new_id,
@@ -378,21 +436,29 @@ def add_edit_space(space_id=None):
                 'templates': {}, # Initialize with an empty templates dict
                 'netmind_model': netmind_alias if card_type == 'netmind' else '',
                 'netmind_upstream_model': netmind_upstream if card_type == 'netmind' else '',
+                'netmind_inject_thinking': netmind_inject_thinking,
                 # Remote inference input options
                 'custom_api_url': request.form.get('custom_api_url', '').strip() if card_type == 'remote_inference' else '',
                 'enable_prompt': request.form.get('enable_prompt') == 'true' if card_type == 'remote_inference' else True,
                 'enable_image_input': request.form.get('enable_image_input') == 'true' if card_type == 'remote_inference' else False,
                 'enable_audio_input': request.form.get('enable_audio_input') == 'true' if card_type == 'remote_inference' else False,
                 'enable_file_input': request.form.get('enable_file_input') == 'true' if card_type == 'remote_inference' else False,
+                'remote_pass_urls': request.form.get('remote_pass_urls') == 'true' if card_type == 'remote_inference' else False,
+                'remote_async_jobs': request.form.get('remote_async_jobs') == 'true' if card_type == 'remote_inference' else False,
 
                 # WebSocket settings
                 'ws_enable_prompt': ws_enable_prompt if card_type == 'websocket' else False,
                 'ws_enable_audio': ws_enable_audio if card_type == 'websocket' else False,
                 'ws_enable_video': ws_enable_video if card_type == 'websocket' else False,
-                'ws_max_queue_size': ws_max_queue_size if card_type == 'websocket' else 10
+                'ws_max_queue_size': ws_max_queue_size if card_type == 'websocket' else 10,
+                'ws_request_timeout_seconds': ws_request_timeout_seconds if card_type == 'websocket' else 300,
+                'ws_batch_max_size': ws_batch_max_size if card_type == 'websocket' else 1,
+                'ws_batch_max_wait_ms': ws_batch_max_wait_ms if card_type == 'websocket' else 50,
+                'auth_token': ws_auth_token if card_type == 'websocket' else ''
             }
         sync_netmind_aliases(db)
         save_db(db)
+        invalidate_space_index()
         flash(f"Space '{request.form['name']}' 已保存。", 'success')
         return redirect(url_for('admin.add_edit_space', space_id=new_id))
 
@@ -460,11 +526,14 @@ def add_template(space_id):
         'force_upload': bool(data.get('force_upload', False)),
         'enable_lora_upload': bool(data.get('enable_lora_upload', False)),
         'requires_invitation_code': bool(data.get('requires_invitation_code', False)),
-        'disable_prompt': bool(data.get('disable_prompt', False))
+        'disable_prompt': bool(data.get('disable_prompt', False)),
+        'gradio_api_name': data.get('gradio_api_name', ''),
+        'gradio_params': data.get('gradio_params', [])
     }
 
     space['templates'][new_template_id] = new_template
     save_db(db)
+    invalidate_space_index()
 
     return jsonify({'success': True, 'template': new_template})
 
@@ -490,7 +559,7 @@ def edit_template(space_id, template_id):
         'preset_params': str, 'predicted_output_filename': str,
         'params': list, 'timeout': int, 'force_upload': bool,
         'enable_lora_upload': bool, 'requires_invitation_code': bool,
-        'disable_prompt': bool
+        'disable_prompt': bool, 'gradio_api_name': str, 'gradio_params': list
     }
 
     if not data.get('name'):
@@ -517,6 +586,7 @@ def edit_template(space_id, template_id):
                 pass
 
     save_db(db)
+    invalidate_space_index()
     return jsonify({'success': True, 'template': template})
 
 
@@ -529,6 +599,7 @@ def delete_template(space_id, template_id):
 
     del space['templates'][template_id]
     save_db(db)
+    invalidate_space_index()
     return jsonify({'success': True})
 
 
@@ -545,6 +616,7 @@ def delete_space(space_id):
         del db['spaces'][space_id]
         sync_netmind_aliases(db)
         save_db(db)
+        invalidate_space_index()
         flash('Space 已删除。', 'success')
 
     return redirect(url_for('admin.admin_panel'))
@@ -593,13 +665,57 @@ def netmind_settings():
             request.form.get('rate_limit_max_requests'),
             fallback=settings.get('rate_limit_max_requests')
         )
-        if not settings['enable_alias_mapping']:
-            settings['model_aliases'] = {}
+        settings['model_rate_limits'] = parse_rate_limit_overrides(request.form.get('model_rate_limits'))
+        settings['key_rate_limits'] = parse_rate_limit_overrides(request.form.get('key_rate_limits'))
+        settings['response_cache_enabled'] = request.form.get('response_cache_enabled') == 'on'
+        settings['stream_passthrough'] = request.form.get('stream_passthrough') == 'on'
+        settings['thinking_prompt_enabled'] = request.form.get('thinking_prompt_enabled') == 'on'
+        settings['thinking_prompt'] = request.form.get('thinking_prompt', '').strip()
+        settings['fallback_base_urls'] = [
+            line.strip() for line in request.form.get('fallback_base_urls', '').splitlines() if line.strip()
+        ]
+        settings['connect_timeout_seconds'] = max(1, _parse_non_negative_int(
+            request.form.get('connect_timeout_seconds'), settings.get('connect_timeout_seconds', 10)))
+        settings['first_token_timeout_seconds'] = max(1, _parse_non_negative_int(
+            request.form.get('first_token_timeout_seconds'), settings.get('first_token_timeout_seconds', 60)))
+        settings['hedging_enabled'] = request.form.get('hedging_enabled') == 'on'
+        settings['daily_token_quota'] = _parse_non_negative_int(
+            request.form.get('daily_token_quota'), settings.get('daily_token_quota', 0))
+        user_token_quotas = {}
+        for line in request.form.get('user_token_quotas', '').splitlines():
+            name, _, value = line.partition('=')
+            if name.strip() and value.strip().isdigit():
+                user_token_quotas[name.strip()] = int(value.strip())
+        settings['user_token_quotas'] = user_token_quotas
+        settings['hedge_percentile'] = min(99, max(50, _parse_non_negative_int(
+            request.form.get('hedge_percentile'), settings.get('hedge_percentile', 95))))
+        cache_ttl, cache_max_entries = get_cache_config(settings)[1:]
+        settings['response_cache_ttl_seconds'] = _parse_non_negative_int(
+            request.form.get('response_cache_ttl_seconds'), cache_ttl)
+        settings['response_cache_max_entries'] = _parse_non_negative_int(
+            request.form.get('response_cache_max_entries'), cache_max_entries)
+        if not settings['response_cache_enabled']:
+            response_cache.clear()
+        sync_netmind_aliases(db)
         save_db(db)
         flash('模型代理配置已更新。', 'success')
         return redirect(url_for('admin.netmind_settings'))
 
-    return render_template('admin_netmind.html', settings=settings)
+    from .netmind_proxy import NetMindClient
+    key_stats = {row['key']: row for row in NetMindClient().get_key_stats(db)}
+    return render_template(
+        'admin_netmind.html',
+        settings=settings,
+        key_stats=key_stats,
+        cache_config=get_cache_config(settings),
+        cache_stats=response_cache.stats(),
+        usage_by_user=usage_meter.summarize(usage_window_start(1), ('username',))[:20],
+        usage_by_model=usage_meter.summarize(usage_window_start(1), ('model',)),
+        usage_by_key=usage_meter.summarize(usage_window_start(1), ('key_id',)),
+        user_token_quotas_text='\n'.join(f"{name} = {value}" for name, value in sorted((settings.get('user_token_quotas') or {}).items())),
+        model_rate_limits_text=format_rate_limit_overrides(settings.get('model_rate_limits')),
+        key_rate_limits_text=format_rate_limit_overrides(settings.get('key_rate_limits'))
+    )
 
 @admin_bp.route('/netmind/key/add', methods=['POST'])
 def netmind_add_key():
@@ -628,6 +744,8 @@ def netmind_delete_key():
     if key_to_delete and key_to_delete in settings.get('keys', []):
         settings['keys'].remove(key_to_delete)
         save_db(db)
+        from .netmind_proxy import NetMindClient
+        NetMindClient().evict_key(key_to_delete)
         flash('密钥已删除。', 'success')
     else:
         flash('未找到密钥。', 'error')
@@ -2,8 +2,10 @@ import os
 import uuid
 import shlex
 import threading
-import tempfile
+import itertools
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
 from datetime import datetime
 from flask import (
     Blueprint, request, jsonify, url_for, current_app, Response, stream_with_context
@@ -15,7 +17,6 @@ import subprocess
 import shutil
 import base64
 import json
-import secrets
 from .database import load_db, save_db, backup_db
 from .utils import allowed_file, get_user_by_token, predict_output_filename, slugify
 from . import tasks
@@ -34,16 +35,47 @@ from .modal_drive_utils import (
     get_drive_username,
     filter_user_items,
     normalize_relative_path,
-    ensure_share_storage
+    get_cached_listing,
+    store_listing,
+    invalidate_listing,
+    is_user_root_known,
+    remember_user_root,
+    list_directory,
+    paginate_items
 )
 from .netmind_config import (
     DEFAULT_NETMIND_RATE_LIMIT_MAX_REQUESTS,
     DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS,
     get_rate_limit_config
 )
+from .rate_limiter import RateLimit, get_rate_limiter
+from .response_cache import response_cache, build_cache_key, is_cacheable_request, get_cache_config
+from .usage_meter import usage_meter, usage_window_start
+from .conversation_store import conversation_store, normalize_conversation_id
+from .remote_inference import remember_config_owner
+from .derivatives import attach_preview_urls, schedule_derivatives
+from .remote_api_client import get_http_session, StreamingMultipartBody, UPLOAD_READ_SIZE
+from . import share_store
+from .space_index import find_space_by_name, find_template_by_name
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Modal Drive: (connect, read) timeouts for metadata calls and for file transfers
+MODAL_DRIVE_TIMEOUT = (10, 60)
+MODAL_DRIVE_TRANSFER_TIMEOUT = (10, 600)
+# Downloads at least this large are fetched from the drive as parallel ranges
+MODAL_DRIVE_PARALLEL_THRESHOLD = 64 * 1024 * 1024
+MODAL_DRIVE_RANGE_CHUNK = 4 * 1024 * 1024
+MODAL_DRIVE_RANGE_WORKERS = 4
+MODAL_DRIVE_PROGRESS_TTL = 3600
+# Batch endpoints: items per request and concurrent drive calls
+MODAL_DRIVE_BATCH_MAX_ITEMS = 200
+MODAL_DRIVE_BATCH_WORKERS = 8
+
+# upload_id -> forwarding progress of a proxied upload
+_modal_drive_transfers = {}
+_modal_drive_transfers_lock = threading.Lock()
+
 HARDWARE_PROFILES = {
     'cpu': {
         'display_name': 'CPU (2 vCPU, 2GB)',
@@ -73,60 +105,140 @@ HARDWARE_PROFILES = {
 
 DEFAULT_HARDWARE_KEY = 'cpu'
 
-_netmind_rate_limit_history = {}
-
-def _check_netmind_rate_limit(user_identifier, max_requests, window_seconds):
+def _netmind_rate_limits(settings, username, model):
     """
-    Simple in-memory rate limiter for NetMind chat API.
-    Limits each user to max_requests per window_seconds interval.
+    Buckets a NetMind chat request counts against: the global per-user limit,
+    an optional per-user (API key) override, and an optional per-model limit.
     """
-    if not user_identifier:
-        return True, None
+    settings = settings or {}
+    limits = []
+    key_overrides = settings.get('key_rate_limits') or {}
+    user_limit = key_overrides.get(username)
+    if user_limit:
+        limits.append(RateLimit(f"netmind:user:{username}",
+                                int(user_limit.get('max_requests', 0)),
+                                int(user_limit.get('window_seconds', DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS))))
+    else:
+        max_requests, window_seconds = get_rate_limit_config(settings)
+        limits.append(RateLimit(f"netmind:user:{username}", max_requests, window_seconds))
+
+    model_overrides = {k.strip().lower(): v for k, v in (settings.get('model_rate_limits') or {}).items()}
+    model_limit = model_overrides.get((model or '').strip().lower())
+    if model_limit:
+        limits.append(RateLimit(f"netmind:model:{(model or '').strip().lower()}:{username}",
+                                int(model_limit.get('max_requests', 0)),
+                                int(model_limit.get('window_seconds', DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS))))
+    return limits
+
+
+# Sampling parameters forwarded upstream as-is; they are also part of the response cache key.
+NETMIND_SAMPLING_PARAMS = (
+    'temperature', 'top_p', 'presence_penalty', 'frequency_penalty',
+    'stop', 'seed', 'n', 'response_format', 'logit_bias'
+)
 
-    try:
-        max_requests = int(max_requests)
-    except (TypeError, ValueError):
-        max_requests = DEFAULT_NETMIND_RATE_LIMIT_MAX_REQUESTS
 
+def _get_daily_token_quota(settings, username):
+    """Per-user daily token quota (0 = unlimited); per-user overrides win over the global value."""
+    settings = settings or {}
+    overrides = settings.get('user_token_quotas') or {}
+    value = overrides.get(username, settings.get('daily_token_quota', 0))
     try:
-        window_seconds = int(window_seconds)
+        return max(0, int(value))
     except (TypeError, ValueError):
-        window_seconds = DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS
-
-    if max_requests <= 0:
-        return True, None
-
-    history = _netmind_rate_limit_history.setdefault(user_identifier, deque())
-    now = time.time()
-    window = max(1, window_seconds)
-
-    while history and now - history[0] >= window:
-        history.popleft()
+        return 0
+
+
+def _cache_stream(chunks, cache_key, ttl_seconds, max_entries):
+    """Relays SSE chunks and stores them once the stream has completed cleanly."""
+    recorded = []
+    for chunk in chunks:
+        recorded.append(chunk)
+        yield chunk
+    if recorded and recorded[-1].startswith('data: [DONE]'):
+        response_cache.set(cache_key, recorded, ttl_seconds, max_entries)
+
+
+def _strip_ad_suffix(content, ad_suffix):
+    if ad_suffix and isinstance(content, str) and content.endswith(ad_suffix):
+        return content[:-len(ad_suffix)]
+    return content
+
+
+def _remember_reply(username, conversation_id, new_messages, payload, ad_suffix):
+    """Stores the new messages and the assistant reply of a non-streaming response."""
+    choices = payload.get('choices') or []
+    if not choices:
+        return
+    reply = {k: v for k, v in (choices[0].get('message') or {}).items() if v is not None}
+    reply['role'] = reply.get('role') or 'assistant'
+    reply['content'] = _strip_ad_suffix(reply.get('content') or '', ad_suffix)
+    conversation_store.append(username, conversation_id, list(new_messages) + [reply])
+
+
+def _remember_stream(chunks, username, conversation_id, new_messages, ad_suffix):
+    """Relays SSE chunks and stores the assembled assistant reply once the stream completes."""
+    parts = []
+    completed = False
+    for chunk in chunks:
+        if chunk.startswith('data: [DONE]'):
+            completed = True
+        elif chunk.startswith('data: '):
+            try:
+                choices = json.loads(chunk[6:]).get('choices') or []
+            except ValueError:
+                choices = []
+            if choices:
+                content = (choices[0].get('delta') or {}).get('content')
+                if content:
+                    parts.append(content)
+        yield chunk
+    if completed:
+        reply = {'role': 'assistant', 'content': _strip_ad_suffix(''.join(parts), ad_suffix)}
+        conversation_store.append(username, conversation_id, list(new_messages) + [reply])
 
-    if len(history) >= max_requests:
-        retry_after = window - (now - history[0])
-        return False, max(1, int(retry_after))
 
-    history.append(now)
-    return True, None
+def _wants_no_cache(headers):
+    directives = (headers.get('Cache-Control') or '').lower()
+    return 'no-cache' in directives or 'no-store' in directives
 
 
-def _modal_drive_request(method, endpoint, **kwargs):
-    base_url, token = get_modal_drive_credentials()
+def _modal_drive_request(method, endpoint, credentials=None, **kwargs):
+    """
+    Calls the Modal Drive API over the shared connection pool.
+    Pass `credentials` (base_url, token) when calling outside a request/app context.
+    """
+    base_url, token = credentials or get_modal_drive_credentials()
     if not base_url or not token:
         return None, '无限容量网盘尚未配置'
 
     url = f"{base_url}{endpoint}"
     headers = kwargs.pop('headers', {})
     headers.setdefault('Authorization', f"Bearer {token}")
+    kwargs.setdefault('timeout', MODAL_DRIVE_TIMEOUT)
 
     try:
-        response = requests.request(method, url, headers=headers, timeout=60, **kwargs)
+        response = get_http_session().request(method, url, headers=headers, **kwargs)
         return response, None
     except requests.RequestException as exc:
         return None, str(exc)
 
 
+def _record_modal_drive_transfer(upload_id, username, sent, total, status):
+    now = time.time()
+    with _modal_drive_transfers_lock:
+        _modal_drive_transfers[upload_id] = {
+            'username': username,
+            'sent': sent,
+            'total': total,
+            'status': status,
+            'updated_at': now
+        }
+        if len(_modal_drive_transfers) > 1000:
+            for key in [k for k, v in _modal_drive_transfers.items() if now - v['updated_at'] > MODAL_DRIVE_PROGRESS_TTL]:
+                del _modal_drive_transfers[key]
+
+
 def _modal_drive_login_required():
     if not session.get('logged_in'):
         return jsonify({'success': False, 'error': '请先登录'}), 401
@@ -284,8 +396,9 @@ def relay_to_s3():
             ExtraArgs={'ContentType': file.content_type or 'audio/wav'}
         )
         
-        # 3. 生成公共URL
+        # 3. 生成公共URL，并在后台生成缩略图
         public_url = get_public_s3_url(s3_key)
+        schedule_derivatives(current_app._get_current_object(), s3_key)
         
         # 4. 立即删除临时文件（不占用VPS硬盘）
         if temp_path and os.path.exists(temp_path):
@@ -379,6 +492,10 @@ def _ensure_modal_drive_user_root():
     if not username:
         return '无法确定用户目录'
 
+    base_url, _ = get_modal_drive_credentials()
+    if is_user_root_known(base_url, username):
+        return None
+
     response, error = _modal_drive_request('post', '/api/mkdir', data={'path': username})
     if error:
         return error
@@ -391,14 +508,38 @@ def _ensure_modal_drive_user_root():
             message = response.text or '创建用户目录失败'
         return message
 
+    remember_user_root(base_url, username)
     return None
 
 
-def _find_share_by_path(shares, username, relative_path):
-    for token, info in shares.items():
-        if info.get('username') == username and info.get('relative_path') == relative_path:
-            return token, info
-    return None, None
+def _revoke_remote_shares(tokens, credentials=None):
+    """
+    Revokes share tokens on the drive concurrently.
+    Returns the tokens that are gone remotely (deleted or already unknown).
+    """
+    credentials = credentials or get_modal_drive_credentials()
+
+    def revoke(token):
+        response, error = _modal_drive_request('delete', '/api/share', credentials=credentials, json={'token': token})
+        if error:
+            return {'success': False, 'error': error}
+        return {'success': response.status_code in (200, 404)}
+
+    results = _run_modal_drive_batch(revoke, list(tokens))
+    return [token for token, result in zip(tokens, results) if result.get('success')]
+
+
+def sweep_expired_modal_drive_shares():
+    """Scheduler job: removes expired share links locally and on the drive."""
+    credentials = get_modal_drive_credentials()
+    if credentials[0] and credentials[1]:
+        removed = share_store.sweep_expired_shares(lambda tokens: _revoke_remote_shares(tokens, credentials))
+    else:
+        # No drive configured: nothing to revoke remotely
+        removed = share_store.sweep_expired_shares()
+    if removed:
+        print(f"[Shares] Swept {removed} expired Modal Drive shares.")
+    return removed
 
 
 @api_bp.route('/modal-drive/shares')
@@ -410,17 +551,11 @@ def modal_drive_list_shares():
     username = get_drive_username()
     base_url, _ = get_modal_drive_credentials()
     base_url = (base_url or '').rstrip('/')
-    db = load_db()
-    share_entries = db.get('modal_drive_shares', {})
     result = {}
-    for token, info in share_entries.items():
-        if info.get('username') != username:
-            continue
-        rel = info.get('relative_path')
-        if not rel:
-            continue
+    for info in share_store.list_user_shares(username):
+        token = info['token']
         share_url = info.get('public_url') or (f"{base_url}/share/{token}" if base_url else None)
-        result[rel] = {
+        result[info['relative_path']] = {
             'token': token,
             'url': share_url,
             'expires_at': info.get('expires_at')
@@ -456,11 +591,8 @@ def modal_drive_create_share():
     base_url, _ = get_modal_drive_credentials()
     if not base_url:
         return _modal_drive_error_response('无限容量网盘尚未配置。', 503)
-    db, shares = ensure_share_storage()
-    token, info = _find_share_by_path(shares, username, relative_path)
-    if not token:
-        token = secrets.token_urlsafe(16)
-        info = {}
+    existing = share_store.find_share_by_path(username, relative_path)
+    token, replaced_token = share_store.choose_share_token(existing)
 
     try:
         duration = int(data.get('duration') or 604800)
@@ -490,7 +622,8 @@ def modal_drive_create_share():
         message = payload.get('detail') or payload.get('error') or remote_response.text or '生成分享链接失败'
         return _modal_drive_error_response(message, remote_response.status_code)
 
-    info.update({
+    info = {
+        'token': token,
         'username': username,
         'relative_path': relative_path,
         'remote_path': remote_path,
@@ -498,9 +631,11 @@ def modal_drive_create_share():
         'created_at': time.time(),
         'public_url': f"{base_url.rstrip('/')}/share/{token}",
         'expires_at': expires_at
-    })
-    shares[token] = info
-    save_db(db)
+    }
+    share_store.save_shares([info])
+    if replaced_token:
+        # The expired link's row was replaced, so the sweeper won't revoke it anymore
+        _revoke_remote_shares([replaced_token])
 
     return jsonify({'success': True, 'token': token, 'url': info['public_url'], 'expires_at': expires_at})
 
@@ -518,11 +653,10 @@ def modal_drive_delete_share():
     token_param = (data.get('token') or '').strip()
 
     username = get_drive_username()
-    db, shares = ensure_share_storage()
 
     target_token = None
     if token_param:
-        entry = shares.get(token_param)
+        entry = share_store.get_share(token_param)
         if not entry or entry.get('username') != username:
             return _modal_drive_error_response('未找到对应的分享链接', 404)
         target_token = token_param
@@ -531,10 +665,10 @@ def modal_drive_delete_share():
             relative_path = normalize_relative_path(path)
         except ValueError as exc:
             return _modal_drive_error_response(str(exc), 400)
-        token_found, _ = _find_share_by_path(shares, username, relative_path)
-        if not token_found:
+        entry = share_store.find_share_by_path(username, relative_path)
+        if not entry:
             return _modal_drive_error_response('尚未分享该文件', 404)
-        target_token = token_found
+        target_token = entry['token']
     else:
         return _modal_drive_error_response('请提供 path 或 token 参数', 400)
 
@@ -549,8 +683,7 @@ def modal_drive_delete_share():
             message = remote_resp.text or '取消分享失败'
         return _modal_drive_error_response(message, remote_resp.status_code)
 
-    shares.pop(target_token, None)
-    save_db(db)
+    share_store.delete_shares([target_token])
     return jsonify({'success': True, 'message': '分享已取消'})
 
 
@@ -560,28 +693,45 @@ def modal_drive_all():
     if login_resp:
         return login_resp
 
-    ensure_error = _ensure_modal_drive_user_root()
-    if ensure_error:
-        return _modal_drive_error_response(ensure_error, 502)
+    username = get_drive_username()
+    items = None if request.args.get('refresh') else get_cached_listing(username)
+    if items is None:
+        ensure_error = _ensure_modal_drive_user_root()
+        if ensure_error:
+            return _modal_drive_error_response(ensure_error, 502)
 
-    response, error = _modal_drive_request('get', '/api/all')
-    if error:
-        return _modal_drive_error_response(error, 502)
+        response, error = _modal_drive_request('get', '/api/all')
+        if error:
+            return _modal_drive_error_response(error, 502)
 
-    try:
-        payload = response.json()
-    except ValueError:
-        payload = {}
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
 
-    if response.status_code != 200:
-        message = payload.get('detail') or payload.get('error') or response.text or '无限容量网盘请求失败'
-        return _modal_drive_error_response(message, response.status_code)
+        if response.status_code != 200:
+            message = payload.get('detail') or payload.get('error') or response.text or '无限容量网盘请求失败'
+            return _modal_drive_error_response(message, response.status_code)
 
-    return jsonify({
-        'success': True,
-        'items': filter_user_items(payload.get('items', [])),
-        'root': get_drive_username()
-    })
+        items = filter_user_items(payload.get('items', []))
+        store_listing(username, items)
+
+    result = {'success': True, 'root': username}
+
+    # 可选：只列出某个目录的直接子项，并分页
+    directory = request.args.get('dir')
+    if directory is not None:
+        try:
+            items = list_directory(items, directory)
+        except ValueError as exc:
+            return _modal_drive_error_response(str(exc), 400)
+        result['dir'] = normalize_relative_path(directory)
+    if directory is not None or request.args.get('page') or request.args.get('page_size'):
+        items, pagination = paginate_items(items, request.args.get('page'), request.args.get('page_size'))
+        result['pagination'] = pagination
+
+    result['items'] = items
+    return jsonify(result)
 
 
 @api_bp.route('/modal-drive/upload', methods=['POST'])
@@ -610,20 +760,30 @@ def modal_drive_upload():
     if ensure_error:
         return _modal_drive_error_response(ensure_error, 502)
 
-    files = {
-        'file': (
-            file.filename,
-            file.stream,
-            file.mimetype or 'application/octet-stream'
-        )
-    }
+    # Stream the (already spooled) upload to the drive in chunks instead of
+    # letting requests build the whole multipart body in memory.
+    username = get_drive_username()
+    upload_id = (request.form.get('upload_id') or '').strip()[:64] or None
+
+    def on_progress(sent, total):
+        if upload_id:
+            _record_modal_drive_transfer(upload_id, username, sent, total, 'uploading')
+
+    body = StreamingMultipartBody(
+        {'path': remote_path},
+        {'file': (file.filename, file.stream, file.mimetype or 'application/octet-stream')},
+        on_progress=on_progress
+    )
     response, error = _modal_drive_request(
         'post',
         '/api/upload',
-        data={'path': remote_path},
-        files=files
+        data=body,
+        headers={'Content-Type': body.content_type},
+        timeout=MODAL_DRIVE_TRANSFER_TIMEOUT
     )
     if error:
+        if upload_id:
+            _record_modal_drive_transfer(upload_id, username, 0, len(body), 'failed')
         return _modal_drive_error_response(error, 502)
 
     try:
@@ -632,13 +792,420 @@ def modal_drive_upload():
         payload = {}
 
     if response.status_code != 200:
+        if upload_id:
+            _record_modal_drive_transfer(upload_id, username, 0, len(body), 'failed')
         message = payload.get('detail') or payload.get('error') or response.text or '上传失败'
         return _modal_drive_error_response(message, response.status_code)
 
+    if upload_id:
+        _record_modal_drive_transfer(upload_id, username, len(body), len(body), 'completed')
+
+    invalidate_listing(get_drive_username())
     message = payload.get('message') or '上传成功'
     return jsonify({'success': True, 'message': message})
 
 
+@api_bp.route('/modal-drive/upload/progress/<upload_id>')
+def modal_drive_upload_progress(upload_id):
+    login_resp = _modal_drive_login_required()
+    if login_resp:
+        return login_resp
+
+    progress = _modal_drive_transfers.get(upload_id)
+    if not progress or progress['username'] != get_drive_username():
+        return _modal_drive_error_response('未找到上传任务', 404)
+    return jsonify({
+        'success': True,
+        'status': progress['status'],
+        'sent': progress['sent'],
+        'total': progress['total']
+    })
+
+
+_MODAL_DRIVE_PASSTHROUGH_HEADERS = (
+    'Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges',
+    'Content-Disposition', 'ETag', 'Last-Modified'
+)
+
+
+def _proxy_modal_drive_stream(response):
+    """Relays a streamed drive response (200 or 206) to the client chunk by chunk."""
+    def generate():
+        try:
+            for chunk in response.iter_content(chunk_size=UPLOAD_READ_SIZE):
+                if chunk:
+                    yield chunk
+        finally:
+            response.close()
+
+    headers = {k: response.headers[k] for k in _MODAL_DRIVE_PASSTHROUGH_HEADERS if k in response.headers}
+    return Response(stream_with_context(generate()), status=response.status_code, headers=headers)
+
+
+def _fetch_modal_drive_range(credentials, remote_path, start, end):
+    response, error = _modal_drive_request(
+        'get', '/api/download', credentials=credentials,
+        params={'path': remote_path},
+        headers={'Range': f'bytes={start}-{end}'},
+        timeout=MODAL_DRIVE_TRANSFER_TIMEOUT
+    )
+    if error:
+        raise IOError(error)
+    if response.status_code != 206 or len(response.content) != end - start + 1:
+        raise IOError(f'range {start}-{end} failed with HTTP {response.status_code}')
+    return response.content
+
+
+def _parallel_modal_drive_download(credentials, remote_path, total, headers):
+    """
+    Streams a large file by fetching MODAL_DRIVE_RANGE_CHUNK ranges from the
+    drive on a small pool and yielding them in order; at most one chunk per
+    worker is buffered ahead of the client.
+    """
+    ranges = iter(
+        (start, min(start + MODAL_DRIVE_RANGE_CHUNK, total) - 1)
+        for start in range(0, total, MODAL_DRIVE_RANGE_CHUNK)
+    )
+
+    def generate():
+        pool = ThreadPoolExecutor(max_workers=MODAL_DRIVE_RANGE_WORKERS)
+        pending = deque()
+        try:
+            for start, end in itertools.islice(ranges, MODAL_DRIVE_RANGE_WORKERS):
+                pending.append(pool.submit(_fetch_modal_drive_range, credentials, remote_path, start, end))
+            while pending:
+                data = pending.popleft().result()
+                following = next(ranges, None)
+                if following:
+                    pending.append(pool.submit(_fetch_modal_drive_range, credentials, remote_path, *following))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    headers = dict(headers, **{'Content-Length': str(total), 'Accept-Ranges': 'bytes'})
+    return Response(stream_with_context(generate()), status=200, headers=headers)
+
+
+@api_bp.route('/modal-drive/download')
+def modal_drive_download():
+    """
+    Streams a drive file through this server (for clients that cannot use a
+    direct/share link). Range requests are forwarded as is; large full
+    downloads are fetched from the drive as parallel ranges.
+    """
+    login_resp = _modal_drive_login_required()
+    if login_resp:
+        return login_resp
+
+    path = (request.args.get('path') or '').strip()
+    if not path:
+        return _modal_drive_error_response('缺少 path 参数', 400)
+
+    try:
+        remote_path = build_user_full_path(path)
+    except ValueError as exc:
+        return _modal_drive_error_response(str(exc), 400)
+
+    credentials = get_modal_drive_credentials()
+    range_header = request.headers.get('Range')
+    # Without a client Range, ask for the first byte: a 206 tells us the
+    # size and that the drive supports ranges; a 200 is simply relayed.
+    response, error = _modal_drive_request(
+        'get', '/api/download', credentials=credentials,
+        params={'path': remote_path},
+        headers={'Range': range_header or 'bytes=0-0'},
+        stream=True,
+        timeout=MODAL_DRIVE_TRANSFER_TIMEOUT
+    )
+    if error:
+        return _modal_drive_error_response(error, 502)
+
+    if response.status_code not in (200, 206):
+        try:
+            payload = response.json()
+            message = payload.get('detail') or payload.get('error') or '下载失败'
+        except ValueError:
+            message = response.text or '下载失败'
+        finally:
+            response.close()
+        return _modal_drive_error_response(message, response.status_code)
+
+    if range_header or response.status_code == 200:
+        return _proxy_modal_drive_stream(response)
+
+    content_range = response.headers.get('Content-Range', '')
+    response.close()
+    try:
+        total = int(content_range.rsplit('/', 1)[1])
+    except (IndexError, ValueError):
+        total = None
+
+    passthrough = {
+        k: response.headers[k] for k in ('Content-Type', 'Content-Disposition', 'ETag', 'Last-Modified')
+        if k in response.headers
+    }
+    if total is not None and total >= MODAL_DRIVE_PARALLEL_THRESHOLD:
+        return _parallel_modal_drive_download(credentials, remote_path, total, passthrough)
+
+    response, error = _modal_drive_request(
+        'get', '/api/download', credentials=credentials,
+        params={'path': remote_path},
+        stream=True,
+        timeout=MODAL_DRIVE_TRANSFER_TIMEOUT
+    )
+    if error:
+        return _modal_drive_error_response(error, 502)
+    if response.status_code != 200:
+        response.close()
+        return _modal_drive_error_response('下载失败', response.status_code)
+    return _proxy_modal_drive_stream(response)
+
+
+def _modal_drive_remote_error(response, default):
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    return payload.get('detail') or payload.get('error') or response.text or default
+
+
+def _run_modal_drive_batch(func, items):
+    """
+    Runs func(item) -> result dict for every item on a bounded pool.
+    Results keep the order of `items`; an exception becomes a failed result.
+    """
+    def run(item):
+        try:
+            return func(item)
+        except Exception as exc:
+            return {'success': False, 'error': str(exc)}
+
+    with ThreadPoolExecutor(max_workers=min(MODAL_DRIVE_BATCH_WORKERS, max(1, len(items)))) as pool:
+        return list(pool.map(run, items))
+
+
+def _modal_drive_batch_items(data, key):
+    items = data.get(key)
+    if not isinstance(items, list) or not items:
+        return None, _modal_drive_error_response(f'请提供 {key} 列表', 400)
+    if len(items) > MODAL_DRIVE_BATCH_MAX_ITEMS:
+        return None, _modal_drive_error_response(f'单次最多处理 {MODAL_DRIVE_BATCH_MAX_ITEMS} 项', 400)
+    return items, None
+
+
+def _batch_response(results):
+    succeeded = sum(1 for r in results if r.get('success'))
+    return jsonify({
+        'success': succeeded == len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    })
+
+
+@api_bp.route('/modal-drive/batch/delete', methods=['POST'])
+def modal_drive_batch_delete():
+    login_resp = _modal_drive_login_required()
+    if login_resp:
+        return login_resp
+
+    data = request.get_json(silent=True) or {}
+    paths, error_resp = _modal_drive_batch_items(data, 'paths')
+    if error_resp:
+        return error_resp
+
+    ensure_error = _ensure_modal_drive_user_root()
+    if ensure_error:
+        return _modal_drive_error_response(ensure_error, 502)
+
+    credentials = get_modal_drive_credentials()
+    targets = []
+    for path in paths:
+        try:
+            relative_path = normalize_relative_path(str(path or ''))
+            if not relative_path:
+                raise ValueError('无效的路径')
+            targets.append({'path': path, 'remote_path': build_user_full_path(relative_path)})
+        except ValueError as exc:
+            targets.append({'path': path, 'error': str(exc)})
+
+    def delete_one(target):
+        if 'error' in target:
+            return {'path': target['path'], 'success': False, 'error': target['error']}
+        response, error = _modal_drive_request(
+            'delete', '/api/delete', credentials=credentials, params={'path': target['remote_path']}
+        )
+        if error:
+            return {'path': target['path'], 'success': False, 'error': error}
+        if response.status_code != 200:
+            return {'path': target['path'], 'success': False, 'error': _modal_drive_remote_error(response, '删除失败')}
+        return {'path': target['path'], 'success': True}
+
+    results = _run_modal_drive_batch(delete_one, targets)
+    invalidate_listing(get_drive_username())
+    return _batch_response(results)
+
+
+@api_bp.route('/modal-drive/batch/move', methods=['POST'])
+def modal_drive_batch_move():
+    login_resp = _modal_drive_login_required()
+    if login_resp:
+        return login_resp
+
+    data = request.get_json(silent=True) or {}
+    moves, error_resp = _modal_drive_batch_items(data, 'moves')
+    if error_resp:
+        return error_resp
+
+    ensure_error = _ensure_modal_drive_user_root()
+    if ensure_error:
+        return _modal_drive_error_response(ensure_error, 502)
+
+    credentials = get_modal_drive_credentials()
+    targets = []
+    for move in moves:
+        move = move if isinstance(move, dict) else {}
+        path = str(move.get('path') or '').strip()
+        new_path = str(move.get('new_path') or '').strip()
+        try:
+            if not path or not new_path:
+                raise ValueError('请输入原路径和新路径')
+            targets.append({
+                'path': path,
+                'new_path': new_path,
+                'remote_src': build_user_full_path(path),
+                'remote_dst': build_user_full_path(new_path)
+            })
+        except ValueError as exc:
+            targets.append({'path': path, 'new_path': new_path, 'error': str(exc)})
+
+    def move_one(target):
+        result = {'path': target['path'], 'new_path': target['new_path']}
+        if 'error' in target:
+            return dict(result, success=False, error=target['error'])
+        response, error = _modal_drive_request(
+            'post', '/api/rename', credentials=credentials,
+            data={'path': target['remote_src'], 'new_path': target['remote_dst']}
+        )
+        if error:
+            return dict(result, success=False, error=error)
+        if response.status_code != 200:
+            return dict(result, success=False, error=_modal_drive_remote_error(response, '重命名失败'))
+        return dict(result, success=True)
+
+    results = _run_modal_drive_batch(move_one, targets)
+    invalidate_listing(get_drive_username())
+    return _batch_response(results)
+
+
+@api_bp.route('/modal-drive/batch/share', methods=['POST'])
+def modal_drive_batch_share():
+    login_resp = _modal_drive_login_required()
+    if login_resp:
+        return login_resp
+
+    data = request.get_json(silent=True) or {}
+    paths, error_resp = _modal_drive_batch_items(data, 'paths')
+    if error_resp:
+        return error_resp
+
+    try:
+        duration = int(data.get('duration') or 604800)
+    except (TypeError, ValueError):
+        return _modal_drive_error_response('无效的有效期参数', 400)
+    if duration < 60 or duration > 60 * 60 * 24 * 365:
+        return _modal_drive_error_response('有效期需在 1 分钟至 365 天之间', 400)
+
+    credentials = get_modal_drive_credentials()
+    base_url = credentials[0]
+    if not base_url:
+        return _modal_drive_error_response('无限容量网盘尚未配置。', 503)
+
+    username = get_drive_username()
+    expires_at = int(time.time()) + duration
+    targets = []
+    seen = set()
+    for path in paths:
+        try:
+            relative_path = normalize_relative_path(str(path or ''))
+            if not relative_path:
+                raise ValueError('无效的路径')
+            if relative_path in seen:
+                raise ValueError('重复的路径')
+            seen.add(relative_path)
+            targets.append({
+                'path': path,
+                'relative_path': relative_path,
+                'remote_path': build_user_full_path(relative_path)
+            })
+        except ValueError as exc:
+            targets.append({'path': path, 'error': str(exc)})
+
+    existing = share_store.find_shares_by_paths(username, seen)
+    for target in targets:
+        if 'error' not in target:
+            target['token'], target['replaced_token'] = share_store.choose_share_token(
+                existing.get(target['relative_path'])
+            )
+
+    def share_one(target):
+        if 'error' in target:
+            return {'path': target['path'], 'success': False, 'error': target['error']}
+        filename = target['relative_path'].split('/')[-1] or 'shared-file'
+        response, error = _modal_drive_request(
+            'post', '/api/share', credentials=credentials,
+            json={'token': target['token'], 'path': target['remote_path'], 'filename': filename, 'expires_at': expires_at}
+        )
+        if error:
+            return {'path': target['path'], 'success': False, 'error': error}
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        if response.status_code != 200 or not payload.get('ok', False):
+            return {'path': target['path'], 'success': False, 'error': _modal_drive_remote_error(response, '生成分享链接失败')}
+        return {
+            'path': target['path'],
+            'success': True,
+            'token': target['token'],
+            'url': f"{base_url.rstrip('/')}/share/{target['token']}",
+            'expires_at': expires_at,
+            '_target': target,
+            '_filename': filename
+        }
+
+    results = _run_modal_drive_batch(share_one, targets)
+
+    # Persist every created share in a single transaction
+    now = time.time()
+    records = []
+    replaced_tokens = []
+    for result in results:
+        target = result.pop('_target', None)
+        filename = result.pop('_filename', None)
+        if not target:
+            continue
+        if target['replaced_token']:
+            replaced_tokens.append(target['replaced_token'])
+        records.append({
+            'token': target['token'],
+            'username': username,
+            'relative_path': target['relative_path'],
+            'remote_path': target['remote_path'],
+            'filename': filename,
+            'created_at': now,
+            'public_url': result['url'],
+            'expires_at': expires_at
+        })
+    share_store.save_shares(records)
+    if replaced_tokens:
+        _revoke_remote_shares(replaced_tokens, credentials)
+
+    return _batch_response(results)
+
+
 @api_bp.route('/modal-drive/mkdir', methods=['POST'])
 def modal_drive_mkdir():
     login_resp = _modal_drive_login_required()
@@ -672,6 +1239,7 @@ def modal_drive_mkdir():
         message = payload.get('detail') or payload.get('error') or response.text or '创建失败'
         return _modal_drive_error_response(message, response.status_code)
 
+    invalidate_listing(get_drive_username())
     return jsonify({'success': True, 'message': '已创建文件夹'})
 
 
@@ -710,6 +1278,7 @@ def modal_drive_rename():
         message = payload.get('detail') or payload.get('error') or response.text or '重命名失败'
         return _modal_drive_error_response(message, response.status_code)
 
+    invalidate_listing(get_drive_username())
     return jsonify({'success': True, 'message': '已重命名/移动'})
 
 
@@ -745,6 +1314,7 @@ def modal_drive_delete():
         message = payload.get('detail') or payload.get('error') or response.text or '删除失败'
         return _modal_drive_error_response(message, response.status_code)
 
+    invalidate_listing(get_drive_username())
     return jsonify({'success': True, 'message': '已删除'})
 
 
@@ -780,10 +1350,7 @@ def list_my_s3_files():
 
             file['is_image'] = is_image(file['filename'])
             file['is_video'] = is_video(file['filename'])
-            if file['is_image'] or file['is_video']:
-                file['preview_url'] = get_public_s3_url(file['key'])
-            else:
-                file['preview_url'] = None
+        attach_preview_urls(current_app._get_current_object(), username, files)
 
         return jsonify({'success': True, 'files': files})
     else:
@@ -1036,6 +1603,7 @@ def admin_add_custom_gpu_config(username):
     }
     user.setdefault('remote_inference_configs', []).append(config)
     save_db(db)
+    remember_config_owner(config['id'], username)
 
     return jsonify({'success': True, 'config': config})
 
@@ -1301,18 +1869,16 @@ def run_space_api():
     if not all([space_name, template_name]):
         return jsonify({'error': 'Missing required parameters: space_name, gpu_template'}), 400
 
-    space = next((s for s in db.get('spaces', {}).values() if s['name'] == space_name), None)
+    space = find_space_by_name(db, space_name)
     if not space:
         return jsonify({'error': f'Space "{space_name}" not found'}), 404
 
     ai_project_id = space['id']
 
-    template = next((t for t in space.get('templates', {}).values() if t['name'] == template_name), None)
+    template_id, template = find_template_by_name(db, space, template_name)
     if not template:
         return jsonify({'error': f'Template "{template_name}" not found in space "{space_name}"'}), 404
 
-    template_id = next((k for k, v in space.get('templates', {}).items() if v['name'] == template_name), None)
-
     user_api_key = user.get('api_key')
     if not user_api_key:
         return jsonify({'error': 'User API key is missing'}), 500
@@ -1455,24 +2021,38 @@ def netmind_chat_completions():
         return jsonify({'error': 'Invalid token'}), 403
 
     db = load_db()
-    max_requests, window_seconds = get_rate_limit_config(db.get('netmind_settings'))
-    allowed, retry_after = _check_netmind_rate_limit(user['username'], max_requests, window_seconds)
-    if not allowed:
-        per_minute = max_requests
-        if window_seconds and window_seconds != 60 and max_requests > 0:
-            per_minute = max(1, int(max_requests * 60 / window_seconds))
-        return jsonify({
-            'error': 'Rate limit exceeded. Please wait before sending more requests.',
-            'retry_after_seconds': retry_after,
-            'limit_per_window': max_requests,
-            'window_seconds': window_seconds,
-            'limit_per_minute': per_minute
-        }), 429
 
     data = request.get_json()
     if not data:
         return jsonify({'error': 'Missing request body'}), 400
 
+    daily_quota = _get_daily_token_quota(db.get('netmind_settings'), user['username'])
+    if daily_quota:
+        used = usage_meter.tokens_used_today(user['username'])
+        if used >= daily_quota:
+            return jsonify({
+                'error': 'Daily token quota exceeded.',
+                'daily_token_quota': daily_quota,
+                'tokens_used_today': used
+            }), 429
+
+    limits = _netmind_rate_limits(db.get('netmind_settings'), user['username'], data.get('model'))
+    rate_limit = get_rate_limiter(current_app).hit(limits)
+    rate_limit_headers = rate_limit.headers() if rate_limit else {}
+    if rate_limit and not rate_limit.allowed:
+        max_requests, window_seconds = rate_limit.limit, rate_limit.window_seconds
+        per_minute = max(1, int(max_requests * 60 / window_seconds)) if window_seconds != 60 else max_requests
+        resp = jsonify({
+            'error': 'Rate limit exceeded. Please wait before sending more requests.',
+            'retry_after_seconds': int(rate_limit_headers['Retry-After']),
+            'limit_per_window': max_requests,
+            'window_seconds': window_seconds,
+            'limit_per_minute': per_minute
+        })
+        resp.status_code = 429
+        resp.headers.update(rate_limit_headers)
+        return resp
+
     messages = data.get('messages')
     model = data.get('model')
     stream = data.get('stream', False)
@@ -1493,7 +2073,14 @@ def netmind_chat_completions():
     if not messages or not model:
         return jsonify({'error': 'Missing required parameters: messages, model'}), 400
 
-    # Security/Rate Limiting could go here
+    # Conversation-state mode: the client sends only the new messages and the
+    # proxy prepends the history it stored for this conversation_id.
+    conversation_id = normalize_conversation_id(data.get('conversation_id'))
+    new_messages = messages
+    if conversation_id:
+        if not isinstance(messages, list):
+            return jsonify({'error': 'messages must be a list'}), 400
+        messages = conversation_store.history(user['username'], conversation_id) + messages
 
     extra_params = {}
     if functions is not None:
@@ -1504,11 +2091,53 @@ def netmind_chat_completions():
         extra_params['tools'] = tools
     if tool_choice is not None:
         extra_params['tool_choice'] = tool_choice
+    for name in NETMIND_SAMPLING_PARAMS:
+        if data.get(name) is not None:
+            extra_params[name] = data[name]
+    if stream and isinstance(data.get('stream_options'), dict):
+        extra_params['stream_options'] = data['stream_options']
     if not extra_params:
         extra_params = None
 
     client = NetMindClient()
 
+    # Deterministic requests can be served from the response cache (opt-in by
+    # the admin; callers can bypass it with Cache-Control: no-cache).
+    cache_key = None
+    settings = db.get('netmind_settings') or {}
+    ad_suffix = settings.get('ad_suffix', '') if settings.get('ad_enabled') else ''
+    cache_enabled, cache_ttl, cache_max_entries = get_cache_config(settings)
+    if cache_enabled and is_cacheable_request(extra_params or {}) and not _wants_no_cache(request.headers):
+        cache_key = build_cache_key(
+            client.resolve_model_name(db, model),
+            messages,
+            {
+                'public_model': model,
+                'stream': bool(stream),
+                'max_tokens': max_tokens,
+                'params': extra_params,
+                'ad': [settings.get('ad_enabled', False), settings.get('ad_suffix', '')],
+            }
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            if stream:
+                chunks = iter(cached)
+                if conversation_id:
+                    chunks = _remember_stream(chunks, user['username'], conversation_id, new_messages, ad_suffix)
+                resp = Response(chunks, mimetype='text/event-stream')
+                resp.headers['Cache-Control'] = 'no-cache, no-transform'
+                resp.headers['X-Accel-Buffering'] = 'no'
+            else:
+                if conversation_id:
+                    _remember_reply(user['username'], conversation_id, new_messages, cached, ad_suffix)
+                resp = jsonify(cached)
+            resp.headers['X-Cache'] = 'HIT'
+            if conversation_id:
+                resp.headers['X-Conversation-Id'] = conversation_id
+            resp.headers.update(rate_limit_headers)
+            return resp
+
     try:
         response = client.chat_completion(
             db,
@@ -1516,10 +2145,15 @@ def netmind_chat_completions():
             model,
             stream=stream,
             max_tokens=max_tokens,
-            extra_params=extra_params
+            extra_params=extra_params,
+            usage_callback=lambda api_key, usage: usage_meter.record(user['username'], model, api_key, usage)
         )
 
         if stream:
+            if cache_key:
+                response = _cache_stream(response, cache_key, cache_ttl, cache_max_entries)
+            if conversation_id:
+                response = _remember_stream(response, user['username'], conversation_id, new_messages, ad_suffix)
             resp = Response(
                 stream_with_context(response),
                 mimetype='text/event-stream'
@@ -1527,11 +2161,25 @@ def netmind_chat_completions():
             resp.headers['Cache-Control'] = 'no-cache, no-transform'
             resp.headers['Connection'] = 'keep-alive'
             resp.headers['X-Accel-Buffering'] = 'no'
+            resp.headers.update(rate_limit_headers)
+            if cache_key:
+                resp.headers['X-Cache'] = 'MISS'
+            if conversation_id:
+                resp.headers['X-Conversation-Id'] = conversation_id
             return resp
         else:
             # For sync response, OpenAI object needs to be serialized to JSON
             # response is a ChatCompletion object from openai library
-            return jsonify(json.loads(response.model_dump_json()))
+            payload = json.loads(response.model_dump_json())
+            resp = jsonify(payload)
+            resp.headers.update(rate_limit_headers)
+            if cache_key:
+                response_cache.set(cache_key, payload, cache_ttl, cache_max_entries)
+                resp.headers['X-Cache'] = 'MISS'
+            if conversation_id:
+                _remember_reply(user['username'], conversation_id, new_messages, payload, ad_suffix)
+                resp.headers['X-Conversation-Id'] = conversation_id
+            return resp
 
     except Exception as e:
         import traceback
@@ -1540,3 +2188,56 @@ def netmind_chat_completions():
         if hasattr(e, 'status_code') and e.status_code:
             return jsonify({'error': str(e)}), e.status_code
         return jsonify({'error': str(e)}), 500
+
+
+@api_bp.route('/v1/conversations/<conversation_id>', methods=['DELETE'])
+def netmind_delete_conversation(conversation_id):
+    """Forgets the server-side history of a conversation started with conversation_id."""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer ') or not auth_header[7:]:
+        return jsonify({'error': 'Missing or invalid Authorization header'}), 401
+
+    user = get_user_by_token(auth_header[7:])
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 403
+
+    deleted = conversation_store.delete(user['username'], conversation_id)
+    return jsonify({'success': True, 'deleted': deleted})
+
+
+@api_bp.route('/v1/usage', methods=['GET'])
+def netmind_usage():
+    """
+    Token usage of the calling user through /api/v1/chat/completions.
+    Authenticated via PumpkinAI User Bearer Token. ?days=N (default 7, max 90).
+    """
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer ') or not auth_header[7:]:
+        return jsonify({'error': 'Missing or invalid Authorization header'}), 401
+
+    user = get_user_by_token(auth_header[7:])
+    if not user:
+        return jsonify({'error': 'Invalid token'}), 403
+
+    try:
+        days = min(90, max(1, int(request.args.get('days', 7))))
+    except (TypeError, ValueError):
+        days = 7
+
+    db = load_db()
+    username = user['username']
+    since = usage_window_start(days)
+    daily_quota = _get_daily_token_quota(db.get('netmind_settings'), username)
+    used_today = usage_meter.tokens_used_today(username)
+    return jsonify({
+        'username': username,
+        'days': days,
+        'totals': (usage_meter.summarize(since, ('username',), username=username) or [{}])[0],
+        'by_day': sorted(usage_meter.summarize(since, ('day',), username=username), key=lambda item: item['day']),
+        'by_model': usage_meter.summarize(since, ('model',), username=username),
+        'quota': {
+            'daily_token_quota': daily_quota,
+            'tokens_used_today': used_today,
+            'tokens_remaining_today': max(0, daily_quota - used_today) if daily_quota else None
+        }
+    })
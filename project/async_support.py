@@ -0,0 +1,76 @@
+"""
+Helpers for running the app on a cooperative (green thread) event loop.
+
+With SOCKETIO_ASYNC_MODE set to 'eventlet' or 'gevent', every WebSocket
+connection becomes a green thread instead of an OS thread. Socket I/O done by
+requests, boto3 and openai turns cooperative once the stdlib is monkey
+patched, but C-level blocking calls (sqlite3, large json parsing) still stall
+the whole hub, so they are pushed to the native thread pool via offload().
+"""
+import os
+
+SUPPORTED_ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+_active_mode = None
+
+
+def get_configured_async_mode():
+    """
+    Returns the async mode requested through the SOCKETIO_ASYNC_MODE environment
+    variable: 'threading' (Werkzeug dev server), 'eventlet' or 'gevent'. run.py
+    reads the same variable before importing the app, to monkey patch first;
+    app.config['SOCKETIO_ASYNC_MODE'] is set from get_active_async_mode().
+    """
+    mode = (os.environ.get('SOCKETIO_ASYNC_MODE') or 'threading').strip().lower()
+    if mode not in SUPPORTED_ASYNC_MODES:
+        return 'threading'
+    return mode
+
+
+def get_active_async_mode():
+    """
+    Returns the async mode the process is actually running with.
+    Falls back to 'threading' when a green mode is configured but the stdlib
+    was never patched (e.g. `flask run`), since green servers misbehave then.
+    """
+    global _active_mode
+    if _active_mode is not None:
+        return _active_mode
+
+    mode = get_configured_async_mode()
+    patched = False
+    if mode == 'eventlet':
+        try:
+            from eventlet import patcher
+            patched = patcher.is_monkey_patched('socket')
+        except ImportError:
+            patched = False
+    elif mode == 'gevent':
+        try:
+            from gevent import monkey
+            patched = monkey.is_module_patched('socket')
+        except ImportError:
+            patched = False
+
+    if mode != 'threading' and not patched:
+        print(f"[Async] SOCKETIO_ASYNC_MODE={mode} requested but the stdlib is not patched; using threading.")
+        mode = 'threading'
+
+    _active_mode = mode
+    return _active_mode
+
+
+def offload(func, *args, **kwargs):
+    """
+    Runs a blocking call without stalling the event loop.
+    Under eventlet/gevent the call executes in a native worker thread;
+    in threading mode it simply runs inline.
+    """
+    mode = get_active_async_mode()
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    if mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
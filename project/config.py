@@ -19,6 +19,16 @@ DB_FILE = 'database.sqlite' # 使用SQLite数据库文件
 # Flask's default is 'static', so we specify a more nested path.
 COVER_FOLDER = os.path.join('static', 'covers')
 
+# --- API Rate Limiting ---
+# 'sqlite' (shared by all processes on this host, survives restarts),
+# 'redis' (shared across hosts, needs the `redis` package) or 'memory'.
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite')
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_DB_FILE = 'rate_limits.sqlite'
+
+# remote_inference 异步任务的后台线程数
+REMOTE_INFERENCE_JOB_WORKERS = int(os.environ.get('REMOTE_INFERENCE_JOB_WORKERS', '8'))
+
 # --- Other Configurations ---
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'avi', 'zip', 'rar'}
 
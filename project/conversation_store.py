@@ -0,0 +1,77 @@
+"""
+Server-side conversation history for /api/v1/chat/completions.
+
+Clients that pass a `conversation_id` only need to send the new messages;
+the proxy prepends the stored history and appends the assistant reply once
+the response has been produced. Storage is an in-process LRU bounded by the
+number of conversations, the number of messages per conversation and an
+idle TTL, so it is a payload optimisation, not durable chat storage.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+MAX_CONVERSATIONS = 5000
+MAX_MESSAGES_PER_CONVERSATION = 100
+CONVERSATION_TTL_SECONDS = 6 * 3600
+MAX_CONVERSATION_ID_LENGTH = 128
+
+
+class ConversationStore:
+    def __init__(self, max_conversations=MAX_CONVERSATIONS, max_messages=MAX_MESSAGES_PER_CONVERSATION,
+                 ttl_seconds=CONVERSATION_TTL_SECONDS):
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self.ttl_seconds = ttl_seconds
+
+    def history(self, username, conversation_id):
+        """Stored messages for the conversation (a copy), or [] if unknown/expired."""
+        key = (username, conversation_id)
+        now = time.time()
+        with self._lock:
+            entry = self._conversations.get(key)
+            if entry is None:
+                return []
+            if now - entry['updated_at'] > self.ttl_seconds:
+                del self._conversations[key]
+                return []
+            self._conversations.move_to_end(key)
+            return list(entry['messages'])
+
+    def append(self, username, conversation_id, messages):
+        """Appends messages, trimming the oldest non-system messages past the per-conversation cap."""
+        key = (username, conversation_id)
+        with self._lock:
+            entry = self._conversations.get(key)
+            if entry is None:
+                entry = {'messages': [], 'updated_at': 0}
+                self._conversations[key] = entry
+            entry['messages'].extend(messages)
+            overflow = len(entry['messages']) - self.max_messages
+            if overflow > 0:
+                system = [m for m in entry['messages'] if m.get('role') == 'system']
+                rest = [m for m in entry['messages'] if m.get('role') != 'system']
+                entry['messages'] = system + rest[overflow:]
+            entry['updated_at'] = time.time()
+            self._conversations.move_to_end(key)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def delete(self, username, conversation_id):
+        with self._lock:
+            return self._conversations.pop((username, conversation_id), None) is not None
+
+
+conversation_store = ConversationStore()
+
+
+def normalize_conversation_id(value):
+    """Returns a usable conversation id or None."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if not value or len(value) > MAX_CONVERSATION_ID_LENGTH:
+        return None
+    return value
@@ -4,6 +4,7 @@ import uuid
 import sqlite3
 from datetime import datetime
 from flask import current_app
+from .async_support import offload
 from .netmind_config import (
     DEFAULT_NETMIND_RATE_LIMIT_MAX_REQUESTS,
     DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS,
@@ -15,44 +16,58 @@ def get_db_path():
     """Constructs the full path to the SQLite database file within the instance folder."""
     return os.path.join(current_app.instance_path, current_app.config['DB_FILE'])
 
-def get_db_connection():
+def get_db_connection(db_path=None):
     """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(get_db_path())
+    conn = sqlite3.connect(db_path or get_db_path())
     conn.row_factory = sqlite3.Row # This allows accessing columns by name
     return conn
 
+def _ensure_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS app_data (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """)
+    conn.commit()
+
 def init_db_schema():
     """Initializes the database schema if it doesn't exist."""
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS app_data (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            );
-        """)
-        conn.commit()
+        _ensure_schema(conn)
 
-def load_db():
-    """Loads the entire application data from the SQLite database."""
-    init_db_schema() # Ensure table exists
-    with get_db_connection() as conn:
+def _read_main_db(db_path):
+    with get_db_connection(db_path) as conn:
+        _ensure_schema(conn)
         cursor = conn.cursor()
         cursor.execute("SELECT value FROM app_data WHERE key = 'main_db';")
         row = cursor.fetchone()
         if row:
             return json.loads(row['value'])
-    return get_default_db_structure()
+    return None
 
-def save_db(data):
-    """Saves the entire application data to the SQLite database."""
-    init_db_schema() # Ensure table exists
+def _write_main_db(db_path, data):
     db_json = json.dumps(data, indent=4, ensure_ascii=False)
-    with get_db_connection() as conn:
+    with get_db_connection(db_path) as conn:
+        _ensure_schema(conn)
         cursor = conn.cursor()
         cursor.execute("INSERT OR REPLACE INTO app_data (key, value) VALUES (?, ?);", ('main_db', db_json))
         conn.commit()
 
+def load_db():
+    """Loads the entire application data from the SQLite database."""
+    # sqlite3 and json parsing block the event loop in eventlet/gevent mode,
+    # so the work runs in a native thread there.
+    data = offload(_read_main_db, get_db_path())
+    if data is not None:
+        return data
+    return get_default_db_structure()
+
+def save_db(data):
+    """Saves the entire application data to the SQLite database."""
+    offload(_write_main_db, get_db_path(), data)
+
 def get_default_db_structure():
     """Returns the default structure for a new database."""
     return {
@@ -261,6 +276,10 @@ def init_db():
             fallback=DEFAULT_NETMIND_RATE_LIMIT_MAX_REQUESTS
         )
 
+    # Modal Drive shares moved from the JSON blob to their own indexed table
+    from .share_store import migrate_json_shares
+    migrate_json_shares(db)
+
     save_db(db)
 
 def backup_db():
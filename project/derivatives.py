@@ -0,0 +1,172 @@
+"""
+Thumbnails and video posters for results stored in S3.
+
+When a result lands in S3 (tasks.py, /api/relay-to-s3, WebSocket uploads)
+a background job downloads it, renders a small WebP preview (Pillow for
+images, an ffmpeg frame grab for videos) and stores it under
+DERIVATIVES_PREFIX + <original key> + '.webp'. Listings use the derivative
+as preview_url when it exists, and queue a few missing ones per listing so
+older results are backfilled gradually.
+
+Pillow and the ffmpeg binary are optional; without them the corresponding
+previews fall back to the original object.
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from .s3_utils import download_s3_object, upload_file_to_s3, list_keys_with_prefix, get_public_s3_url
+
+DERIVATIVES_PREFIX = '_derivatives/'
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 75
+POSTER_SEEK_SECONDS = 1
+FFMPEG_TIMEOUT = 60
+DERIVATIVE_WORKERS = 2
+# Missing derivatives queued per listing request
+BACKFILL_PER_LISTING = 20
+# A key whose derivative failed is not retried for this long
+FAILED_RETRY_SECONDS = 3600
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm', 'm4v', 'mpg', 'mpeg'}
+
+_executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix='derivatives')
+_pending = set()
+_failed = {}
+_state_lock = threading.Lock()
+
+
+def derivative_key(object_key):
+    return f"{DERIVATIVES_PREFIX}{object_key}.webp"
+
+
+def _media_kind(object_key):
+    ext = object_key.rsplit('.', 1)[-1].lower() if '.' in object_key else ''
+    if ext in IMAGE_EXTENSIONS:
+        return 'image'
+    if ext in VIDEO_EXTENSIONS:
+        return 'video'
+    return None
+
+
+def _render_thumbnail(src_path, out_path):
+    try:
+        from PIL import Image
+    except ImportError:
+        print("[Derivatives] Pillow is not installed; skipping image thumbnail.")
+        return False
+    with Image.open(src_path) as image:
+        image.seek(0)  # first frame of animated images
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        image.save(out_path, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+    return True
+
+
+def _render_poster(src_path, out_path):
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        print("[Derivatives] ffmpeg not found; skipping video poster.")
+        return False
+    width, height = THUMBNAIL_SIZE
+    cmd = [
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-ss', str(POSTER_SEEK_SECONDS), '-i', src_path,
+        '-frames:v', '1',
+        '-vf', f"scale='min({width},iw)':'min({height},ih)':force_original_aspect_ratio=decrease",
+        '-c:v', 'libwebp', '-quality', str(THUMBNAIL_QUALITY),
+        out_path
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=FFMPEG_TIMEOUT)
+    if proc.returncode != 0 or not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+        # Clips shorter than the seek offset: take the very first frame instead
+        cmd[cmd.index('-ss') + 1] = '0'
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=FFMPEG_TIMEOUT)
+    if proc.returncode != 0:
+        print(f"[Derivatives] ffmpeg failed for {src_path}: {proc.stderr.strip()[:200]}")
+        return False
+    return os.path.exists(out_path) and os.path.getsize(out_path) > 0
+
+
+def _generate(app, object_key, kind):
+    src_fd, src_path = tempfile.mkstemp(suffix=os.path.splitext(object_key)[1])
+    out_fd, out_path = tempfile.mkstemp(suffix='.webp')
+    os.close(src_fd)
+    os.close(out_fd)
+    ok = False
+    try:
+        with app.app_context():
+            if not download_s3_object(object_key, src_path):
+                return
+            render = _render_thumbnail if kind == 'image' else _render_poster
+            if render(src_path, out_path):
+                ok = upload_file_to_s3(out_path, derivative_key(object_key), content_type='image/webp')
+    except Exception as e:
+        print(f"[Derivatives] Could not build preview for {object_key}: {e}")
+    finally:
+        for path in (src_path, out_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with _state_lock:
+            _pending.discard(object_key)
+            if ok:
+                _failed.pop(object_key, None)
+            else:
+                _failed[object_key] = time.time()
+
+
+def schedule_derivatives(app, object_key):
+    """
+    Queues preview generation for an S3 object. No-op for non-media keys,
+    derivatives themselves, keys already queued and recent failures.
+    """
+    if not object_key or object_key.startswith(DERIVATIVES_PREFIX):
+        return False
+    kind = _media_kind(object_key)
+    if not kind:
+        return False
+    with _state_lock:
+        if object_key in _pending:
+            return False
+        failed_at = _failed.get(object_key)
+        if failed_at and time.time() - failed_at < FAILED_RETRY_SECONDS:
+            return False
+        _pending.add(object_key)
+    _executor.submit(_generate, app, object_key, kind)
+    return True
+
+
+def attach_preview_urls(app, username, files):
+    """
+    Sets preview_url on image/video entries of a listing (dicts with key,
+    is_image, is_video): the derivative when it exists (preview_is_thumbnail,
+    always an image), otherwise the original, in which case the derivative is
+    queued for backfill.
+    """
+    media = [f for f in files if f.get('is_image') or f.get('is_video')]
+    for file in files:
+        file['preview_url'] = None
+        file['preview_is_thumbnail'] = False
+    if not media:
+        return files
+
+    existing = list_keys_with_prefix(f"{DERIVATIVES_PREFIX}{username}/") or set()
+    backfilled = 0
+    for file in media:
+        thumb_key = derivative_key(file['key'])
+        if thumb_key in existing:
+            file['preview_url'] = get_public_s3_url(thumb_key)
+            file['preview_is_thumbnail'] = True
+            continue
+        file['preview_url'] = get_public_s3_url(file['key'])
+        if backfilled < BACKFILL_PER_LISTING and schedule_derivatives(app, file['key']):
+            backfilled += 1
+    return files
@@ -0,0 +1,179 @@
+"""
+Helpers for the `gradio_client` command runner.
+
+Creating a gradio_client.Client downloads the Space's API schema, so clients
+are cached per URL and reused across jobs. A cached client that has been
+idle for a while is health-checked before use. A predict that fails before
+the job reaches the Space (schema/config fetch, connection refused, an
+api_name missing from a stale schema) drops the client and retries once with
+a freshly fetched schema; timeouts and disconnects mid-job are not retried,
+since the Space may still be running the job.
+
+A template's positional arguments come from its `gradio_params` list (see
+build_gradio_args); templates without one keep the IndexTTS argument list
+this runner was originally written for.
+"""
+import io
+import os
+import time
+import wave
+import array
+import math
+import tempfile
+import threading
+
+import httpx
+from gradio_client import Client, handle_file
+
+from .remote_api_client import get_http_session
+
+# Idle time after which a cached client is health-checked before reuse
+GRADIO_CLIENT_HEALTH_INTERVAL = 300
+GRADIO_HEALTH_TIMEOUT = 5
+DEFAULT_GRADIO_API_NAME = '/generate'
+
+# Placeholders allowed as string values in a template's gradio_params
+PROMPT_PLACEHOLDER = '{prompt}'
+DUMMY_AUDIO_PLACEHOLDER = '{dummy_audio}'
+
+# Positional arguments of IndexTTS's /generate endpoint
+INDEXTTS_GRADIO_PARAMS = [
+    "Same as the voice reference",
+    DUMMY_AUDIO_PLACEHOLDER,
+    PROMPT_PLACEHOLDER,
+    DUMMY_AUDIO_PLACEHOLDER,
+    0.8,
+    0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
+    "",
+    False,
+    120,
+    True, 0.8, 30, 0.8, 0.0, 3, 10.0, 1500,
+]
+
+# api_url -> {'client': Client, 'last_ok': timestamp}
+_clients = {}
+_clients_lock = threading.Lock()
+_url_locks = {}
+
+_dummy_wav_bytes = None
+_dummy_wav_path = None
+_dummy_wav_lock = threading.Lock()
+
+
+def _url_lock(api_url):
+    with _clients_lock:
+        return _url_locks.setdefault(api_url, threading.Lock())
+
+
+def _is_healthy(client):
+    try:
+        response = get_http_session().get(client.src, timeout=GRADIO_HEALTH_TIMEOUT)
+        return response.status_code < 500
+    except Exception as e:
+        print(f"[Gradio] Health check for {client.src} failed: {e}")
+        return False
+
+
+def get_gradio_client(api_url, refresh=False):
+    """Cached Client for `api_url`; `refresh` forces a new one (and a new schema)."""
+    with _url_lock(api_url):
+        entry = _clients.get(api_url)
+        now = time.time()
+        if entry and not refresh:
+            if now - entry['last_ok'] < GRADIO_CLIENT_HEALTH_INTERVAL or _is_healthy(entry['client']):
+                entry['last_ok'] = now
+                return entry['client']
+        client = Client(api_url)
+        _clients[api_url] = {'client': client, 'last_ok': now}
+        return client
+
+
+def drop_gradio_client(api_url):
+    with _url_lock(api_url):
+        _clients.pop(api_url, None)
+
+
+def _build_dummy_wav():
+    """One second of a 44.1 kHz sine wave, as WAV bytes."""
+    samples = array.array('h', (int(math.sin(i / 100.0) * 32767) for i in range(44100)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setparams((1, 2, 44100, 44100, 'NONE', 'not compressed'))
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def get_dummy_wav_path():
+    """
+    Path of the placeholder reference audio. The WAV is generated once per
+    process and kept in memory; the file is rewritten only if it disappears.
+    """
+    global _dummy_wav_bytes, _dummy_wav_path
+    with _dummy_wav_lock:
+        if _dummy_wav_bytes is None:
+            _dummy_wav_bytes = _build_dummy_wav()
+        if not _dummy_wav_path or not os.path.exists(_dummy_wav_path):
+            with tempfile.NamedTemporaryFile(delete=False, prefix='dummy_prompt_', suffix='.wav') as tmp:
+                tmp.write(_dummy_wav_bytes)
+            _dummy_wav_path = tmp.name
+        return _dummy_wav_path
+
+
+def build_gradio_args(template, prompt):
+    """
+    Positional predict() arguments for a template. String values equal to
+    '{prompt}' or '{dummy_audio}' are replaced with the prompt and the
+    placeholder audio file respectively; everything else is passed as is.
+    """
+    params = template.get('gradio_params') or INDEXTTS_GRADIO_PARAMS
+    args = []
+    for value in params:
+        if value == PROMPT_PLACEHOLDER:
+            args.append(prompt)
+        elif value == DUMMY_AUDIO_PLACEHOLDER:
+            args.append(handle_file(get_dummy_wav_path()))
+        else:
+            args.append(value)
+    return args
+
+
+def _failed_before_submit(error):
+    """
+    True when predict() failed before the job was handed to the Space, so
+    retrying cannot run it twice: the connection could not be opened, or the cached
+    schema has no such endpoint (gradio_client raises ValueError naming
+    api_name/fn_index). Timeouts and dropped connections are not included.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, ConnectionRefusedError)):
+            return True
+        if isinstance(error, ValueError) and ('api_name' in str(error) or 'fn_index' in str(error)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def gradio_predict(api_url, args, api_name=DEFAULT_GRADIO_API_NAME):
+    """
+    predict() through the cached client. Failures before the job is submitted
+    (see _failed_before_submit) rebuild the client, re-fetching the schema,
+    and retry once; anything else is raised so a long GPU job never runs twice.
+    """
+    for attempt in range(2):
+        try:
+            client = get_gradio_client(api_url, refresh=attempt > 0)
+        except Exception as e:
+            # Fetching the config/schema failed: nothing was submitted yet
+            if attempt:
+                raise
+            print(f"[Gradio] Could not connect to {api_url} ({e}); retrying.")
+            continue
+        try:
+            return client.predict(*args, api_name=api_name)
+        except Exception as e:
+            if attempt or not _failed_before_submit(e):
+                raise
+            print(f"[Gradio] predict on {api_url} failed before submission ({e}); retrying with a fresh client.")
+            drop_gradio_client(api_url)
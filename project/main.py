@@ -394,7 +394,10 @@ def ai_project_view(ai_project_id):
             enable_image_input=ai_project.get('enable_image_input', False),
             enable_audio_input=ai_project.get('enable_audio_input', False),
             enable_file_input=ai_project.get('enable_file_input', False),
-            custom_api_url=ai_project.get('custom_api_url', '')
+            custom_api_url=ai_project.get('custom_api_url', ''),
+            last_remote_inference_result=last_remote_inference_result,
+            username=username,
+            server_domain=effective_server_domain
         )
 
     if space_card_type == 'netmind':
@@ -624,7 +627,8 @@ def run_inference(ai_project_id):
     # Special handling for remote_inference type
     space_card_type = ai_project.get('card_type', 'standard')
     if space_card_type == 'remote_inference':
-        from .remote_api_client import smart_call_remote_api, download_result_file
+        from .remote_api_client import smart_call_remote_api, download_result_file, prefetch_urls
+        from .remote_jobs import submit_remote_job
         import tempfile
         from werkzeug.utils import secure_filename
         
@@ -645,75 +649,85 @@ def run_inference(ai_project_id):
                 params_dict['prompt'] = prompt_text
                 params_dict['text'] = prompt_text
             
-            import requests as req_lib # avoid conflict with flask request
-            
-            def save_url_to_temp(url, prefix):
-                try:
-                    resp = req_lib.get(url, stream=True, timeout=30)
-                    resp.raise_for_status()
-                    suffix = os.path.splitext(url.split('?')[0])[1] or '.bin'
-                    tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix=suffix)
-                    for chunk in resp.iter_content(chunk_size=8192):
-                        tmp.write(chunk)
-                    tmp.close()
-                    return tmp.name
-                except Exception as e:
-                    print(f"Failed to download {url}: {e}")
-                    return None
+            # URL inputs: either forwarded as-is (the remote API downloads them
+            # itself) or fetched concurrently before the call.
+            url_inputs = {
+                'image': (request.form.get('image_url', '').strip(), 'image', 'img_'),
+                'audio': (request.form.get('audio_url', '').strip(), 'audio', 'aud_'),
+                'file': (request.form.get('file_url', '').strip(), 'file', 'file_'),
+            }
+            url_inputs = {name: spec for name, spec in url_inputs.items() if spec[0]}
+            if ai_project.get('remote_pass_urls'):
+                for name, (url, _, _) in url_inputs.items():
+                    params_dict[f'{name}_url'] = url
+                url_inputs = {}
+            prefetched = prefetch_urls(url_inputs)
+            for name, fetched in prefetched.items():
+                if fetched.get('path'):
+                    temp_files.append(fetched['path'])
+            failed = {name: fetched['error'] for name, fetched in prefetched.items() if fetched.get('error')}
+            if failed:
+                return jsonify({'error': '输入文件下载失败：' + '；'.join(failed.values())}), 400
 
             # Handle image (Upload OR URL)
-            image_url = request.form.get('image_url', '').strip()
-            if image_url:
-                temp_path = save_url_to_temp(image_url, 'img_')
-                if temp_path:
-                    files_dict['image'] = temp_path
-                    temp_files.append(temp_path)
+            if 'image' in prefetched:
+                files_dict['image'] = prefetched['image']['path']
+            elif params_dict.get('image_url'):
+                pass
             elif 'image_input' in request.files:
                 image_file = request.files['image_input']
                 if image_file and image_file.filename:
-                    temp_path = os.path.join(tempfile.gettempdir(), secure_filename(image_file.filename))
+                    temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}_{secure_filename(image_file.filename)}")
                     image_file.save(temp_path)
                     files_dict['image'] = temp_path
                     temp_files.append(temp_path)
             
             # Handle audio (Upload OR URL)
-            audio_url = request.form.get('audio_url', '').strip()
-            if audio_url:
-                temp_path = save_url_to_temp(audio_url, 'aud_')
-                if temp_path:
-                    files_dict['audio'] = temp_path
-                    files_dict['prompt_audio'] = temp_path
-                    temp_files.append(temp_path)
+            if 'audio' in prefetched:
+                files_dict['audio'] = prefetched['audio']['path']
+                files_dict['prompt_audio'] = prefetched['audio']['path']
+            elif params_dict.get('audio_url'):
+                pass
             elif 'audio_input' in request.files:
                 audio_file = request.files['audio_input']
                 if audio_file and audio_file.filename:
-                    temp_path = os.path.join(tempfile.gettempdir(), secure_filename(audio_file.filename))
+                    temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}_{secure_filename(audio_file.filename)}")
                     audio_file.save(temp_path)
                     files_dict['audio'] = temp_path
                     files_dict['prompt_audio'] = temp_path
                     temp_files.append(temp_path)
 
             # Handle generic file (Upload OR URL)
-            file_url = request.form.get('file_url', '').strip()
-            if file_url:
-                temp_path = save_url_to_temp(file_url, 'file_')
-                if temp_path:
-                    files_dict['file'] = temp_path
-                    temp_files.append(temp_path)
+            if 'file' in prefetched:
+                files_dict['file'] = prefetched['file']['path']
+            elif params_dict.get('file_url'):
+                pass
             elif 'file_input' in request.files:
                 file_obj = request.files['file_input']
                 if file_obj and file_obj.filename:
-                    temp_path = os.path.join(tempfile.gettempdir(), secure_filename(file_obj.filename))
+                    temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4().hex}_{secure_filename(file_obj.filename)}")
                     file_obj.save(temp_path)
                     files_dict['file'] = temp_path
                     temp_files.append(temp_path)
 
+            timeout = ai_project.get('remote_inference_timeout_seconds', 300)
+
+            # Async mode: queue the call and return a job id; the page polls
+            # /remote_inference/jobs/<job_id> or waits for the socket push.
+            if ai_project.get('remote_async_jobs'):
+                job_id = submit_remote_job(
+                    current_app._get_current_object(), username, ai_project_id,
+                    custom_api_url, files_dict, params_dict, timeout, temp_files
+                )
+                temp_files = []  # now owned by the job
+                return jsonify({'success': True, 'job_id': job_id, 'status': 'pending'}), 202
+
             # Call Remote API with smart retry
             result = smart_call_remote_api(
                 api_url=custom_api_url,
                 files_dict=files_dict if files_dict else None,
                 params_dict=params_dict,
-                timeout=ai_project.get('remote_inference_timeout_seconds', 300)
+                timeout=timeout
             )
             
             if result['success']:
@@ -1015,6 +1029,18 @@ def check_status(task_id):
     return jsonify(task_copy)
 
 
+@main_bp.route('/remote_inference/jobs/<job_id>')
+def remote_inference_job_status(job_id):
+    if not session.get('logged_in'):
+        return jsonify({'error': '未登录'}), 401
+
+    from .remote_jobs import get_remote_job
+    job = get_remote_job(job_id, session['username'])
+    if not job:
+        return jsonify({'status': 'not_found'}), 404
+    return jsonify(job)
+
+
 @main_bp.route('/set_avatar', methods=['POST'])
 def set_avatar():
     if not session.get('logged_in'):
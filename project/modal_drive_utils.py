@@ -5,8 +5,23 @@ Modal Drive Utilities
 """
 
 import os
+import time
+import threading
 from flask import session
-from .database import load_db, save_db
+from .database import load_db
+
+# 列表缓存：网盘用户名 -> (写入时间, 过滤后的项目列表)
+# 本站自己的上传/建目录/重命名/删除会立即失效对应用户的缓存，
+# TTL 只用于兜底其他途径对网盘的修改。
+MODAL_DRIVE_LISTING_TTL = 30
+# 用户根目录已确认存在的记忆时长
+MODAL_DRIVE_ROOT_TTL = 3600
+MODAL_DRIVE_DEFAULT_PAGE_SIZE = 100
+MODAL_DRIVE_MAX_PAGE_SIZE = 1000
+
+_listing_cache = {}
+_known_roots = {}
+_cache_lock = threading.Lock()
 
 
 def get_modal_drive_credentials():
@@ -157,21 +172,85 @@ def filter_user_items(items):
     return filtered
 
 
-def ensure_share_storage():
+def get_cached_listing(username):
     """
-    确保数据库中存在分享存储结构
-    
-    Returns:
-        tuple: (db, shares) - 数据库对象和分享字典
+    返回缓存的用户项目列表（副本），过期或不存在时返回 None
     """
-    db = load_db()
-    
-    if 'modal_drive_shares' not in db:
-        db['modal_drive_shares'] = {}
-    
-    shares = db['modal_drive_shares']
-    
-    return db, shares
+    with _cache_lock:
+        entry = _listing_cache.get(username)
+        if not entry:
+            return None
+        if time.time() - entry[0] > MODAL_DRIVE_LISTING_TTL:
+            del _listing_cache[username]
+            return None
+        return list(entry[1])
+
+
+def store_listing(username, items):
+    with _cache_lock:
+        _listing_cache[username] = (time.time(), list(items))
+
+
+def invalidate_listing(username):
+    """本站修改了用户网盘内容后调用"""
+    with _cache_lock:
+        _listing_cache.pop(username, None)
+
+
+def is_user_root_known(base_url, username):
+    with _cache_lock:
+        confirmed_at = _known_roots.get((base_url, username))
+        return bool(confirmed_at) and time.time() - confirmed_at < MODAL_DRIVE_ROOT_TTL
+
+
+def remember_user_root(base_url, username):
+    with _cache_lock:
+        _known_roots[(base_url, username)] = time.time()
+
+
+def forget_user_root(base_url, username):
+    with _cache_lock:
+        _known_roots.pop((base_url, username), None)
+
+
+def list_directory(items, directory):
+    """
+    返回 directory（相对路径，'' 表示根目录）下的直接子项目
+    """
+    directory = normalize_relative_path(directory)
+    children = []
+    for item in items:
+        relative_path = item.get('relative_path', '')
+        if not relative_path:
+            continue
+        parent = relative_path.rsplit('/', 1)[0] if '/' in relative_path else ''
+        if parent == directory:
+            children.append(item)
+    return children
+
+
+def paginate_items(items, page, page_size):
+    """
+    分页，返回 (当前页项目, 分页信息)
+    """
+    try:
+        page = max(1, int(page or 1))
+    except (TypeError, ValueError):
+        page = 1
+    try:
+        page_size = int(page_size or MODAL_DRIVE_DEFAULT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        page_size = MODAL_DRIVE_DEFAULT_PAGE_SIZE
+    page_size = min(max(1, page_size), MODAL_DRIVE_MAX_PAGE_SIZE)
+
+    start = (page - 1) * page_size
+    page_items = items[start:start + page_size]
+    return page_items, {
+        'page': page,
+        'page_size': page_size,
+        'total': len(items),
+        'has_more': start + page_size < len(items)
+    }
 
 
 def get_user_quota_info(username=None):
@@ -40,3 +40,37 @@ def get_rate_limit_config(settings=None):
     window = sanitize_rate_limit_window(settings.get('rate_limit_window_seconds'))
     max_requests = sanitize_rate_limit_max_requests(settings.get('rate_limit_max_requests'))
     return max_requests, window
+
+
+def parse_rate_limit_overrides(text):
+    """
+    Parses admin input of the form "name = 30/60" (one per line, 30 requests
+    per 60 seconds) into {name: {'max_requests': 30, 'window_seconds': 60}}.
+    Invalid lines are skipped.
+    """
+    overrides = {}
+    for line in (text or '').splitlines():
+        if '=' not in line:
+            continue
+        name, _, spec = line.partition('=')
+        name = name.strip()
+        count, _, window = spec.strip().partition('/')
+        if not name:
+            continue
+        try:
+            max_requests = max(0, int(count.strip()))
+            window_seconds = max(1, int(window.strip() or DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS))
+        except ValueError:
+            continue
+        overrides[name] = {'max_requests': max_requests, 'window_seconds': window_seconds}
+    return overrides
+
+
+def format_rate_limit_overrides(overrides):
+    """
+    Inverse of parse_rate_limit_overrides, for pre-filling the admin form.
+    """
+    lines = []
+    for name, limit in sorted((overrides or {}).items()):
+        lines.append(f"{name} = {limit.get('max_requests', 0)}/{limit.get('window_seconds', DEFAULT_NETMIND_RATE_LIMIT_WINDOW_SECONDS)}")
+    return '\n'.join(lines)
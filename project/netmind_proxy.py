@@ -2,11 +2,280 @@ import time
 import random
 import threading
 import json
-from openai import OpenAI, APIError, AuthenticationError, RateLimitError, BadRequestError
+import queue
+from collections import deque
+import httpx
+from openai import (
+    OpenAI, APIError, APIConnectionError, APIStatusError, AuthenticationError, RateLimitError,
+    InternalServerError
+)
 from .database import save_db
 
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
 DEFAULT_NETMIND_BASE_URL = 'https://api.netmind.ai/inference-api/openai/v1'
 
+# Shared upstream connection pool for every cached OpenAI client
+NETMIND_POOL_MAX_CONNECTIONS = 100
+NETMIND_POOL_MAX_KEEPALIVE = 20
+NETMIND_POOL_KEEPALIVE_EXPIRY = 60
+NETMIND_CONNECT_TIMEOUT = 10
+NETMIND_READ_TIMEOUT = 600
+
+# Key scheduler tuning
+KEY_LATENCY_EWMA_ALPHA = 0.2
+KEY_ERROR_EWMA_ALPHA = 0.2
+KEY_DEFAULT_RATE_LIMIT_COOLDOWN = 30
+KEY_AUTH_ERROR_COOLDOWN = 600
+KEY_MAX_RETRY_AFTER = 3600
+
+DEFAULT_THINKING_SYSTEM_PROMPT = """
+You are a profound thinking assistant.
+Before answering the user's request, you must perform a detailed step-by-step analysis.
+Enclose your internal thought process within <thinking>...</thinking> tags.
+After the thinking tags, provide your final response.
+"""
+
+# Timeouts, hedging and failover (per-deployment overrides live in netmind_settings)
+DEFAULT_FIRST_TOKEN_TIMEOUT = 60
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_MIN_DELAY = 2.0
+HEDGE_MIN_SAMPLES = 20
+LATENCY_SAMPLE_SIZE = 200
+
+# Structured error codes/types in the upstream error body that mean the key
+# has run out of credit for good
+BALANCE_EXHAUSTED_CODES = ('insufficient_quota', 'insufficient_balance')
+# NetMind's own message for an empty account (sent as a 400)
+NETMIND_BALANCE_MESSAGE = 'usd balance not enough'
+
+
+def _is_balance_exhausted(error):
+    """
+    True only for 402s, an explicit insufficient_quota/insufficient_balance
+    code in the error body, or NetMind's "USD balance not enough" message.
+    Free-text matching on words like "quota exceeded" would also catch
+    ordinary 429 rate limits and blacklist healthy keys for good.
+    """
+    if getattr(error, 'status_code', None) == 402:
+        return True
+    body = getattr(error, 'body', None)
+    if isinstance(body, dict):
+        details = body.get('error') if isinstance(body.get('error'), dict) else body
+        for field in ('code', 'type'):
+            if str(details.get(field) or '').lower() in BALANCE_EXHAUSTED_CODES:
+                return True
+        if NETMIND_BALANCE_MESSAGE in str(details.get('message') or '').lower():
+            return True
+    return NETMIND_BALANCE_MESSAGE in str(error).lower()
+
+
+def _parse_retry_after(error):
+    """Seconds to wait from a 429's Retry-After header (seconds or HTTP date), if present."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return min(max(0.0, float(value)), KEY_MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        retry_at = parsedate_to_datetime(value).timestamp()
+        return min(max(0.0, retry_at - time.time()), KEY_MAX_RETRY_AFTER)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class UpstreamTimeoutError(Exception):
+    """No first token arrived from an upstream endpoint within the configured timeout."""
+    status_code = 504
+
+
+def _is_endpoint_error(error):
+    """Errors that say more about the endpoint than the key, so failing over to another base URL may help."""
+    if isinstance(error, (APIConnectionError, InternalServerError, UpstreamTimeoutError)):
+        return True
+    return isinstance(error, APIError) and getattr(error, 'status_code', None) in (404, 502, 503, 504)
+
+
+class _UpstreamAttempt:
+    """
+    One upstream call running in its own (green) thread. It reports to the shared
+    queue once it has a result (sync) or its first chunk (stream), or fails.
+    An attempt abandoned by the race (hedge loser, timeout) cleans up after itself.
+    """
+
+    def __init__(self, key, base_url, start, results, scheduler):
+        self.key = key
+        self.base_url = base_url
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self._start = start
+        self._results = results
+        self._scheduler = scheduler
+        self._lock = threading.Lock()
+        self._finished = False
+        self._abandoned = False
+
+    def begin(self):
+        self.started_at = self._scheduler.acquire(self.key)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.result = self._start()
+        except Exception as e:
+            self.error = e
+        with self._lock:
+            self._finished = True
+            abandoned = self._abandoned
+        if abandoned:
+            self._cleanup()
+        else:
+            self._results.put(self)
+
+    def abandon(self):
+        with self._lock:
+            self._abandoned = True
+            finished = self._finished
+        if finished:
+            self._cleanup()
+
+    def _cleanup(self):
+        if isinstance(self.result, tuple):
+            self.result[1].close()
+        self._scheduler.finish(self.key)
+
+
+class NetMindKeyScheduler:
+    """
+    Tracks per-key health in memory and picks the least-loaded healthy key.
+
+    For each key: requests in flight, a latency EWMA, an error-rate EWMA and a
+    cool-down deadline set by 429s (honouring Retry-After) or auth failures.
+    Score = (in_flight + 1) * latency / (1 - error_rate); lowest wins, ties
+    are broken randomly so equal keys share load.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        entry = self._stats.get(key)
+        if entry is None:
+            entry = {
+                'in_flight': 0,
+                'requests': 0,
+                'errors': 0,
+                'rate_limited': 0,
+                'latency_ewma': None,
+                'error_rate': 0.0,
+                'cooldown_until': 0.0,
+                'last_error': None,
+                'last_used': None,
+            }
+            self._stats[key] = entry
+        return entry
+
+    def _score(self, entry):
+        latency = entry['latency_ewma'] or 1.0
+        error_rate = min(entry['error_rate'], 0.9)
+        return (entry['in_flight'] + 1) * latency / (1.0 - error_rate)
+
+    def pick(self, keys, exclude=None):
+        """Returns the best key, or None. Keys in cool-down are only used if nothing else is left."""
+        exclude = exclude or set()
+        candidates = [k for k in keys if k not in exclude] or list(keys)
+        if not candidates:
+            return None
+        now = time.time()
+        with self._lock:
+            ready = [k for k in candidates if self._entry(k)['cooldown_until'] <= now]
+            if not ready:
+                # Everything is cooling down: use the key that recovers first
+                return min(candidates, key=lambda k: self._stats[k]['cooldown_until'])
+            scored = [(self._score(self._stats[k]), random.random(), k) for k in ready]
+            return min(scored)[2]
+
+    def acquire(self, key):
+        with self._lock:
+            entry = self._entry(key)
+            entry['in_flight'] += 1
+            entry['requests'] += 1
+            entry['last_used'] = time.time()
+        return time.time()
+
+    def release(self, key, started_at, error=None):
+        """Records the outcome of a request started with acquire() and frees its slot."""
+        self.observe(key, started_at, error=error)
+        self.finish(key)
+
+    def finish(self, key):
+        with self._lock:
+            entry = self._entry(key)
+            entry['in_flight'] = max(0, entry['in_flight'] - 1)
+
+    def observe(self, key, started_at, error=None):
+        """Feeds latency/error outcome into the key's EWMAs without touching in_flight."""
+        elapsed = time.time() - started_at
+        with self._lock:
+            entry = self._entry(key)
+            failed = 1.0 if error is not None else 0.0
+            entry['error_rate'] = (KEY_ERROR_EWMA_ALPHA * failed +
+                                   (1 - KEY_ERROR_EWMA_ALPHA) * entry['error_rate'])
+            if error is None:
+                if entry['latency_ewma'] is None:
+                    entry['latency_ewma'] = elapsed
+                else:
+                    entry['latency_ewma'] = (KEY_LATENCY_EWMA_ALPHA * elapsed +
+                                             (1 - KEY_LATENCY_EWMA_ALPHA) * entry['latency_ewma'])
+                return
+
+            entry['errors'] += 1
+            entry['last_error'] = str(error)[:200]
+            if isinstance(error, RateLimitError):
+                entry['rate_limited'] += 1
+                cooldown = _parse_retry_after(error)
+                if cooldown is None:
+                    cooldown = KEY_DEFAULT_RATE_LIMIT_COOLDOWN
+                entry['cooldown_until'] = max(entry['cooldown_until'], time.time() + cooldown)
+            elif isinstance(error, AuthenticationError):
+                entry['cooldown_until'] = max(entry['cooldown_until'], time.time() + KEY_AUTH_ERROR_COOLDOWN)
+
+    def forget(self, key):
+        with self._lock:
+            self._stats.pop(key, None)
+
+    def snapshot(self, keys):
+        """Per-key stats for the admin page, in the order of `keys`."""
+        now = time.time()
+        with self._lock:
+            rows = []
+            for key in keys:
+                entry = self._stats.get(key) or {}
+                latency = entry.get('latency_ewma')
+                rows.append({
+                    'key': key,
+                    'in_flight': entry.get('in_flight', 0),
+                    'requests': entry.get('requests', 0),
+                    'errors': entry.get('errors', 0),
+                    'rate_limited': entry.get('rate_limited', 0),
+                    'error_rate': round(entry.get('error_rate', 0.0) * 100, 1),
+                    'latency_ms': int(latency * 1000) if latency is not None else None,
+                    'cooldown_seconds': max(0, int(entry.get('cooldown_until', 0) - now)),
+                    'last_error': entry.get('last_error'),
+                })
+            return rows
+
 class NetMindClient:
     _instance = None
     _lock = threading.Lock()
@@ -19,8 +288,70 @@ class NetMindClient:
         return cls._instance
 
     def __init__(self):
-        # State could be managed here if needed, but we mostly rely on DB passed in context
-        pass
+        # __new__ returns the same instance every time, so only set up once.
+        # Settings/keys still come from the DB passed in per call.
+        if getattr(self, '_initialized', False):
+            return
+        self._initialized = True
+        self._http_client = None
+        # {(api_key, base_url): OpenAI}
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self.scheduler = NetMindKeyScheduler()
+        self._alias_table = None
+        self._alias_table_version = None
+        # Recent time-to-first-token (stream) / total latency (sync) of winning attempts
+        self._latency_samples = {True: deque(maxlen=LATENCY_SAMPLE_SIZE), False: deque(maxlen=LATENCY_SAMPLE_SIZE)}
+
+    def _get_http_client(self):
+        """One keep-alive httpx pool shared by all keys; TLS is negotiated once per connection."""
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                http2=_HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=NETMIND_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=NETMIND_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=NETMIND_POOL_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(NETMIND_READ_TIMEOUT, connect=NETMIND_CONNECT_TIMEOUT)
+            )
+        return self._http_client
+
+    def _get_client(self, api_key, base_url):
+        """Returns a long-lived OpenAI client for (api_key, base_url)."""
+        cache_key = (api_key, base_url)
+        client = self._clients.get(cache_key)
+        if client is not None:
+            return client
+        with self._clients_lock:
+            client = self._clients.get(cache_key)
+            if client is None:
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=self._get_http_client()
+                )
+                self._clients[cache_key] = client
+        return client
+
+    def evict_key(self, api_key):
+        """
+        Drops cached clients for a key that was deleted or blacklisted.
+        The clients are not closed because they share the pooled http client.
+        """
+        with self._clients_lock:
+            for cache_key in [k for k in self._clients if k[0] == api_key]:
+                del self._clients[cache_key]
+        self.scheduler.forget(api_key)
+
+    def get_key_stats(self, db):
+        """Scheduler state for every configured key (used by the admin page)."""
+        settings = self._get_settings(db)
+        blacklist = set(settings.get('blacklist', []))
+        rows = self.scheduler.snapshot([k for k in settings.get('keys', []) if k.strip()])
+        for row in rows:
+            row['blacklisted'] = row['key'] in blacklist
+        return rows
 
     def _get_settings(self, db):
         return db.get('netmind_settings', {})
@@ -31,18 +362,15 @@ class NetMindClient:
         blacklist = settings.get('blacklist', [])
         return [k for k in all_keys if k.strip() and k not in blacklist]
 
-    def _get_next_key(self, db, exclude_key=None):
+    def _get_next_key(self, db, exclude_key=None, tried=None):
         keys = self._get_valid_keys(db)
         if not keys:
             return None
 
-        if exclude_key and exclude_key in keys and len(keys) > 1:
-            # Simple rotation: just pick a random one that is not the excluded one
-            # For true round-robin, we would need persistent state
-            candidates = [k for k in keys if k != exclude_key]
-            return random.choice(candidates)
-
-        return random.choice(keys)
+        exclude = set(tried or ())
+        if exclude_key:
+            exclude.add(exclude_key)
+        return self.scheduler.pick(keys, exclude=exclude)
 
     def _normalize_base_url(self, raw_url):
         """
@@ -73,6 +401,10 @@ class NetMindClient:
 
         return base_url
 
+    def resolve_model_name(self, db, requested_model):
+        """Public model name -> upstream model name, as chat_completion would send it."""
+        return self._resolve_model_name(db, requested_model)
+
     def _resolve_model_name(self, db, requested_model):
         """
         Allows admins to expose friendly model names to users when enabled.
@@ -84,6 +416,24 @@ class NetMindClient:
         if not settings or not settings.get('enable_alias_mapping'):
             return requested_model
 
+        resolved = self._get_alias_table(db, settings).get(requested_model.strip().lower())
+        return resolved or requested_model
+
+    def _get_alias_table(self, db, settings):
+        """
+        Returns the compiled (lower-cased) alias table. admin.sync_netmind_aliases
+        bumps `alias_version` whenever the aliases change, so the table is only
+        rebuilt then; databases that predate the version fall back to a rebuild.
+        """
+        version = settings.get('alias_version')
+        if version is None:
+            return self._compile_alias_table(db, settings)
+        if self._alias_table is None or self._alias_table_version != version:
+            self._alias_table = self._compile_alias_table(db, settings)
+            self._alias_table_version = version
+        return self._alias_table
+
+    def _compile_alias_table(self, db, settings):
         lookup = {}
 
         alias_config = settings.get('model_aliases') or {}
@@ -107,141 +457,263 @@ class NetMindClient:
             if alias_key and upstream_value:
                 lookup[alias_key] = upstream_value
 
-        resolved = lookup.get(requested_model.strip().lower())
-        return resolved or requested_model
+        return lookup
 
-    def chat_completion(self, db, messages, model, stream=False, max_tokens=None, extra_params=None):
-        # Inject Thinking System Prompt
-        THINKING_SYSTEM_PROMPT = """
-You are a profound thinking assistant.
-Before answering the user's request, you must perform a detailed step-by-step analysis.
-Enclose your internal thought process within <thinking>...</thinking> tags.
-After the thinking tags, provide your final response.
-"""
-        # Ensure messages is a list and make a copy to avoid side effects
+    def chat_completion(self, db, messages, model, stream=False, max_tokens=None, extra_params=None, usage_callback=None):
+        """
+        Proxies a chat completion upstream. `usage_callback(api_key, usage_dict)`
+        is called once with the upstream token usage of the winning attempt.
+        """
         if not isinstance(messages, list):
             messages = []
-        messages = messages.copy()
-
-        # Check if there is already a system message
-        system_message_index = next((i for i, m in enumerate(messages) if m.get('role') == 'system'), None)
-
-        if system_message_index is not None:
-             # Append to existing system message
-             original_content = messages[system_message_index].get('content', '')
-             messages[system_message_index]['content'] = original_content + "\n\n" + THINKING_SYSTEM_PROMPT
-        else:
-             # Insert new system message at the beginning
-             messages.insert(0, {"role": "system", "content": THINKING_SYSTEM_PROMPT})
 
         settings = self._get_settings(db)
-        base_url = self._normalize_base_url(settings.get('base_url'))
-        fallback_base_url = None
-        if base_url != DEFAULT_NETMIND_BASE_URL:
-            fallback_base_url = DEFAULT_NETMIND_BASE_URL
+        thinking_prompt = self._thinking_prompt_for(settings, model)
+        if thinking_prompt:
+            messages = self._inject_system_prompt(messages, thinking_prompt)
 
         ad_suffix = settings.get('ad_suffix', '')
         ad_enabled = settings.get('ad_enabled', False)
         public_model_name = model
         upstream_model_name = self._resolve_model_name(db, model)
 
-        key = self._get_next_key(db)
-        if not key:
+        keys = self._get_valid_keys(db)
+        if not keys:
             raise Exception("No NetMind API keys configured.")
 
-        # Max retries based on the number of keys available
-        max_retries = len(self._get_valid_keys(db))
-        attempts = 0
+        connect_timeout, first_token_timeout, hedging_enabled, hedge_percentile = self._get_timeout_settings(settings)
+        passthrough = settings.get('stream_passthrough', False)
+
+        def make_start(key, endpoint):
+            client = self._get_client(key, endpoint).with_options(
+                timeout=httpx.Timeout(NETMIND_READ_TIMEOUT, connect=connect_timeout)
+            )
+            request_options = extra_params.copy() if extra_params else None
+            args = (client, messages, upstream_model_name, public_model_name, ad_suffix, ad_enabled)
+            kwargs = {'max_tokens': max_tokens, 'extra_params': request_options}
+            if not stream:
+                return lambda: self._handle_sync(*args, **kwargs)
+            if usage_callback:
+                # Ask upstream for the trailing usage chunk; only relay it if the client asked too
+                request_options = request_options or {}
+                stream_options = dict(request_options.get('stream_options') or {})
+                kwargs['forward_usage'] = bool(stream_options.get('include_usage'))
+                stream_options['include_usage'] = True
+                request_options['stream_options'] = stream_options
+                kwargs['extra_params'] = request_options
+                kwargs['report_usage'] = lambda usage: usage_callback(key, usage)
+            handler = self._handle_stream_passthrough if passthrough else self._handle_stream
+            return lambda: self._prime_stream(handler(*args, **kwargs))
+
+        return self._run_with_failover(
+            db, settings, keys, self._get_endpoints(settings), make_start, stream,
+            first_token_timeout if stream else None,
+            self._hedge_delay(stream, hedge_percentile) if hedging_enabled else None,
+            usage_callback=usage_callback
+        )
+
+    def _run_with_failover(self, db, settings, keys, endpoints, make_start, stream, first_token_timeout, hedge_delay, usage_callback=None):
+        """
+        Races upstream attempts until one produces a response.
+
+        Key errors (401/429/balance) move on to another key; endpoint errors
+        (connection, 5xx, 404, first-token timeout) fail over to the next base
+        URL. If the lone attempt is slower than `hedge_delay`, a second one is
+        fired on another key (or endpoint) and the loser is abandoned.
+        """
+        results = queue.Queue()
+        running = []
+        bad_keys = set()
+        failed_endpoints = set()
+        max_attempts = len(keys) + len(endpoints) - 1 + (1 if hedge_delay else 0)
+        launched = 0
+        hedge_at = None
+        hedged = False
         last_error = None
 
-        current_base_url = base_url
+        def launch(avoid_keys=()):
+            nonlocal launched
+            endpoint = next((e for e in endpoints if e not in failed_endpoints), None)
+            candidates = [k for k in keys if k not in bad_keys]
+            if endpoint is None or not candidates or launched >= max_attempts:
+                return None
+            key = self.scheduler.pick(candidates, exclude=set(avoid_keys))
+            if key in avoid_keys:
+                # Hedging with the same key only makes sense against another endpoint
+                endpoint = next((e for e in endpoints if e not in failed_endpoints and e != endpoint), None)
+                if endpoint is None:
+                    return None
+            attempt = _UpstreamAttempt(key, endpoint, make_start(key, endpoint), results, self.scheduler)
+            attempt.begin()
+            running.append(attempt)
+            launched += 1
+            return attempt
+
+        if launch() is None:
+            raise Exception("No NetMind API keys configured.")
+        if hedge_delay:
+            hedge_at = time.time() + hedge_delay
+
+        while running:
+            now = time.time()
+            deadlines = []
+            if first_token_timeout:
+                deadlines.extend(a.started_at + first_token_timeout for a in running)
+            if hedge_at is not None and not hedged:
+                deadlines.append(hedge_at)
+            wait = max(0.01, min(deadlines) - now) if deadlines else None
 
-        while attempts < max_retries:
             try:
-                client = OpenAI(
-                    api_key=key,
-                    base_url=current_base_url
-                )
+                attempt = results.get(timeout=wait)
+            except queue.Empty:
+                now = time.time()
+                for timed_out in [a for a in running if first_token_timeout and now - a.started_at >= first_token_timeout]:
+                    print(f"NetMind endpoint {timed_out.base_url} (Key: {timed_out.key[:4]}...) sent no first token within {first_token_timeout}s.")
+                    running.remove(timed_out)
+                    last_error = UpstreamTimeoutError(f"No response from upstream within {first_token_timeout}s")
+                    self.scheduler.observe(timed_out.key, timed_out.started_at, error=last_error)
+                    timed_out.abandon()
+                    failed_endpoints.add(timed_out.base_url)
+                if hedge_at is not None and not hedged and now >= hedge_at and len(running) == 1:
+                    hedged = True
+                    hedge = launch(avoid_keys={running[0].key})
+                    if hedge is not None:
+                        print(f"NetMind request slower than {hedge_delay:.1f}s, hedging on key {hedge.key[:4]}... ({hedge.base_url}).")
+                if not running:
+                    launch()
+                continue
 
-                request_options = extra_params.copy() if extra_params else None
+            if attempt not in running:
+                continue  # Already abandoned after a timeout
+            running.remove(attempt)
+            key = attempt.key
 
+            if attempt.error is None:
+                for loser in running:
+                    loser.abandon()
+                self.scheduler.observe(key, attempt.started_at)
+                self._latency_samples[bool(stream)].append(time.time() - attempt.started_at)
                 if stream:
-                    return self._handle_stream(
-                        client,
-                        messages,
-                        upstream_model_name,
-                        public_model_name,
-                        ad_suffix,
-                        ad_enabled,
-                        max_tokens=max_tokens,
-                        extra_params=request_options
-                    )
-                else:
-                    return self._handle_sync(
-                        client,
-                        messages,
-                        upstream_model_name,
-                        public_model_name,
-                        ad_suffix,
-                        ad_enabled,
-                        max_tokens=max_tokens,
-                        extra_params=request_options
-                    )
-
-            except BadRequestError as e:
-                # Check for "usd balance not enough" and blacklist the key
-                # Error code: 400 - {'detail': 'usd balance not enough...'}
-                # e.message usually contains the message
-                # e.response might have the JSON body
-
-                # Check message or body
-                error_msg = str(e).lower()
-                if 'usd balance not enough' in error_msg:
-                    print(f"NetMind Key {key[:4]}... exhausted (Balance insufficient). Blacklisting.")
-
-                    # Add to blacklist
-                    if 'blacklist' not in settings:
-                        settings['blacklist'] = []
-
-                    if key not in settings['blacklist']:
-                        settings['blacklist'].append(key)
-                        save_db(db) # Persist blacklist
-
-                    last_error = e
-                    attempts += 1
-                    key = self._get_next_key(db, exclude_key=key)
-                    if not key:
-                         break
-                    time.sleep(0.5)
-                    continue
-                else:
-                    # Other BadRequestError
-                    print(f"NetMind BadRequestError: {e}")
-                    raise e
-
-            except (AuthenticationError, RateLimitError) as e:
+                    return self._winning_stream(attempt)
+                self.scheduler.finish(key)
+                if usage_callback:
+                    usage = getattr(attempt.result, 'usage', None)
+                    usage_callback(key, usage.model_dump() if usage is not None else None)
+                return attempt.result
+
+            e = attempt.error
+            self.scheduler.observe(key, attempt.started_at, error=e)
+            self.scheduler.finish(key)
+            last_error = e
+
+            # 402s and insufficient_quota 429s are plain APIStatusError/RateLimitError,
+            # so this must come before the rate-limit branch; other 429s cool down below
+            if isinstance(e, APIStatusError) and _is_balance_exhausted(e):
+                print(f"NetMind Key {key[:4]}... exhausted (Balance insufficient). Blacklisting.")
+                if 'blacklist' not in settings:
+                    settings['blacklist'] = []
+                if key not in settings['blacklist']:
+                    settings['blacklist'].append(key)
+                    save_db(db) # Persist blacklist
+                self.evict_key(key)
+                bad_keys.add(key)
+            elif isinstance(e, (AuthenticationError, RateLimitError)):
+                # The scheduler has already put the key into cool-down
                 print(f"NetMind API Error (Key: {key[:4]}...): {e}")
-                last_error = e
-                attempts += 1
-                key = self._get_next_key(db, exclude_key=key)
-                if not key:
-                     break # Should not happen if max_retries is correct
-                time.sleep(0.5) # Brief pause before retry
-            except APIError as e:
-                if e.status_code == 404 and fallback_base_url:
-                    print(f"NetMind Base URL {current_base_url} returned 404. Falling back to {fallback_base_url}.")
-                    current_base_url = fallback_base_url
-                    fallback_base_url = None
-                    continue
+                bad_keys.add(key)
+            elif _is_endpoint_error(e):
+                print(f"NetMind endpoint {attempt.base_url} failed ({e}). Failing over.")
+                failed_endpoints.add(attempt.base_url)
+            else:
+                # Request errors (e.g. validation) will not be solved by another key or endpoint
                 print(f"NetMind API Error: {e}")
+                for other in running:
+                    other.abandon()
                 raise e
-            except Exception as e:
-                 # Other errors (e.g. validation, network) might not be solved by rotating keys
-                 print(f"NetMind Unexpected Error: {e}")
-                 raise e
+
+            if not running:
+                launch()
 
         raise last_error or Exception("All NetMind keys failed.")
 
+    def _thinking_prompt_for(self, settings, model):
+        """
+        The thinking system prompt to inject for `model`, or None. Admins can turn
+        injection off globally or per netmind space (see sync_netmind_aliases).
+        """
+        if not settings.get('thinking_prompt_enabled', True):
+            return None
+        if (model or '').strip().lower() in (settings.get('thinking_disabled_models') or []):
+            return None
+        return settings.get('thinking_prompt') or DEFAULT_THINKING_SYSTEM_PROMPT
+
+    def _inject_system_prompt(self, messages, prompt):
+        """Returns a new list with `prompt` added to the first system message; the caller's dicts are not modified."""
+        messages = list(messages)
+        system_message_index = next(
+            (i for i, m in enumerate(messages) if isinstance(m, dict) and m.get('role') == 'system'), None
+        )
+        if system_message_index is not None:
+            # Append to existing system message
+            original = messages[system_message_index]
+            messages[system_message_index] = dict(original, content=(original.get('content') or '') + "\n\n" + prompt)
+        else:
+            # Insert new system message at the beginning
+            messages.insert(0, {"role": "system", "content": prompt})
+        return messages
+
+    def _get_endpoints(self, settings):
+        """Primary base URL, then admin-configured fallbacks, then the default NetMind endpoint."""
+        endpoints = []
+        for raw_url in [settings.get('base_url')] + list(settings.get('fallback_base_urls') or []) + [DEFAULT_NETMIND_BASE_URL]:
+            endpoint = self._normalize_base_url(raw_url)
+            if endpoint not in endpoints:
+                endpoints.append(endpoint)
+        return endpoints
+
+    def _get_timeout_settings(self, settings):
+        def number(name, default, minimum):
+            try:
+                return max(minimum, float(settings.get(name, default)))
+            except (TypeError, ValueError):
+                return default
+        connect_timeout = number('connect_timeout_seconds', NETMIND_CONNECT_TIMEOUT, 1)
+        first_token_timeout = number('first_token_timeout_seconds', DEFAULT_FIRST_TOKEN_TIMEOUT, 1)
+        hedge_percentile = number('hedge_percentile', DEFAULT_HEDGE_PERCENTILE, 50)
+        return connect_timeout, first_token_timeout, bool(settings.get('hedging_enabled')), min(hedge_percentile, 99.9)
+
+    def _hedge_delay(self, stream, percentile):
+        """
+        Hedge threshold: the given percentile of recent winning latencies,
+        never below DEFAULT_HEDGE_MIN_DELAY. None until there are enough samples.
+        """
+        samples = sorted(self._latency_samples[bool(stream)])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return max(DEFAULT_HEDGE_MIN_DELAY, samples[index])
+
+    def _prime_stream(self, stream):
+        """Pulls the first chunk so an attempt only counts as answered once tokens flow."""
+        try:
+            first = next(stream)
+        except StopIteration:
+            first = None
+        return first, stream
+
+    def _winning_stream(self, attempt):
+        """Relays the winning stream; the key stays in flight until it ends or the client goes away."""
+        first, stream = attempt.result
+        try:
+            if first is not None:
+                yield first
+            for chunk in stream:
+                yield chunk
+        finally:
+            # Propagates client disconnects to the upstream request
+            stream.close()
+            self.scheduler.finish(attempt.key)
+
     def _handle_sync(self, client, messages, upstream_model, public_model, ad_suffix, ad_enabled, max_tokens=None, extra_params=None):
         payload = {
             'model': upstream_model,
@@ -271,7 +743,8 @@ After the thinking tags, provide your final response.
 
         return response
 
-    def _handle_stream(self, client, messages, upstream_model, public_model, ad_suffix, ad_enabled, max_tokens=None, extra_params=None):
+    def _handle_stream(self, client, messages, upstream_model, public_model, ad_suffix, ad_enabled, max_tokens=None, extra_params=None,
+                       report_usage=None, forward_usage=True):
         payload = {
             'model': upstream_model,
             'messages': messages,
@@ -291,6 +764,11 @@ After the thinking tags, provide your final response.
         chunk_counter = 0
 
         for chunk in response:
+            usage = getattr(chunk, 'usage', None)
+            if usage is not None and report_usage:
+                report_usage(usage.model_dump())
+                if not chunk.choices and not forward_usage:
+                    continue
             chunk_payload = self._sanitize_chunk_payload(chunk, public_model, chunk_id_base, chunk_counter)
             chunk_counter += 1
             yield f"data: {json.dumps(chunk_payload, ensure_ascii=False)}\n\n"
@@ -317,6 +795,118 @@ After the thinking tags, provide your final response.
 
         yield "data: [DONE]\n\n"
 
+    def _handle_stream_passthrough(self, client, messages, upstream_model, public_model, ad_suffix, ad_enabled, max_tokens=None, extra_params=None,
+                                   report_usage=None, forward_usage=True):
+        """
+        Relays the upstream SSE lines without parsing each chunk into models.
+
+        The request is sent eagerly so connection/auth/429 errors surface inside
+        chat_completion's retry loop. Only the first chunk is decoded, to learn
+        the upstream id and model; later chunks get a plain string substitution
+        of those two values. Closing the returned generator (client went away)
+        closes the upstream response, which cancels the generation.
+        """
+        payload = {
+            'model': upstream_model,
+            'messages': messages,
+            'stream': True
+        }
+        if isinstance(max_tokens, int) and max_tokens > 0:
+            payload['max_tokens'] = max_tokens
+        if extra_params:
+            payload.update(extra_params)
+
+        response_cm = client.chat.completions.with_streaming_response.create(**payload)
+        upstream = response_cm.__enter__()
+        return self._relay_sse(response_cm, upstream, public_model, ad_suffix, ad_enabled, report_usage, forward_usage)
+
+    def _relay_sse(self, response_cm, upstream, public_model, ad_suffix, ad_enabled, report_usage=None, forward_usage=True):
+        public_id = self._generate_public_id()
+        replacements = None
+        # Lines of the current SSE event; relayed unchanged (apart from the data
+        # rewrite) once its blank line arrives, so event:/id: stay with their data:
+        event_lines = []
+        skip_event = False
+        done = False
+        try:
+            for line in upstream.iter_lines():
+                if not line:
+                    if event_lines and not skip_event:
+                        yield "\n".join(event_lines) + "\n\n"
+                    event_lines = []
+                    skip_event = False
+                    continue
+                if not line.startswith('data:'):
+                    # event:, id:, retry: and comments / keep-alives
+                    event_lines.append(line)
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    done = True
+                    break
+                if report_usage and '"usage"' in data:
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        chunk = {}
+                    if chunk.get('usage'):
+                        report_usage(chunk['usage'])
+                        if not chunk.get('choices') and not forward_usage:
+                            skip_event = True
+                            continue
+                if replacements is None:
+                    replacements = self._sse_replacements(data, public_id, public_model)
+                for old, new in replacements:
+                    data = data.replace(old, new)
+                event_lines.append(f"data: {data}")
+            if event_lines and not skip_event and not done:
+                # Upstream closed without the final blank line
+                yield "\n".join(event_lines) + "\n\n"
+
+            if ad_enabled and ad_suffix:
+                ad_chunk = {
+                    "id": public_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": public_model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {
+                                "content": ad_suffix
+                            },
+                            "finish_reason": None
+                        }
+                    ]
+                }
+                yield f"data: {json.dumps(ad_chunk, ensure_ascii=False)}\n\n"
+
+            yield "data: [DONE]\n\n"
+        finally:
+            response_cm.__exit__(None, None, None)
+
+    def _sse_replacements(self, data, public_id, public_model):
+        """Literal (quoted) substitutions that rewrite the upstream id/model in every chunk."""
+        try:
+            first = json.loads(data)
+        except ValueError:
+            return []
+        replacements = []
+        upstream_id = first.get('id')
+        if isinstance(upstream_id, str) and upstream_id:
+            replacements.append((json.dumps(upstream_id), json.dumps(public_id)))
+        upstream_model = first.get('model')
+        if isinstance(upstream_model, str) and upstream_model and upstream_model != public_model:
+            replacements.append((
+                f'"model":{json.dumps(upstream_model)}',
+                f'"model":{json.dumps(public_model, ensure_ascii=False)}'
+            ))
+            replacements.append((
+                f'"model": {json.dumps(upstream_model)}',
+                f'"model": {json.dumps(public_model, ensure_ascii=False)}'
+            ))
+        return replacements
+
     def _generate_public_id(self, prefix='chatcmpl'):
         return f"{prefix}-pumpkin-{int(time.time() * 1000)}-{random.randint(1000, 9999)}"
 
@@ -0,0 +1,288 @@
+"""
+GCRA (generic cell rate algorithm) rate limiter with a shared backend.
+
+Each bucket stores a single number, its theoretical arrival time (TAT), so
+memory is O(1) per user/model/key. A bucket whose TAT is in the past is
+equivalent to a full bucket and can be dropped, which is how idle entries
+are evicted.
+
+Backends:
+  - 'sqlite' (default): a small table in instance/rate_limits.sqlite, shared
+    by every worker process on the host and persisted across restarts.
+  - 'redis': any Redis-compatible server (RATE_LIMIT_REDIS_URL), shared
+    across hosts. Requires the optional `redis` package.
+  - 'memory': process-local, for development.
+
+A limiter that cannot reach its backend fails open (logs and allows) so an
+outage of the limiter never takes the API down.
+"""
+import os
+import math
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+RATE_LIMIT_BACKENDS = ('memory', 'sqlite', 'redis')
+
+# How often (in checks) the sqlite backend purges idle buckets
+SQLITE_PURGE_EVERY = 500
+# How often (in seconds) the memory backend purges idle buckets
+MEMORY_PURGE_INTERVAL = 60
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """One bucket: at most `max_requests` per `window_seconds`, with bursts up to `max_requests`."""
+    key: str
+    max_requests: int
+    window_seconds: int
+
+    @property
+    def emission_interval(self):
+        return self.window_seconds / self.max_requests
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float
+    retry_after: float
+    window_seconds: int
+
+    def headers(self):
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(max(0, self.remaining)),
+            'X-RateLimit-Reset': str(max(0, int(math.ceil(self.reset_after)))),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, int(math.ceil(self.retry_after))))
+        return headers
+
+
+def _evaluate(limit, stored_tat, now):
+    """
+    Pure GCRA step. Returns (result, new_tat); new_tat is None when denied.
+    """
+    interval = limit.emission_interval
+    tat = max(stored_tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - limit.window_seconds
+
+    if now < allow_at:
+        remaining = 0
+        return RateLimitResult(
+            allowed=False,
+            limit=limit.max_requests,
+            remaining=remaining,
+            reset_after=tat - now,
+            retry_after=allow_at - now,
+            window_seconds=limit.window_seconds,
+        ), None
+
+    remaining = int((limit.window_seconds - (new_tat - now)) / interval + 1e-9)
+    return RateLimitResult(
+        allowed=True,
+        limit=limit.max_requests,
+        remaining=remaining,
+        reset_after=new_tat - now,
+        retry_after=0,
+        window_seconds=limit.window_seconds,
+    ), new_tat
+
+
+def _evaluate_all(limits, stored, now):
+    """
+    Evaluates every bucket; the request is allowed only if all of them allow it.
+    Returns (results, updates) where updates maps key -> new TAT (empty if denied).
+    """
+    results = []
+    updates = {}
+    for limit in limits:
+        result, new_tat = _evaluate(limit, stored.get(limit.key), now)
+        results.append(result)
+        if new_tat is not None:
+            updates[limit.key] = new_tat
+    if not all(r.allowed for r in results):
+        updates = {}
+    return results, updates
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._tats = {}
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def hit(self, limits, now):
+        with self._lock:
+            stored = {l.key: self._tats.get(l.key) for l in limits}
+            results, updates = _evaluate_all(limits, stored, now)
+            self._tats.update(updates)
+            if now - self._last_purge >= MEMORY_PURGE_INTERVAL:
+                self._purge(now)
+            return results
+
+    def _purge(self, now):
+        for key in [k for k, tat in self._tats.items() if tat <= now]:
+            del self._tats[key]
+        self._last_purge = now
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self._checks = 0
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    bucket TEXT PRIMARY KEY,
+                    tat REAL NOT NULL
+                );
+            """)
+            self._local.conn = conn
+        return conn
+
+    def hit(self, limits, now):
+        conn = self._connect()
+        keys = [l.key for l in limits]
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent processes
+        # cannot interleave between our read and write.
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            placeholders = ','.join('?' for _ in keys)
+            rows = conn.execute(
+                f"SELECT bucket, tat FROM rate_limits WHERE bucket IN ({placeholders});", keys
+            ).fetchall()
+            stored = {bucket: tat for bucket, tat in rows}
+            results, updates = _evaluate_all(limits, stored, now)
+            if updates:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO rate_limits (bucket, tat) VALUES (?, ?);",
+                    list(updates.items())
+                )
+            self._checks += 1
+            if self._checks % SQLITE_PURGE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE tat <= ?;", (now,))
+            conn.execute("COMMIT;")
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+        return results
+
+
+# Atomic multi-bucket GCRA. KEYS = buckets; ARGV = now, then (interval, window) per bucket.
+_REDIS_GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local new_tats = {}
+local out = {}
+local denied = false
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i])
+    local window = tonumber(ARGV[2 * i + 1])
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then tat = now end
+    local new_tat = tat + interval
+    if now < new_tat - window then
+        denied = true
+    end
+    new_tats[i] = new_tat
+    out[i] = tostring(tat)
+end
+if not denied then
+    for i, key in ipairs(KEYS) do
+        local ttl_ms = math.ceil((new_tats[i] - now) * 1000)
+        redis.call('SET', key, tostring(new_tats[i]), 'PX', ttl_ms)
+    end
+end
+return out
+"""
+
+
+class RedisBackend:
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis  # optional dependency
+        # Keys are written with a PX expiry, so idle buckets evict themselves.
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_GCRA_SCRIPT)
+        self._prefix = prefix
+
+    def hit(self, limits, now):
+        keys = [self._prefix + l.key for l in limits]
+        args = [now]
+        for l in limits:
+            args.extend([l.emission_interval, l.window_seconds])
+        previous = self._script(keys=keys, args=args)
+        # Redis returns the TATs it saw; replay the same pure step locally for the headers.
+        stored = {l.key: float(tat) for l, tat in zip(limits, previous)}
+        results, _ = _evaluate_all(limits, stored, now)
+        return results
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def hit(self, limits):
+        """
+        Consumes one request from every bucket in `limits` (all or nothing).
+        Returns the RateLimitResult of the most restrictive bucket, or None when
+        no limits apply.
+        """
+        limits = [l for l in limits if l and l.max_requests > 0 and l.window_seconds > 0]
+        if not limits:
+            return None
+        try:
+            results = self.backend.hit(limits, time.time())
+        except Exception as e:
+            print(f"[RateLimiter] Backend error, allowing request: {e}")
+            return None
+
+        denied = [r for r in results if not r.allowed]
+        if denied:
+            return max(denied, key=lambda r: r.retry_after)
+        return min(results, key=lambda r: (r.remaining, -r.reset_after))
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def _build_backend(app):
+    backend = (app.config.get('RATE_LIMIT_BACKEND') or 'sqlite').strip().lower()
+    if backend not in RATE_LIMIT_BACKENDS:
+        print(f"[RateLimiter] Unknown backend '{backend}', using sqlite.")
+        backend = 'sqlite'
+
+    if backend == 'redis':
+        url = app.config.get('RATE_LIMIT_REDIS_URL')
+        try:
+            return RedisBackend(url)
+        except Exception as e:
+            print(f"[RateLimiter] Redis backend unavailable ({e}); falling back to sqlite.")
+            backend = 'sqlite'
+
+    if backend == 'sqlite':
+        path = os.path.join(app.instance_path, app.config.get('RATE_LIMIT_DB_FILE', 'rate_limits.sqlite'))
+        return SQLiteBackend(path)
+
+    return MemoryBackend()
+
+
+def get_rate_limiter(app):
+    """Returns the process-wide limiter, creating it from the app config on first use."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(_build_backend(app))
+    return _limiter
@@ -5,15 +5,190 @@ Handles efficient multipart file upload without base64 encoding
 
 import requests
 import os
+import uuid
 import tempfile
-from typing import Dict, Optional, Any, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Optional, Any, List, Tuple
+
+# Shared keep-alive pools (one per host) for every remote API call
+HTTP_POOL_CONNECTIONS = 20
+HTTP_POOL_MAXSIZE = 50
+# Connection failures are retried for any method (nothing was sent yet);
+# 502/503/504 only for idempotent methods, since inference POSTs are not.
+HTTP_RETRY = Retry(
+    total=3,
+    connect=3,
+    read=0,
+    status=2,
+    backoff_factor=0.5,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+    raise_on_status=False
+)
+# Files larger than this are streamed from disk instead of read into memory
+STREAMING_UPLOAD_THRESHOLD = 8 * 1024 * 1024
+UPLOAD_READ_SIZE = 1024 * 1024
+
+# Input prefetching (URLs given instead of uploads)
+PREFETCH_MAX_BYTES = 200 * 1024 * 1024
+PREFETCH_TIMEOUT = (10, 60)  # (connect, read) seconds
+PREFETCH_MAX_WORKERS = 4
+# Accepted Content-Type prefixes per input kind; None accepts anything.
+# Generic binary types are always accepted since object stores often use them.
+PREFETCH_ALLOWED_TYPES = {
+    'image': ('image/',),
+    'audio': ('audio/', 'video/'),
+    'file': None,
+}
+GENERIC_BINARY_TYPES = ('application/octet-stream', 'binary/octet-stream', '')
+
+# Gradio endpoint variants, in probing order
+ENDPOINT_VARIANTS = ('', '/run/predict', '/api/predict')
+
+_session = None
+_session_lock = threading.Lock()
+
+# base URL -> endpoint suffix that last worked for it
+_endpoint_variant_cache: Dict[str, str] = {}
+
+
+def get_http_session() -> requests.Session:
+    """Process-wide requests.Session with pooled, retrying adapters."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    max_retries=HTTP_RETRY
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _stream_size(stream) -> int:
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell() - position
+    stream.seek(position)
+    return size
+
+
+class StreamingMultipartBody:
+    """
+    File-like multipart/form-data body that reads uploaded files from disk in
+    chunks while requests sends it, so large inputs never sit in memory.
+    It exposes __len__, so requests sends a Content-Length instead of chunked
+    encoding; some Gradio/uvicorn deployments reject chunked uploads.
+
+    `files` values are paths, or (filename, seekable stream, content_type)
+    tuples for data that is already open (e.g. a werkzeug FileStorage
+    stream); streams are read from their current position and not closed.
+    `on_progress(sent, total)` is called as the body is consumed.
+    """
+
+    def __init__(self, fields: Dict[str, Any], files: Dict[str, Any], on_progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self._parts: List[Tuple[str, Any]] = []
+        for name, value in fields.items():
+            values = value if isinstance(value, (list, tuple)) else [value]
+            for item in values:
+                self._parts.append(('bytes', (
+                    f'--{self.boundary}\r\n'
+                    f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                    f'{item}\r\n'
+                ).encode('utf-8')))
+        for name, source in files.items():
+            if isinstance(source, tuple):
+                filename, stream, content_type = source
+                kind, part = 'stream', stream
+            else:
+                filename, content_type = os.path.basename(source), None
+                kind, part = 'file', source
+            filename = filename.replace('"', '')
+            self._parts.append(('bytes', (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type or "application/octet-stream"}\r\n\r\n'
+            ).encode('utf-8')))
+            self._parts.append((kind, part))
+            self._parts.append(('bytes', b'\r\n'))
+        self._parts.append(('bytes', f'--{self.boundary}--\r\n'.encode('utf-8')))
+        self._length = sum(
+            len(part) if kind == 'bytes' else
+            os.path.getsize(part) if kind == 'file' else
+            _stream_size(part)
+            for kind, part in self._parts
+        )
+        self._index = 0
+        self._current = None
+        self._owns_current = False
+        self._buffer = b''
+        self._sent = 0
+        self._on_progress = on_progress
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._length
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            if self._buffer:
+                chunk, self._buffer = self._buffer[:remaining], self._buffer[remaining:]
+            elif self._current is not None:
+                chunk = self._current.read(min(remaining, UPLOAD_READ_SIZE))
+                if not chunk:
+                    if self._owns_current:
+                        self._current.close()
+                    self._current = None
+                    continue
+            elif self._index < len(self._parts):
+                kind, part = self._parts[self._index]
+                self._index += 1
+                if kind == 'bytes':
+                    self._buffer = part
+                elif kind == 'file':
+                    self._current = open(part, 'rb')
+                    self._owns_current = True
+                else:
+                    self._current = part
+                    self._owns_current = False
+                continue
+            else:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        data = b''.join(chunks)
+        if data and self._on_progress:
+            self._sent += len(data)
+            self._on_progress(self._sent, self._length)
+        return data
+
+    def close(self):
+        if self._current is not None and self._owns_current:
+            self._current.close()
+        self._current = None
 
 
 def call_remote_api(
     api_url: str,
     files_dict: Optional[Dict[str, str]] = None,
     params_dict: Optional[Dict[str, Any]] = None,
-    timeout: int = 300
+    timeout: int = 300,
+    headers: Optional[Dict[str, str]] = None,
+    allow_text: bool = False
 ) -> Dict[str, Any]:
     """
     Call remote API with multipart file upload (no base64 encoding)
@@ -23,67 +198,115 @@ def call_remote_api(
         files_dict: Dictionary of {field_name: file_path}
         params_dict: Dictionary of other parameters
         timeout: Request timeout in seconds
+        headers: Extra request headers (e.g. Authorization)
+        allow_text: Return a non-JSON body as text instead of failing
     
     Returns:
-        Dict with 'success', 'data', 'error' keys
+        Dict with 'success', 'data', 'error' keys; failures also carry
+        'error_type' ('timeout', 'connection', 'http', 'invalid_response',
+        'unexpected') and 'status_code' when a response was received
     """
     
+    session = get_http_session()
+    existing_files = {
+        field_name: file_path
+        for field_name, file_path in (files_dict or {}).items()
+        if file_path and os.path.exists(file_path)
+    }
+    data = params_dict or {}
+    streaming = sum(os.path.getsize(path) for path in existing_files.values()) > STREAMING_UPLOAD_THRESHOLD
+
     try:
-        # Prepare multipart form data
-        files = {}
-        data = {}
-        
-        # Add files (binary stream, no encoding)
-        if files_dict:
-            for field_name, file_path in files_dict.items():
-                if file_path and os.path.exists(file_path):
-                    files[field_name] = open(file_path, 'rb')
-        
-        # Add other parameters
-        if params_dict:
-            data = params_dict
-        
-        # Send request
-        response = requests.post(
-            api_url,
-            files=files if files else None,
-            data=data if data else None,
-            timeout=timeout
-        )
-        
-        # Close all opened files
-        for f in files.values():
-            if hasattr(f, 'close'):
-                f.close()
-        
-        response.raise_for_status()
-        
+        if streaming:
+            body = StreamingMultipartBody(data, existing_files)
+            try:
+                response = session.post(
+                    api_url,
+                    data=body,
+                    headers=dict(headers or {}, **{'Content-Type': body.content_type}),
+                    timeout=timeout
+                )
+            finally:
+                body.close()
+        else:
+            with _open_files(existing_files) as files:
+                # Send request
+                response = session.post(
+                    api_url,
+                    files=files if files else None,
+                    data=data if data else None,
+                    headers=headers,
+                    timeout=timeout
+                )
+
+        if response.status_code >= 400:
+            return {
+                'success': False,
+                'error': f'Request failed: HTTP {response.status_code} {response.reason}',
+                'error_type': 'http',
+                'status_code': response.status_code,
+                'body': response.text[:2000]
+            }
+
         # Parse response
-        result_data = response.json() if response.content else {}
-        
+        try:
+            result_data = response.json() if response.content else {}
+        except ValueError:
+            if not allow_text:
+                return {
+                    'success': False,
+                    'error': 'Response is not valid JSON',
+                    'error_type': 'invalid_response',
+                    'status_code': response.status_code,
+                    'body': response.text[:2000]
+                }
+            result_data = response.text
+
         return {
             'success': True,
             'data': result_data,
             'status_code': response.status_code
         }
-        
+
     except requests.exceptions.Timeout:
         return {
             'success': False,
-            'error': f'Request timeout after {timeout} seconds'
+            'error': f'Request timeout after {timeout} seconds',
+            'error_type': 'timeout'
+        }
+    except requests.exceptions.ConnectionError as e:
+        return {
+            'success': False,
+            'error': f'Request failed: {str(e)}',
+            'error_type': 'connection'
         }
     except requests.exceptions.RequestException as e:
         return {
             'success': False,
-            'error': f'Request failed: {str(e)}'
+            'error': f'Request failed: {str(e)}',
+            'error_type': 'connection'
         }
     except Exception as e:
         return {
             'success': False,
-            'error': f'Unexpected error: {str(e)}'
+            'error': f'Unexpected error: {str(e)}',
+            'error_type': 'unexpected'
         }
 
 
+@contextlib.contextmanager
+def _open_files(files_dict: Dict[str, str]):
+    """Opens {field: path} for a multipart upload and always closes them."""
+    opened = {}
+    try:
+        for field_name, file_path in files_dict.items():
+            opened[field_name] = open(file_path, 'rb')
+        yield opened
+    finally:
+        for f in opened.values():
+            f.close()
+
+
 
 def smart_call_remote_api(
     api_url: str,
@@ -96,39 +319,43 @@ def smart_call_remote_api(
     Retries with /run/predict (Gradio 4+) and /api/predict (Gradio 3) if base URL fails.
     """
     
-    # List of URLs to try
-    urls_to_try = [api_url]
-    
-    # If URL is a base URL (no specific path), prioritize common Gradio paths
     clean_url = api_url.rstrip('/')
-    if clean_url == api_url or api_url.endswith('/'):
-        # Usually users paste the base URL e.g. http://host:21564/
-        # We should try specific endpoints if the raw one fails
-        urls_to_try.append(f"{clean_url}/run/predict") # Gradio 4.x
-        urls_to_try.append(f"{clean_url}/api/predict") # Gradio 3.x
-        
+    cached_suffix = _endpoint_variant_cache.get(clean_url)
+
+    # List of URLs to try: the variant that worked last time first, then the rest.
+    # Usually users paste the base URL e.g. http://host:21564/, which needs
+    # /run/predict (Gradio 4.x) or /api/predict (Gradio 3.x).
+    suffixes = list(ENDPOINT_VARIANTS)
+    if cached_suffix is not None:
+        suffixes.remove(cached_suffix)
+        suffixes.insert(0, cached_suffix)
+
     last_result = {'success': False, 'error': 'Unknown error'}
-    
-    for try_url in urls_to_try:
+
+    for suffix in suffixes:
+        try_url = f"{clean_url}{suffix}" if suffix else api_url
         print(f"DEBUG: Trying Remote API: {try_url}")
         result = call_remote_api(try_url, files_dict, params_dict, timeout)
-        
+
         if result['success']:
+            if cached_suffix != suffix:
+                _endpoint_variant_cache[clean_url] = suffix
             return result
-            
+
         # If failed with 404 or 405, continue to next candidate
         # If it's a connection error or 500, probably no point trying other paths on same host
-        error_msg = result.get('error', '')
         status_code = result.get('status_code')
-        
-        if status_code in [404, 405] or '404' in error_msg or '405' in error_msg:
-             print(f"DEBUG: {try_url} failed with {status_code}, trying next...")
-             last_result = result
-             continue
+
+        if status_code in [404, 405]:
+            print(f"DEBUG: {try_url} failed with {status_code}, trying next...")
+            if suffix == cached_suffix:
+                _endpoint_variant_cache.pop(clean_url, None)
+            last_result = result
+            continue
         else:
             # Fatal error (e.g. connection refused), stop trying
             return result
-            
+
     return last_result
 
 
@@ -159,7 +386,7 @@ def call_gradio_api(
             "fn_index": 0
         }
         
-        response = requests.post(
+        response = get_http_session().post(
             api_url,
             json=payload,
             timeout=timeout
@@ -182,6 +409,63 @@ def call_gradio_api(
         )
 
 
+def _fetch_to_temp(url: str, kind: str, prefix: str) -> Dict[str, Any]:
+    allowed = PREFETCH_ALLOWED_TYPES.get(kind)
+    try:
+        with get_http_session().get(url, stream=True, timeout=PREFETCH_TIMEOUT) as response:
+            response.raise_for_status()
+
+            content_type = (response.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+            if allowed and content_type not in GENERIC_BINARY_TYPES and not content_type.startswith(allowed):
+                return {'error': f'{url} 的内容类型 {content_type} 不是有效的 {kind} 文件'}
+
+            declared = response.headers.get('Content-Length')
+            if declared and declared.isdigit() and int(declared) > PREFETCH_MAX_BYTES:
+                return {'error': f'{url} 超过大小限制 ({PREFETCH_MAX_BYTES // (1024 * 1024)}MB)'}
+
+            suffix = os.path.splitext(url.split('?')[0])[1] or '.bin'
+            received = 0
+            with tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix=suffix) as tmp:
+                try:
+                    for chunk in response.iter_content(chunk_size=UPLOAD_READ_SIZE):
+                        received += len(chunk)
+                        if received > PREFETCH_MAX_BYTES:
+                            raise ValueError(f'{url} 超过大小限制 ({PREFETCH_MAX_BYTES // (1024 * 1024)}MB)')
+                        tmp.write(chunk)
+                except Exception:
+                    tmp.close()
+                    os.remove(tmp.name)
+                    raise
+            return {'path': tmp.name}
+    except Exception as e:
+        print(f"Failed to download {url}: {e}")
+        return {'error': str(e)}
+
+
+def prefetch_urls(url_inputs: Dict[str, Tuple[str, str, str]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Downloads several input URLs concurrently over the shared session.
+
+    Args:
+        url_inputs: {name: (url, kind, temp_prefix)}, kind in PREFETCH_ALLOWED_TYPES
+
+    Returns:
+        {name: {'path': temp_path}} or {name: {'error': message}} per input;
+        failed downloads leave no temp files behind
+    """
+    if not url_inputs:
+        return {}
+    if len(url_inputs) == 1:
+        name, (url, kind, prefix) = next(iter(url_inputs.items()))
+        return {name: _fetch_to_temp(url, kind, prefix)}
+    with ThreadPoolExecutor(max_workers=min(PREFETCH_MAX_WORKERS, len(url_inputs))) as pool:
+        futures = {
+            name: pool.submit(_fetch_to_temp, url, kind, prefix)
+            for name, (url, kind, prefix) in url_inputs.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
 def download_result_file(
     result_url: str,
     save_path: Optional[str] = None
@@ -198,20 +482,20 @@ def download_result_file(
     """
     
     try:
-        response = requests.get(result_url, stream=True, timeout=60)
-        response.raise_for_status()
-        
-        if not save_path:
-            # Create temp file
-            suffix = os.path.splitext(result_url)[1] or '.bin'
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                save_path = tmp.name
-        
-        # Download file
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
+        with get_http_session().get(result_url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+
+            if not save_path:
+                # Create temp file
+                suffix = os.path.splitext(result_url)[1] or '.bin'
+                with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                    save_path = tmp.name
+
+            # Download file
+            with open(save_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=UPLOAD_READ_SIZE):
+                    f.write(chunk)
+
         return save_path
         
     except Exception as e:
@@ -1,43 +1,65 @@
 """
 Remote Inference Module
-Handles remote GPU inference through Gradio client with curl fallback.
+Handles remote GPU inference through the pooled HTTP client in remote_api_client.
 Supports queuing, audio uploads, prompt management, and provides admin templates.
 """
 
 import os
-import json
 import time
 import wave
 import struct
 import math
-import subprocess
 import tempfile
+import threading
 from flask import current_app
 from .database import load_db, save_db
+from .remote_api_client import call_remote_api
 
+# config id -> owning username, so lookups do not scan every user.
+# Entries are verified on use and the index is rebuilt on a miss, so it
+# never has to be invalidated explicitly.
+_config_owner_index = {}
+_config_index_lock = threading.Lock()
 
-def generate_curl_command(api_url, params, files=None):
-    """
-    Generate a curl command for remote API requests without exposing API URL in logs.
-    Returns a tuple of (command_list, sanitized_display_command)
-    """
-    # Build curl command
-    cmd = ['curl', '-X', 'POST', api_url]
-    cmd.extend(['-H', 'Content-Type: multipart/form-data'])
-    
-    # Add files
-    if files:
-        for field_name, file_path in files.items():
-            cmd.extend(['-F', f'{field_name}=@{file_path}'])
-    
-    # Add data params
-    for key, value in params.items():
-        cmd.extend(['-F', f'{key}={value}'])
-    
-    # Create sanitized version for display (hide actual API URL)
-    sanitized_cmd = ' '.join(cmd).replace(api_url, '<HIDDEN_API_URL>')
-    
-    return cmd, sanitized_cmd
+
+def remember_config_owner(config_id, username):
+    """Records the owner of a newly created remote inference config."""
+    with _config_index_lock:
+        _config_owner_index[config_id] = username
+
+
+def _rebuild_config_index(db):
+    index = {}
+    for username, user_data in db.get('users', {}).items():
+        for c in user_data.get('remote_inference_configs', []):
+            if c.get('id'):
+                index[c['id']] = username
+    with _config_index_lock:
+        _config_owner_index.clear()
+        _config_owner_index.update(index)
+
+
+def find_remote_config(db, config_id):
+    """Returns the remote inference config with this id, or None."""
+    def lookup():
+        username = _config_owner_index.get(config_id)
+        user_data = db.get('users', {}).get(username) if username else None
+        if not user_data:
+            return None
+        return next((c for c in user_data.get('remote_inference_configs', []) if c.get('id') == config_id), None)
+
+    config = lookup()
+    if config is None:
+        _rebuild_config_index(db)
+        config = lookup()
+    return config
+
+
+def _describe_request(params, files=None):
+    """Log-friendly summary of a remote request that never includes the API URL."""
+    fields = ', '.join(f'{k}={v!r}' for k, v in params.items()) or '-'
+    uploads = ', '.join(f'{k}=@{os.path.basename(p)}' for k, p in (files or {}).items()) or '-'
+    return f'POST <HIDDEN_API_URL>\nFields: {fields}\nFiles: {uploads}'
 
 
 def execute_remote_inference(config_id, params, uploaded_files=None):
@@ -50,24 +72,19 @@ def execute_remote_inference(config_id, params, uploaded_files=None):
         uploaded_files: Dictionary of {field_name: file_path} for file uploads
     
     Returns:
-        Dict with status, result, and logs
+        Dict with status, result, and logs; errors also carry error_type
+        and, when the remote answered, status_code
     """
     db = load_db()
     
     # Find configuration
-    config = None
-    for user_data in db.get('users', {}).values():
-        for c in user_data.get('remote_inference_configs', []):
-            if c.get('id') == config_id:
-                config = c
-                break
-        if config:
-            break
+    config = find_remote_config(db, config_id)
     
     if not config:
         return {
             'status': 'error',
             'error': 'Configuration not found',
+            'error_type': 'config',
             'logs': 'Remote inference configuration does not exist'
         }
     
@@ -76,56 +93,54 @@ def execute_remote_inference(config_id, params, uploaded_files=None):
         return {
             'status': 'error',
             'error': 'API URL not configured',
+            'error_type': 'config',
             'logs': 'Remote inference API URL is missing'
         }
-    
-    try:
-        # Generate curl command
-        cmd, sanitized_cmd = generate_curl_command(api_url, params, uploaded_files)
-        
-        # Execute
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=config.get('timeout', 300)
-        )
-        
-        if result.returncode == 0:
-            # Parse response
-            try:
-                response = json.loads(result.stdout)
-                return {
-                    'status': 'completed',
-                    'result': response,
-                    'logs': f'Command: {sanitized_cmd}\n\nResponse received successfully'
-                }
-            except json.JSONDecodeError:
-                return {
-                    'status': 'completed',
-                    'result': result.stdout,
-                    'logs': f'Command: {sanitized_cmd}\n\nRaw response:\n{result.stdout}'
-                }
+
+    timeout = config.get('timeout', 300)
+    headers = {'Authorization': f"Bearer {config['api_token']}"} if config.get('api_token') else None
+    description = _describe_request(params, uploaded_files)
+    started_at = time.time()
+
+    result = call_remote_api(
+        api_url,
+        files_dict=uploaded_files,
+        params_dict=params,
+        timeout=timeout,
+        headers=headers,
+        allow_text=True
+    )
+    elapsed = time.time() - started_at
+
+    if result['success']:
+        response = result['data']
+        if isinstance(response, str):
+            logs = f'{description}\n\nRaw response ({elapsed:.1f}s):\n{response}'
         else:
-            return {
-                'status': 'error',
-                'error': result.stderr,
-                'logs': f'Command: {sanitized_cmd}\n\nError:\n{result.stderr}'
-            }
-            
-    except subprocess.TimeoutExpired:
+            logs = f'{description}\n\nResponse received successfully ({elapsed:.1f}s)'
         return {
-            'status': 'error',
-            'error': 'Request timeout',
-            'logs': f'Request exceeded timeout of {config.get("timeout", 300)} seconds'
-        }
-    except Exception as e:
-        return {
-            'status': 'error',
-            'error': str(e),
-            'logs': f'Execution error: {str(e)}'
+            'status': 'completed',
+            'result': response,
+            'logs': logs
         }
 
+    error_type = result.get('error_type', 'unexpected')
+    if error_type == 'timeout':
+        logs = f'Request exceeded timeout of {timeout} seconds'
+    else:
+        logs = f'{description}\n\nError:\n{result["error"]}'
+        if result.get('body'):
+            logs += f'\n\nResponse body:\n{result["body"]}'
+    error = {
+        'status': 'error',
+        'error': 'Request timeout' if error_type == 'timeout' else result['error'],
+        'error_type': error_type,
+        'logs': logs
+    }
+    if result.get('status_code'):
+        error['status_code'] = result['status_code']
+    return error
+
 
 def get_admin_template_code(config_type='audio_generation'):
     """
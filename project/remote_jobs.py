@@ -0,0 +1,177 @@
+"""
+Background jobs for remote_inference spaces.
+
+run_inference submits the remote API call here and returns a job id at once
+instead of holding a web worker for the whole GPU run. The job runs on a
+bounded thread pool; its outcome is kept in `remote_jobs` for polling, pushed
+to the user's sockets ('remote_inference_complete') and persisted into
+user_states[username]['remote_inference_results'][ai_project_id] so it
+survives a page refresh or a restart.
+"""
+import os
+import time
+import uuid
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from .database import load_db, save_db
+from .remote_api_client import smart_call_remote_api
+
+# Finished jobs are kept in memory this long for polling; the persisted
+# user_states entry remains afterwards.
+REMOTE_JOB_RETENTION_SECONDS = 3600
+# A persisted 'pending' result older than the call timeout plus this is treated as lost
+REMOTE_JOB_GRACE_SECONDS = 120
+
+# job_id -> {'status', 'username', 'ai_project_id', 'created_at', 'finished_at', 'data', 'error'}
+remote_jobs = {}
+_jobs_lock = threading.Lock()
+# Serializes the load_db/save_db round trip so concurrent jobs don't drop each other's results
+_persist_lock = threading.Lock()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(app):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=app.config.get('REMOTE_INFERENCE_JOB_WORKERS', 8),
+                    thread_name_prefix='remote-inference'
+                )
+    return _executor
+
+
+def _result_payload(job_id, status, data=None, error=None):
+    now = datetime.utcnow()
+    return {
+        'job_id': job_id,
+        'status': status,
+        'data': data,
+        'error': error,
+        'saved_at': now.isoformat(timespec='milliseconds') + 'Z',
+        'saved_at_ms': int(now.timestamp() * 1000)
+    }
+
+
+def _persist_result(username, ai_project_id, payload):
+    with _persist_lock:
+        db = load_db()
+        state = db.setdefault('user_states', {}).setdefault(username, {})
+        state.setdefault('remote_inference_results', {})[ai_project_id] = payload
+        save_db(db)
+
+
+def _notify_user(username, payload):
+    from .websocket_server import get_socketio, user_sockets
+    sio = get_socketio()
+    if not sio:
+        return
+    for sid in list(user_sockets.get(username, [])):
+        sio.emit('remote_inference_complete', payload, room=sid)
+
+
+def _prune_finished(now):
+    with _jobs_lock:
+        expired = [
+            job_id for job_id, job in remote_jobs.items()
+            if job.get('finished_at') and now - job['finished_at'] > REMOTE_JOB_RETENTION_SECONDS
+        ]
+        for job_id in expired:
+            del remote_jobs[job_id]
+
+
+def _run_job(app, job_id, api_url, files_dict, params_dict, timeout, temp_files):
+    job = remote_jobs[job_id]
+    job['status'] = 'running'
+    try:
+        result = smart_call_remote_api(
+            api_url=api_url,
+            files_dict=files_dict or None,
+            params_dict=params_dict,
+            timeout=timeout
+        )
+        if result['success']:
+            job.update(status='completed', data=result.get('data'))
+        else:
+            job.update(status='failed', error=result.get('error', 'API调用失败'))
+    except Exception as e:
+        print(f"[RemoteJobs] Job {job_id} failed: {e}")
+        job.update(status='failed', error=str(e))
+    finally:
+        job['finished_at'] = time.time()
+        for temp_file in temp_files:
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            except OSError:
+                pass
+
+    payload = _result_payload(job_id, job['status'], job.get('data'), job.get('error'))
+    try:
+        with app.app_context():
+            _persist_result(job['username'], job['ai_project_id'], payload)
+    except Exception as e:
+        print(f"[RemoteJobs] Could not persist result of job {job_id}: {e}")
+    try:
+        _notify_user(job['username'], dict(payload, ai_project_id=job['ai_project_id']))
+    except Exception as e:
+        print(f"[RemoteJobs] Could not notify {job['username']} about job {job_id}: {e}")
+
+
+def submit_remote_job(app, username, ai_project_id, api_url, files_dict, params_dict, timeout, temp_files):
+    """
+    Queues a remote API call and returns its job id. The job takes ownership
+    of `temp_files` and deletes them when it finishes.
+    """
+    now = time.time()
+    _prune_finished(now)
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        remote_jobs[job_id] = {
+            'status': 'queued',
+            'username': username,
+            'ai_project_id': ai_project_id,
+            'created_at': now,
+            'finished_at': None,
+            'data': None,
+            'error': None,
+        }
+    pending = _result_payload(job_id, 'pending')
+    # Lets other processes (and this one after a restart) tell a running job from a lost one
+    pending['expires_at_ms'] = pending['saved_at_ms'] + int((timeout + REMOTE_JOB_GRACE_SECONDS) * 1000)
+    _persist_result(username, ai_project_id, pending)
+    _get_executor(app).submit(_run_job, app, job_id, api_url, files_dict, params_dict, timeout, list(temp_files))
+    return job_id
+
+
+def get_remote_job(job_id, username, db=None):
+    """
+    Job state as a dict for `username`, or None. Falls back to the persisted
+    result when the job is no longer in memory (e.g. after a restart).
+    """
+    job = remote_jobs.get(job_id)
+    if job:
+        if job['username'] != username:
+            return None
+        return {
+            'job_id': job_id,
+            'ai_project_id': job['ai_project_id'],
+            'status': job['status'],
+            'data': job.get('data'),
+            'error': job.get('error'),
+        }
+
+    db = db if db is not None else load_db()
+    results = db.get('user_states', {}).get(username, {}).get('remote_inference_results', {})
+    for ai_project_id, result in results.items():
+        if isinstance(result, dict) and result.get('job_id') == job_id:
+            expires_at_ms = result.get('expires_at_ms') or 0
+            if result.get('status') == 'pending' and expires_at_ms < time.time() * 1000:
+                return dict(result, ai_project_id=ai_project_id, status='failed', error='任务已中断，请重新提交')
+            return dict(result, ai_project_id=ai_project_id)
+    return None
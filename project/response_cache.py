@@ -0,0 +1,108 @@
+"""
+In-process LRU + TTL cache for deterministic NetMind chat completions.
+
+Only requests that ask for deterministic output (temperature 0, a single
+choice) are cacheable. Entries are keyed by a SHA-256 of the canonical JSON
+of everything that can change the answer, so key order in the request body
+does not matter.
+"""
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_RESPONSE_CACHE_TTL_SECONDS = 600
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 1000
+
+
+def is_cacheable_request(params):
+    """
+    True when the sampling parameters make the upstream answer deterministic.
+    """
+    try:
+        temperature = float(params.get('temperature'))
+    except (TypeError, ValueError):
+        return False
+    if temperature != 0:
+        return False
+    if params.get('n') not in (None, 1):
+        return False
+    return True
+
+
+def build_cache_key(model, messages, params):
+    canonical = json.dumps(
+        {'model': model, 'messages': messages, 'params': params},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds, max_entries):
+        if ttl_seconds <= 0 or max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits * 100 / lookups, 1) if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def get_cache_config(settings=None):
+    """
+    Returns (enabled, ttl_seconds, max_entries) from the NetMind settings.
+    """
+    settings = settings or {}
+    try:
+        ttl = max(0, int(settings.get('response_cache_ttl_seconds', DEFAULT_RESPONSE_CACHE_TTL_SECONDS)))
+    except (TypeError, ValueError):
+        ttl = DEFAULT_RESPONSE_CACHE_TTL_SECONDS
+    try:
+        max_entries = max(0, int(settings.get('response_cache_max_entries', DEFAULT_RESPONSE_CACHE_MAX_ENTRIES)))
+    except (TypeError, ValueError):
+        max_entries = DEFAULT_RESPONSE_CACHE_MAX_ENTRIES
+    return bool(settings.get('response_cache_enabled')), ttl, max_entries
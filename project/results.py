@@ -1,9 +1,10 @@
 from flask import (
     Blueprint, render_template, request, redirect, url_for, session, flash,
-    Response, stream_with_context
+    Response, stream_with_context, current_app
 )
 import requests
 from .s3_utils import list_files_for_user, get_public_s3_url
+from .derivatives import attach_preview_urls
 
 results_bp = Blueprint('results', __name__, url_prefix='/results')
 
@@ -35,11 +36,7 @@ def my_results():
         for file in s3_files:
             file['is_image'] = is_image(file['filename'])
             file['is_video'] = is_video(file['filename'])
-            if file['is_image'] or file['is_video']:
-                file['preview_url'] = get_public_s3_url(file['key'])
-            else:
-                file['preview_url'] = None
-
+        attach_preview_urls(current_app._get_current_object(), username, s3_files)
 
     return render_template('my_results.html', files=s3_files)
 
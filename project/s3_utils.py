@@ -1,5 +1,5 @@
 import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+from botocore.exceptions import NoCredentialsError, ClientError, BotoCoreError
 import json
 import os
 from flask import current_app
@@ -161,6 +161,141 @@ def upload_file_to_s3(file_path, object_name, content_type=None):
         print(f"File not found: {file_path}")
         return False
 
+def _get_bucket_client():
+    """Returns (s3_client, bucket_name) or (None, None) when S3 is not configured."""
+    s3_client = get_s3_client()
+    s3_config = get_s3_config()
+    if not s3_client or not s3_config:
+        print("S3 client or config not available.")
+        return None, None
+    bucket_name = s3_config.get('S3_BUCKET_NAME')
+    if not bucket_name:
+        print("S3 bucket name not configured.")
+        return None, None
+    return s3_client, bucket_name
+
+def create_multipart_upload(object_name, content_type=None):
+    """
+    Starts an S3 multipart upload.
+
+    :return: The multipart UploadId, or None on failure.
+    """
+    s3_client, bucket_name = _get_bucket_client()
+    if not s3_client:
+        return None
+    try:
+        params = {'Bucket': bucket_name, 'Key': object_name}
+        if content_type:
+            params['ContentType'] = content_type
+        response = s3_client.create_multipart_upload(**params)
+        return response['UploadId']
+    except (ClientError, BotoCoreError) as e:
+        print(f"Failed to create multipart upload for {object_name}: {e}")
+        return None
+
+def upload_part(object_name, upload_id, part_number, data):
+    """
+    Uploads one part (1-based part_number) of a multipart upload.
+    Every part except the last must be at least 5 MiB.
+
+    :return: The part's ETag, or None on failure.
+    """
+    s3_client, bucket_name = _get_bucket_client()
+    if not s3_client:
+        return None
+    try:
+        response = s3_client.upload_part(
+            Bucket=bucket_name,
+            Key=object_name,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=bytes(data)
+        )
+        return response['ETag']
+    except (ClientError, BotoCoreError) as e:
+        print(f"Failed to upload part {part_number} of {object_name}: {e}")
+        return None
+
+def complete_multipart_upload(object_name, upload_id, parts):
+    """
+    Completes a multipart upload.
+
+    :param parts: dict of {part_number: etag}.
+    :return: True if successful, False otherwise.
+    """
+    s3_client, bucket_name = _get_bucket_client()
+    if not s3_client:
+        return False
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=object_name,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'PartNumber': number, 'ETag': etag} for number, etag in sorted(parts.items())
+            ]}
+        )
+        print(f"Successfully completed multipart upload s3://{bucket_name}/{object_name}")
+        return True
+    except (ClientError, BotoCoreError) as e:
+        print(f"Failed to complete multipart upload for {object_name}: {e}")
+        return False
+
+def abort_multipart_upload(object_name, upload_id):
+    """
+    Aborts a multipart upload so S3 discards the stored parts.
+
+    :return: True if successful, False otherwise.
+    """
+    s3_client, bucket_name = _get_bucket_client()
+    if not s3_client:
+        return False
+    try:
+        s3_client.abort_multipart_upload(Bucket=bucket_name, Key=object_name, UploadId=upload_id)
+        return True
+    except (ClientError, BotoCoreError) as e:
+        print(f"Failed to abort multipart upload for {object_name}: {e}")
+        return False
+
+def download_s3_object(object_key, file_path):
+    """
+    Downloads an object to a local file.
+
+    :return: True if successful, False otherwise.
+    """
+    s3_client, bucket_name = _get_bucket_client()
+    if not s3_client:
+        return False
+    try:
+        s3_client.download_file(bucket_name, object_key, file_path)
+        return True
+    except ClientError as e:
+        print(f"Failed to download {object_key} from S3: {e}")
+        return False
+
+def list_keys_with_prefix(prefix):
+    """
+    Lists every object key under a prefix.
+
+    :return: A set of keys, or None if an error occurs.
+    """
+    s3_client, bucket_name = _get_bucket_client()
+    if not s3_client:
+        return None
+    try:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        keys = set()
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for item in page.get('Contents', []):
+                keys.add(item['Key'])
+        return keys
+    except ClientError as e:
+        print(f"Failed to list objects under {prefix}: {e}")
+        return None
+    except NoCredentialsError:
+        print("Credentials not available for S3.")
+        return None
+
 def delete_s3_object(object_key):
     """
     Delete an object from the S3 bucket.
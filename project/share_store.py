@@ -0,0 +1,211 @@
+"""
+Modal Drive share links, stored in the `modal_drive_shares` table of the main
+SQLite file instead of the JSON blob.
+
+Rows are keyed by token with a unique (username, relative_path) index, so
+lookups by link or by file no longer scan every share in the system, and an
+index on expires_at lets the sweeper find expired links cheaply. Shares that
+older versions kept in db['modal_drive_shares'] are moved over by
+migrate_json_shares() on startup.
+"""
+import time
+import secrets
+
+from .database import get_db_connection, get_db_path
+
+SHARE_FIELDS = ('token', 'username', 'relative_path', 'remote_path', 'filename',
+                'public_url', 'created_at', 'expires_at')
+SWEEP_BATCH_SIZE = 100
+
+
+def _ensure_share_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS modal_drive_shares (
+            token TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            relative_path TEXT NOT NULL,
+            remote_path TEXT,
+            filename TEXT,
+            public_url TEXT,
+            created_at REAL,
+            expires_at INTEGER
+        );
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_shares_user_path ON modal_drive_shares (username, relative_path);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_shares_expires ON modal_drive_shares (expires_at);")
+
+
+def _connect():
+    conn = get_db_connection(get_db_path())
+    _ensure_share_schema(conn)
+    return conn
+
+
+def _row_to_share(row):
+    return {field: row[field] for field in SHARE_FIELDS} if row else None
+
+
+def get_share(token):
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM modal_drive_shares WHERE token = ?;", (token,)).fetchone()
+    return _row_to_share(row)
+
+
+def find_share_by_path(username, relative_path):
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT * FROM modal_drive_shares WHERE username = ? AND relative_path = ?;",
+            (username, relative_path)
+        ).fetchone()
+    return _row_to_share(row)
+
+
+def find_shares_by_paths(username, relative_paths):
+    """{relative_path: share} for the given paths of one user."""
+    shares = {}
+    relative_paths = list(relative_paths)
+    with _connect() as conn:
+        for start in range(0, len(relative_paths), 500):
+            chunk = relative_paths[start:start + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            rows = conn.execute(
+                f"SELECT * FROM modal_drive_shares WHERE username = ? AND relative_path IN ({placeholders});",
+                [username] + chunk
+            ).fetchall()
+            for row in rows:
+                shares[row['relative_path']] = _row_to_share(row)
+    return shares
+
+
+def choose_share_token(existing, now=None):
+    """
+    (token, replaced_token) for sharing a path whose current share is
+    `existing` (or None). A live share keeps its token so the link doesn't
+    change. An expired one gets a new token: the sweeper only picks shares
+    that had expired when it started, so it may be revoking the old token at
+    this very moment and must never hit a link that was just handed out.
+    """
+    now = now if now is not None else time.time()
+    if existing and (existing.get('expires_at') is None or existing['expires_at'] > now):
+        return existing['token'], None
+    return secrets.token_urlsafe(16), existing['token'] if existing else None
+
+
+def list_user_shares(username, include_expired=False):
+    query = "SELECT * FROM modal_drive_shares WHERE username = ?"
+    params = [username]
+    if not include_expired:
+        query += " AND (expires_at IS NULL OR expires_at > ?)"
+        params.append(int(time.time()))
+    with _connect() as conn:
+        rows = conn.execute(query + ";", params).fetchall()
+    return [_row_to_share(row) for row in rows]
+
+
+def save_shares(shares):
+    """Inserts or replaces share dicts in one transaction."""
+    if not shares:
+        return
+    rows = [tuple(share.get(field) for field in SHARE_FIELDS) for share in shares]
+    with _connect() as conn:
+        # OR REPLACE also drops an older row for the same (username, relative_path)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO modal_drive_shares ({', '.join(SHARE_FIELDS)}) "
+            f"VALUES ({', '.join('?' for _ in SHARE_FIELDS)});",
+            rows
+        )
+        conn.commit()
+
+
+def delete_shares(tokens, expired_before=None):
+    """
+    Deletes shares by token and returns the number of rows removed. With
+    `expired_before`, only rows that are still expired at that time are
+    removed.
+    """
+    tokens = list(tokens)
+    if not tokens:
+        return 0
+    with _connect() as conn:
+        if expired_before is None:
+            cursor = conn.executemany("DELETE FROM modal_drive_shares WHERE token = ?;", [(t,) for t in tokens])
+        else:
+            cursor = conn.executemany(
+                "DELETE FROM modal_drive_shares WHERE token = ? AND expires_at <= ?;",
+                [(t, int(expired_before)) for t in tokens]
+            )
+        conn.commit()
+    return cursor.rowcount
+
+
+def _still_expired(tokens, now):
+    """The subset of `tokens` whose rows still exist and are expired at `now`."""
+    tokens = list(tokens)
+    placeholders = ','.join('?' for _ in tokens)
+    with _connect() as conn:
+        rows = conn.execute(
+            f"SELECT token FROM modal_drive_shares WHERE token IN ({placeholders}) AND expires_at <= ?;",
+            tokens + [now]
+        ).fetchall()
+    expired = {row['token'] for row in rows}
+    return [t for t in tokens if t in expired]
+
+
+def expired_share_tokens(now=None, limit=SWEEP_BATCH_SIZE, after=''):
+    """Tokens of expired shares, ordered by token and starting after `after`."""
+    now = int(now if now is not None else time.time())
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT token FROM modal_drive_shares WHERE expires_at IS NOT NULL AND expires_at <= ? AND token > ? "
+            "ORDER BY token LIMIT ?;",
+            (now, after, limit)
+        ).fetchall()
+    return [row['token'] for row in rows]
+
+
+def sweep_expired_shares(remote_delete=None, batch_size=SWEEP_BATCH_SIZE):
+    """
+    Deletes expired shares in batches. `remote_delete(tokens)` should revoke
+    them on the drive and return the tokens it managed to delete; the others
+    stay for the next sweep. Without it, rows are only removed locally.
+    Returns the number of rows removed.
+    """
+    removed = 0
+    now = int(time.time())
+    after = ''
+    while True:
+        tokens = expired_share_tokens(now, batch_size, after)
+        if not tokens:
+            break
+        after = tokens[-1]
+        # Skip rows deleted since the select. Re-shares of these paths get a
+        # new token (choose_share_token), so revoking never hits a live link.
+        tokens = _still_expired(tokens, now)
+        if not tokens:
+            continue
+        deleted = set(remote_delete(tokens)) if remote_delete else set(tokens)
+        removed += delete_shares([t for t in tokens if t in deleted], expired_before=now)
+    return removed
+
+
+def migrate_json_shares(db):
+    """
+    Moves shares kept in db['modal_drive_shares'] (the JSON blob) into the
+    table. Returns True when `db` was changed and needs saving.
+    """
+    legacy = db.get('modal_drive_shares')
+    if legacy is None:
+        return False
+    shares = []
+    for token, info in (legacy or {}).items():
+        if not info.get('username') or not info.get('relative_path'):
+            continue
+        shares.append(dict(info, token=token))
+    # Keep the newest share per (username, relative_path) to satisfy the unique index
+    latest = {}
+    for share in sorted(shares, key=lambda s: s.get('created_at') or 0):
+        latest[(share['username'], share['relative_path'])] = share
+    save_shares(list(latest.values()))
+    del db['modal_drive_shares']
+    print(f"[Shares] Migrated {len(latest)} Modal Drive shares to the shares table.")
+    return True
@@ -0,0 +1,103 @@
+"""
+Name lookups for spaces and their templates.
+
+The API and WebSocket paths address spaces by name (and templates by name
+within a space), while db['spaces'] is keyed by id. This module keeps
+name -> [space_id, ...] and (space_id, template name) -> template_id
+indexes so those lookups don't scan every space. Space names are not unique
+(admin doesn't enforce it), so a name maps to every id that carries it.
+
+Admin edits call invalidate_space_index(); a hit is always checked against
+the db that was passed in, and a miss rebuilds the index when the space set
+has changed (e.g. a space added by another worker process), so a stale
+index can never return the wrong space.
+"""
+import time
+import threading
+
+# A miss rebuilds the index at most this often when the space count is unchanged
+SPACE_INDEX_REBUILD_INTERVAL = 5
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _build_index(spaces):
+    names = {}
+    templates = {}
+    for space_id, space in spaces.items():
+        name = space.get('name')
+        if name:
+            names.setdefault(name, []).append(space_id)
+        for template_id, template in (space.get('templates') or {}).items():
+            key = (space_id, template.get('name'))
+            if key[1] and key not in templates:
+                templates[key] = template_id
+    return {
+        'names': names,
+        'templates': templates,
+        'space_count': len(spaces),
+        'built_at': time.time()
+    }
+
+
+def invalidate_space_index():
+    """Drops the index; call after spaces or templates are added, renamed or deleted."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def _get_index(spaces, force=False):
+    global _index
+    with _index_lock:
+        if _index is None or force:
+            _index = _build_index(spaces)
+        return _index
+
+
+def _should_rebuild(index, spaces):
+    return (
+        index['space_count'] != len(spaces)
+        or time.time() - index['built_at'] > SPACE_INDEX_REBUILD_INTERVAL
+    )
+
+
+def find_space_by_name(db, space_name, card_type=None):
+    """
+    The first space named `space_name` in `db` (restricted to `card_type`
+    when given), or None.
+    """
+    spaces = db.get('spaces', {})
+    if not space_name:
+        return None
+    index = _get_index(spaces)
+    for attempt in range(2):
+        for space_id in index['names'].get(space_name, ()):
+            space = spaces.get(space_id)
+            if not space or space.get('name') != space_name:
+                continue
+            if card_type is None or space.get('card_type') == card_type:
+                return space
+        if attempt or not _should_rebuild(index, spaces):
+            return None
+        index = _get_index(spaces, force=True)
+    return None
+
+
+def find_template_by_name(db, space, template_name):
+    """(template_id, template) for `template_name` within `space`, or (None, None)."""
+    templates = space.get('templates') or {}
+    if not template_name or not templates:
+        return None, None
+    spaces = db.get('spaces', {})
+    index = _get_index(spaces)
+    for attempt in range(2):
+        template_id = index['templates'].get((space.get('id'), template_name))
+        template = templates.get(template_id)
+        if template and template.get('name') == template_name:
+            return template_id, template
+        if attempt or not _should_rebuild(index, spaces):
+            return None, None
+        index = _get_index(spaces, force=True)
+    return None, None
@@ -7,7 +7,8 @@ from .database import load_db, save_db
 from .utils import predict_output_filename
 from project import create_app
 import shutil
-from gradio_client import Client, handle_file
+from .derivatives import schedule_derivatives
+from .gradio_runner import gradio_predict, build_gradio_args, DEFAULT_GRADIO_API_NAME
 
 # This dictionary will hold the state of all running/completed tasks.
 # Note: This is in-memory and will be lost on app restart.
@@ -83,31 +84,10 @@ def execute_inference_task(task_id, username, command, temp_upload_paths, user_a
                     tasks[task_id]['logs'] += f'Prompt: {prompt}\n'
 
                     try:
-                        client = Client(api_url)
-
-                        # Prepare dummy wav if needed
-                        dummy_wav = "dummy_prompt.wav"
-                        if not os.path.exists(dummy_wav):
-                            import wave, struct, math
-                            with wave.open(dummy_wav, 'w') as file:
-                                file.setparams((1, 2, 44100, 44100, 'NONE', 'not compressed'))
-                                values = [struct.pack('h', int(math.sin(i/100.0)*32767)) for i in range(44100)]
-                                file.writeframes(b''.join(values))
-
-                        # Call predict
-                        # Hardcoded params for IndexTTS for now, as we don't have a generic param mapper yet
-                        result = client.predict(
-                            "Same as the voice reference",
-                            handle_file(dummy_wav),
-                            prompt,
-                            handle_file(dummy_wav),
-                            0.8,
-                            0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-                            "",
-                            False,
-                            120,
-                            True, 0.8, 30, 0.8, 0.0, 3, 10.0, 1500,
-                            api_name="/generate"
+                        result = gradio_predict(
+                            api_url,
+                            build_gradio_args(template, prompt),
+                            api_name=template.get('gradio_api_name') or DEFAULT_GRADIO_API_NAME
                         )
 
                         # Handle result
@@ -278,6 +258,7 @@ def execute_inference_task(task_id, username, command, temp_upload_paths, user_a
                     tasks[task_id]['logs'] += "\n--- Task completed. Result uploaded to S3. ---\n"
                     tasks[task_id]['result_files'] = [s3_object_name] # Store the S3 object key
                     tasks[task_id]['status'] = 'completed'
+                    schedule_derivatives(app, s3_object_name)
 
                 break # Exit the while loop
 
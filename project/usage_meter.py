@@ -0,0 +1,215 @@
+"""
+Token usage metering for the NetMind chat completions proxy.
+
+Usage from each request is added to in-memory counters bucketed by hour and
+(user, model, upstream key). A background task flushes the counters into the
+`usage_counters` table of the main SQLite file with one batched upsert, so a
+chat request never pays for a save_db(). Reads merge the persisted rows with
+the not-yet-flushed counters.
+"""
+import atexit
+import threading
+from datetime import datetime, timedelta
+
+from .async_support import offload
+from .database import get_db_connection, get_db_path
+
+USAGE_FLUSH_INTERVAL = 10
+USAGE_FLUSH_THRESHOLD = 500
+USAGE_BUCKET_FORMAT = '%Y-%m-%dT%H'
+
+_COUNTER_FIELDS = ('requests', 'prompt_tokens', 'completion_tokens', 'total_tokens')
+
+
+def mask_key(api_key):
+    """Stable, non-secret identifier for an upstream key (same format as the admin page)."""
+    if not api_key:
+        return ''
+    return f"{api_key[:8]}...{api_key[-4:]}"
+
+
+def _ensure_usage_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usage_counters (
+            bucket TEXT NOT NULL,
+            username TEXT NOT NULL,
+            model TEXT NOT NULL,
+            key_id TEXT NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            total_tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, username, model, key_id)
+        );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_user_bucket ON usage_counters (username, bucket);")
+
+
+class UsageMeter:
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._db_path = None
+        # Per-process running total of today's tokens per user, for cheap quota checks
+        self._today = None
+        self._today_totals = {}
+
+    def init_app(self, app):
+        with app.app_context():
+            self._db_path = get_db_path()
+            with get_db_connection(self._db_path) as conn:
+                _ensure_usage_schema(conn)
+
+    def record(self, username, model, api_key, usage):
+        """Adds one request's usage (an OpenAI `usage` dict or None) to the pending counters."""
+        usage = usage or {}
+        prompt = int(usage.get('prompt_tokens') or 0)
+        completion = int(usage.get('completion_tokens') or 0)
+        total = int(usage.get('total_tokens') or (prompt + completion))
+        bucket = datetime.utcnow().strftime(USAGE_BUCKET_FORMAT)
+        counter_key = (bucket, username or '', model or '', mask_key(api_key))
+        with self._lock:
+            counters = self._pending.setdefault(counter_key, [0, 0, 0, 0])
+            counters[0] += 1
+            counters[1] += prompt
+            counters[2] += completion
+            counters[3] += total
+            pending = len(self._pending)
+            if self._today == bucket[:10] and counter_key[1] in self._today_totals:
+                self._today_totals[counter_key[1]] += total
+        if pending >= USAGE_FLUSH_THRESHOLD:
+            threading.Thread(target=self.flush, daemon=True).start()
+
+    def flush(self):
+        """Writes the pending counters in one transaction. Safe to call from any thread."""
+        if not self._db_path:
+            return
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            rows = [key + tuple(values) for key, values in batch.items()]
+            try:
+                with get_db_connection(self._db_path) as conn:
+                    _ensure_usage_schema(conn)
+                    conn.executemany("""
+                        INSERT INTO usage_counters
+                            (bucket, username, model, key_id, requests, prompt_tokens, completion_tokens, total_tokens)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (bucket, username, model, key_id) DO UPDATE SET
+                            requests = requests + excluded.requests,
+                            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                            completion_tokens = completion_tokens + excluded.completion_tokens,
+                            total_tokens = total_tokens + excluded.total_tokens;
+                    """, rows)
+                    conn.commit()
+            except Exception as e:
+                print(f"[Usage] Flush failed, keeping {len(rows)} counters for the next attempt: {e}")
+                with self._lock:
+                    for key, values in batch.items():
+                        counters = self._pending.setdefault(key, [0, 0, 0, 0])
+                        for i, value in enumerate(values):
+                            counters[i] += value
+
+    def _rows(self, since, username=None):
+        """Persisted plus pending rows since `since`, as dicts."""
+        since_bucket = since.strftime(USAGE_BUCKET_FORMAT)
+        merged = {}
+        if self._db_path:
+            query = "SELECT bucket, username, model, key_id, requests, prompt_tokens, completion_tokens, total_tokens FROM usage_counters WHERE bucket >= ?"
+            params = [since_bucket]
+            if username is not None:
+                query += " AND username = ?"
+                params.append(username)
+            with get_db_connection(self._db_path) as conn:
+                _ensure_usage_schema(conn)
+                for row in conn.execute(query, params).fetchall():
+                    merged[tuple(row[:4])] = list(row[4:])
+        with self._lock:
+            for key, values in self._pending.items():
+                if key[0] < since_bucket or (username is not None and key[1] != username):
+                    continue
+                counters = merged.setdefault(key, [0, 0, 0, 0])
+                for i, value in enumerate(values):
+                    counters[i] += value
+        return [
+            dict(zip(('bucket', 'username', 'model', 'key_id') + _COUNTER_FIELDS, key + tuple(values)))
+            for key, values in merged.items()
+        ]
+
+    def summarize(self, since, group_by, username=None):
+        """
+        Totals since `since`, grouped by one or more of
+        'day', 'username', 'model', 'key_id'; sorted by total_tokens desc.
+        """
+        groups = {}
+        for row in self._rows(since, username=username):
+            row['day'] = row['bucket'][:10]
+            group_key = tuple(row[field] for field in group_by)
+            totals = groups.setdefault(group_key, dict.fromkeys(_COUNTER_FIELDS, 0))
+            for field in _COUNTER_FIELDS:
+                totals[field] += row[field]
+        summary = [dict(zip(group_by, key), **totals) for key, totals in groups.items()]
+        summary.sort(key=lambda item: item['total_tokens'], reverse=True)
+        return summary
+
+    def tokens_used_today(self, username):
+        """
+        Total tokens used by `username` since 00:00 UTC (for quota enforcement).
+        Read from SQLite once per user per day, then kept up to date by record();
+        usage from other processes shows up after their next flush and this
+        process's next day rollover, so quotas are enforced approximately.
+        """
+        now = datetime.utcnow()
+        day = now.strftime('%Y-%m-%d')
+        with self._lock:
+            if self._today != day:
+                self._today = day
+                self._today_totals = {}
+            if username in self._today_totals:
+                return self._today_totals[username]
+        since = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        used = sum(row['total_tokens'] for row in self._rows(since, username=username))
+        with self._lock:
+            self._today_totals.setdefault(username, used)
+            return self._today_totals[username]
+
+
+usage_meter = UsageMeter()
+
+_flush_started = False
+
+
+def start_usage_flusher(app, socketio, interval=USAGE_FLUSH_INTERVAL):
+    """Starts the periodic counter flush once per process."""
+    global _flush_started
+    if _flush_started:
+        return
+    _flush_started = True
+    usage_meter.init_app(app)
+
+    def periodic_flush():
+        while True:
+            socketio.sleep(interval)
+            try:
+                offload(usage_meter.flush)
+            except Exception as e:
+                print(f"[Usage] Flush error: {e}")
+
+    socketio.start_background_task(periodic_flush)
+    # Write whatever is still pending on shutdown instead of losing up to one interval
+    atexit.register(_flush_on_exit)
+
+
+def _flush_on_exit():
+    try:
+        # Called directly: the event loop may already be gone at exit
+        usage_meter.flush()
+    except Exception as e:
+        print(f"[Usage] Final flush error: {e}")
+
+
+def usage_window_start(days):
+    return datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(days=max(1, days))
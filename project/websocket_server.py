@@ -3,7 +3,44 @@ WebSocket Server Module for Remote Inference Connections
 
 This module handles WebSocket connections from remote app.py clients
 and manages inference request queues for each Space.
+
+Several workers may register for the same Space. Each worker reports
+heartbeats (with optional GPU/queue load), and the server tracks per-worker
+latency and failures. Workers that stop heart-beating are evicted, workers
+that keep failing are circuit-broken for a cool-down period, and requests
+that time out on one worker are re-dispatched to another.
+
+Spaces can opt into micro-batching: compatible queued requests (same inputs
+apart from the text prompt) are sent to a batch-capable worker as a single
+inference_batch message, bounded by a maximum size and wait time.
+
+Worker protocol (version 2):
+    worker -> server  register_remote        {space_name, token, protocol_version,
+                                              capabilities: {max_batch_size, max_concurrency,
+                                                             binary, heartbeat_interval}}
+    server -> worker  register_result        {success, protocol_version, capabilities}
+    worker -> server  worker_heartbeat       {gpu_utilization, gpu_memory_*_mb, queue_depth}
+    server -> worker  inference_request      {request_id, user, data}
+    server -> worker  inference_batch        {batch_id, requests: [...]}
+    server -> worker  inference_cancel       {request_id}
+    worker -> server  inference_result       {request_id, success, result, error, retryable}
+    worker -> server  inference_batch_result {batch_id, results: [...]}
+
+Items of an inference_batch may also be answered one by one with
+inference_result as they finish. A worker runs batch items in order, so the
+timeout of the item at position i is (i + 1) times the space's request timeout.
+
+The token must match the space's auth_token. Version 1 clients (no token,
+capabilities as top-level keys) are only accepted by spaces without a token.
+With binary=True, base64 media in request data is sent as raw bytes, and
+bytes values in results under "<name>_bytes" are re-encoded as "<name>_base64"
+for browsers.
 """
+import base64
+import hashlib
+import hmac
+import json
+import threading
 import time
 import uuid
 from collections import deque
@@ -11,30 +48,69 @@ from datetime import datetime
 from flask import Blueprint, request, session
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
 from .database import load_db, save_db
+from .async_support import get_active_async_mode
+from .space_index import find_space_by_name
 
 # Global SocketIO instance - will be set in create_app
 socketio = None
 
-# Active remote connections: {space_name: {"sid": socket_id, "connected_at": timestamp}}
+# Registered remote workers: {space_name: {sid: worker_state}}
+# worker_state is built by _new_worker_state().
 active_connections = {}
 
-# User request queues: {space_name: deque([{"request_id": str, "user": str, "data": dict, "submitted_at": float}])}
+# Requests waiting for a worker: {space_name: deque([{"request_id": str, "user": str, "data": dict, "submitted_at": float, ...}])}
 request_queues = {}
 
+# Requests currently running on a worker: {request_id: {"space_name": str, "sid": str, "request": dict, "dispatched_at": float, "batch_id": str|None, "batch_position": int}}
+in_flight = {}
+
+# Batches still running on a worker: {batch_id: set(request_ids not yet answered)}
+in_flight_batches = {}
+
 # Pending results: {request_id: {"space_name": str, "user": str, "status": str, "result": any}}
 pending_results = {}
 
 # User socket mapping for pushing results: {username: [sid1, sid2, ...]}
 user_sockets = {}
 
+# Guards the dicts above; handlers, HTTP routes and the monitor all touch them.
+_state_lock = threading.RLock()
+_monitor_started = False
+_flush_scheduled = set()
+
+# --- Health / failover tuning ---
+MONITOR_INTERVAL_SECONDS = 5
+HEARTBEAT_MISSED_LIMIT = 3           # evict after this many missed heartbeats
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 300
+MAX_DISPATCH_ATTEMPTS = 3            # total tries per request across workers
+CIRCUIT_FAILURE_THRESHOLD = 3        # consecutive failures before opening the circuit
+CIRCUIT_COOLDOWN_SECONDS = 30
+ORPHANED_REQUEST_GRACE_SECONDS = 30  # how long queued requests wait for a worker to come back
+LATENCY_EWMA_ALPHA = 0.3
+DEFAULT_BATCH_MAX_WAIT_MS = 50
+
+# --- Worker protocol ---
+PROTOCOL_VERSION = 2
+MIN_PROTOCOL_VERSION = 1
+SERVER_MAX_BATCH_SIZE = 64
+SERVER_MAX_CONCURRENCY = 16
+MIN_HEARTBEAT_INTERVAL_SECONDS = 2
+BINARY_MEDIA_FIELDS = ('audio', 'video', 'image')
+
 ws_bp = Blueprint('websocket', __name__, url_prefix='/ws')
 
 
 def init_socketio(app):
-    """Initialize SocketIO with the Flask app."""
+    """
+    Initialize SocketIO with the Flask app.
+    The async mode follows SOCKETIO_ASYNC_MODE (threading, eventlet or gevent).
+    """
     global socketio
-    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+    async_mode = get_active_async_mode()
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode)
+    app.config['SOCKETIO_ASYNC_MODE'] = async_mode
     register_handlers(socketio)
+    _start_health_monitor(socketio)
     return socketio
 
 
@@ -43,32 +119,195 @@ def get_socketio():
     return socketio
 
 
+# ============================================================
+# Worker health
+# ============================================================
+
+def _negotiate_capabilities(data):
+    """
+    Returns (protocol_version, capabilities) agreed with a registering worker.
+    Version 1 clients send their capabilities as top-level keys.
+    """
+    try:
+        version = int(data.get('protocol_version') or 1)
+    except (TypeError, ValueError):
+        version = 1
+    version = min(version, PROTOCOL_VERSION)
+
+    requested = data.get('capabilities') if version >= 2 else data
+    if not isinstance(requested, dict):
+        requested = {}
+
+    def _int_cap(key, upper):
+        try:
+            return min(max(1, int(requested.get(key) or 1)), upper)
+        except (TypeError, ValueError):
+            return 1
+
+    try:
+        heartbeat_interval = float(requested.get('heartbeat_interval') or 0)
+    except (TypeError, ValueError):
+        heartbeat_interval = 0
+    if heartbeat_interval:
+        heartbeat_interval = max(heartbeat_interval, MIN_HEARTBEAT_INTERVAL_SECONDS)
+
+    return version, {
+        'max_batch_size': _int_cap('max_batch_size', SERVER_MAX_BATCH_SIZE),
+        'max_concurrency': _int_cap('max_concurrency', SERVER_MAX_CONCURRENCY),
+        'binary': bool(requested.get('binary')) and version >= 2,
+        'heartbeat_interval': heartbeat_interval or None,
+    }
+
+
+def _new_worker_state(sid, space_name, protocol_version, capabilities):
+    """Builds the bookkeeping dict for a freshly registered worker."""
+    return {
+        'sid': sid,
+        'space_name': space_name,
+        'connected_at': datetime.utcnow().isoformat(),
+        'protocol_version': protocol_version,
+        # Workers that never announce an interval (older clients) are not
+        # subject to heartbeat eviction.
+        'heartbeat_interval': capabilities['heartbeat_interval'],
+        'last_heartbeat': time.time(),
+        'load': {},
+        'max_concurrency': capabilities['max_concurrency'],
+        'max_batch_size': capabilities['max_batch_size'],
+        'binary': capabilities['binary'],
+        'active_requests': set(),
+        # A single request or a whole batch occupies one slot
+        'slots_in_use': 0,
+        'latency_ewma': None,
+        'successes': 0,
+        'failures': 0,
+        'consecutive_failures': 0,
+        'circuit': 'closed',
+        'circuit_opened_at': None,
+    }
+
+
+def _is_worker_stale(worker, now):
+    interval = worker.get('heartbeat_interval')
+    if not interval:
+        return False
+    return now - worker['last_heartbeat'] > interval * HEARTBEAT_MISSED_LIMIT
+
+
+def _worker_can_accept(worker, now):
+    """True if the worker is healthy and has a free slot for another request."""
+    if _is_worker_stale(worker, now):
+        return False
+    if worker['circuit'] == 'open':
+        if now - (worker['circuit_opened_at'] or 0) < CIRCUIT_COOLDOWN_SECONDS:
+            return False
+        worker['circuit'] = 'half_open'
+    if worker['circuit'] == 'half_open':
+        # Only one probe request until the worker proves itself again
+        return worker['slots_in_use'] == 0
+    return worker['slots_in_use'] < worker['max_concurrency']
+
+
+def _worker_score(worker):
+    """Lower is better: weighs current load, observed latency and failure rate."""
+    total = worker['successes'] + worker['failures']
+    failure_rate = worker['failures'] / total if total else 0.0
+    latency = worker['latency_ewma'] or 1.0
+    utilization = (worker['slots_in_use'] + 1) / worker['max_concurrency']
+
+    gpu_util = worker['load'].get('gpu_utilization')
+    try:
+        gpu_factor = 1.0 + float(gpu_util) / 100.0 if gpu_util is not None else 1.0
+    except (TypeError, ValueError):
+        gpu_factor = 1.0
+
+    return utilization * latency * gpu_factor * (1.0 + failure_rate)
+
+
+def _record_success(worker, latency):
+    worker['successes'] += 1
+    worker['consecutive_failures'] = 0
+    worker['circuit'] = 'closed'
+    worker['circuit_opened_at'] = None
+    if worker['latency_ewma'] is None:
+        worker['latency_ewma'] = latency
+    else:
+        worker['latency_ewma'] = (LATENCY_EWMA_ALPHA * latency +
+                                  (1 - LATENCY_EWMA_ALPHA) * worker['latency_ewma'])
+
+
+def _record_failure(worker, reason):
+    worker['failures'] += 1
+    worker['consecutive_failures'] += 1
+    if worker['circuit'] == 'half_open' or worker['consecutive_failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+        if worker['circuit'] != 'open':
+            print(f"[WS] Circuit opened for worker {worker['sid']} on space "
+                  f"{worker['space_name']}: {reason}")
+        worker['circuit'] = 'open'
+        worker['circuit_opened_at'] = time.time()
+
+
+def _worker_summary(worker, now):
+    """Public view of a worker for status endpoints (no socket ids)."""
+    return {
+        'connected_at': worker['connected_at'],
+        'protocol_version': worker['protocol_version'],
+        'healthy': not _is_worker_stale(worker, now) and worker['circuit'] != 'open',
+        'circuit': worker['circuit'],
+        'active_requests': len(worker['active_requests']),
+        'max_concurrency': worker['max_concurrency'],
+        'max_batch_size': worker['max_batch_size'],
+        'latency_ewma_seconds': round(worker['latency_ewma'], 3) if worker['latency_ewma'] is not None else None,
+        'successes': worker['successes'],
+        'failures': worker['failures'],
+        'seconds_since_heartbeat': round(now - worker['last_heartbeat'], 1),
+        'load': worker['load'],
+    }
+
+
 def is_space_online(space_name):
-    """Check if a space has an active remote connection."""
-    return space_name in active_connections
+    """Check if a space has at least one live remote worker."""
+    now = time.time()
+    with _state_lock:
+        workers = active_connections.get(space_name, {})
+        return any(not _is_worker_stale(w, now) for w in workers.values())
 
 
 def get_space_connection_info(space_name):
-    """Get connection info for a space."""
-    return active_connections.get(space_name)
+    """Get connection info for all workers of a space."""
+    now = time.time()
+    with _state_lock:
+        workers = active_connections.get(space_name)
+        if not workers:
+            return None
+        return [_worker_summary(w, now) for w in workers.values()]
+
+
+# ============================================================
+# Queueing and dispatch
+# ============================================================
+
+def _in_flight_count(space_name):
+    return sum(1 for entry in in_flight.values() if entry['space_name'] == space_name)
 
 
 def get_queue_position(space_name, request_id):
-    """Get the queue position for a request."""
-    if space_name not in request_queues:
+    """Get the queue position for a request (0 while it is being processed)."""
+    with _state_lock:
+        if request_id in in_flight:
+            return 0
+        queue = request_queues.get(space_name)
+        if not queue:
+            return -1
+        for i, req in enumerate(queue):
+            if req['request_id'] == request_id:
+                return i + 1  # 1-indexed position
         return -1
-    queue = request_queues[space_name]
-    for i, req in enumerate(queue):
-        if req['request_id'] == request_id:
-            return i + 1  # 1-indexed position
-    return -1
 
 
 def get_queue_length(space_name):
-    """Get the current queue length for a space."""
-    if space_name not in request_queues:
-        return 0
-    return len(request_queues[space_name])
+    """Get the current number of queued plus running requests for a space."""
+    with _state_lock:
+        return len(request_queues.get(space_name, ())) + _in_flight_count(space_name)
 
 
 def submit_inference_request(space_name, username, data):
@@ -78,54 +317,62 @@ def submit_inference_request(space_name, username, data):
     """
     if not is_space_online(space_name):
         return False, "远程服务器不在线", 0
-    
-    # Get max queue size from space settings
+
+    # Get max queue size and request timeout from space settings
     db = load_db()
-    space = None
-    for sid, s in db.get('spaces', {}).items():
-        if s.get('name') == space_name:
-            space = s
-            break
-    
+    space = find_space_by_name(db, space_name)
+
     max_queue = 10
+    request_timeout = DEFAULT_REQUEST_TIMEOUT_SECONDS
+    batch_max_size = 1
+    batch_max_wait_ms = DEFAULT_BATCH_MAX_WAIT_MS
     if space:
         max_queue = space.get('ws_max_queue_size', 10) or 10
-    
-    # Initialize queue if needed
-    if space_name not in request_queues:
-        request_queues[space_name] = deque()
-    
-    queue = request_queues[space_name]
-    
-    # Check queue limit
-    if len(queue) >= max_queue:
-        return False, f"队列已满，最多 {max_queue} 人排队", 0
-    
-    # Create request
-    request_id = str(uuid.uuid4())
-    request_data = {
-        'request_id': request_id,
-        'user': username,
-        'data': data,
-        'submitted_at': time.time()
-    }
-    
-    queue.append(request_data)
-    position = len(queue)
-    
-    # Store pending result
-    pending_results[request_id] = {
-        'space_name': space_name,
-        'user': username,
-        'status': 'queued',
-        'result': None,
-        'queue_position': position
-    }
-    
-    # If this is the first in queue, send to remote immediately
-    if position == 1:
-        _send_to_remote(space_name, request_data)
-    
+        request_timeout = space.get('ws_request_timeout_seconds') or DEFAULT_REQUEST_TIMEOUT_SECONDS
+        batch_max_size = space.get('ws_batch_max_size') or 1
+        if space.get('ws_batch_max_wait_ms') is not None:
+            batch_max_wait_ms = space['ws_batch_max_wait_ms']
+
+    with _state_lock:
+        # Initialize queue if needed
+        if space_name not in request_queues:
+            request_queues[space_name] = deque()
+
+        queue = request_queues[space_name]
+
+        # Check queue limit
+        if len(queue) + _in_flight_count(space_name) >= max_queue:
+            return False, f"队列已满，最多 {max_queue} 人排队", 0
+
+        # Create request
+        request_id = str(uuid.uuid4())
+        request_data = {
+            'request_id': request_id,
+            'user': username,
+            'data': data,
+            'submitted_at': time.time(),
+            'timeout': request_timeout,
+            'attempts': 0,
+            'excluded_sids': set(),
+            'batch_max_size': batch_max_size,
+            'batch_max_wait': batch_max_wait_ms / 1000.0,
+            'batch_key': _batch_key(data) if batch_max_size > 1 else None
+        }
+
+        queue.append(request_data)
+        position = len(queue) + _in_flight_count(space_name)
+
+        # Store pending result
+        pending_results[request_id] = {
+            'space_name': space_name,
+            'user': username,
+            'status': 'queued',
+            'result': None,
+            'queue_position': position
+        }
+
+        _dispatch(space_name)
+
     return True, request_id, position
 
 
@@ -134,137 +381,472 @@ def get_pending_result(request_id):
     return pending_results.get(request_id)
 
 
-def _send_to_remote(space_name, request_data):
+def _batch_key(data):
+    """
+    Requests can share a batch when everything but the text prompt matches
+    (same reference audio, same generation parameters).
+    """
+    shared = {k: v for k, v in (data or {}).items() if k != 'prompt'}
+    try:
+        encoded = json.dumps(shared, sort_keys=True, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def _pick_worker(space_name, request_data, now):
+    """Returns the best worker for a request, or None if nobody can take it."""
+    workers = active_connections.get(space_name, {})
+    candidates = [w for w in workers.values() if _worker_can_accept(w, now)]
+    if not candidates:
+        return None
+    # Prefer workers that have not already failed this request
+    fresh = [w for w in candidates if w['sid'] not in request_data['excluded_sids']]
+    return min(fresh or candidates, key=_worker_score)
+
+
+def _assign(worker, request_data, batch_id=None, batch_position=0):
+    """Marks a request as running on a worker."""
+    request_id = request_data['request_id']
+    request_data['attempts'] += 1
+    worker['active_requests'].add(request_id)
+    in_flight[request_id] = {
+        'space_name': worker['space_name'],
+        'sid': worker['sid'],
+        'request': request_data,
+        'dispatched_at': time.time(),
+        'batch_id': batch_id,
+        'batch_position': batch_position
+    }
+    if request_id in pending_results:
+        pending_results[request_id]['status'] = 'processing'
+        pending_results[request_id]['queue_position'] = 0
+
+
+def _payload_for_worker(worker, data):
+    """Converts base64/data-URL media fields to raw bytes for binary-capable workers."""
+    if not worker['binary'] or not isinstance(data, dict):
+        return data
+    converted = dict(data)
+    for field in BINARY_MEDIA_FIELDS:
+        value = converted.get(field)
+        if not isinstance(value, str) or not value:
+            continue
+        if value.startswith('data:'):
+            header, _, encoded = value.partition(',')
+            if not header.endswith(';base64'):
+                continue  # non-base64 data URL: pass through as is
+        else:
+            encoded = value
+        try:
+            # validate=True: URLs and paths must fail instead of decoding into junk
+            converted[field] = base64.b64decode(encoded, validate=True)
+        except (ValueError, TypeError):
+            pass  # leave anything that is not base64 untouched
+    return converted
+
+
+def _result_for_browser(result):
+    """Re-encodes "<name>_bytes" values from binary workers as "<name>_base64" strings."""
+    if not isinstance(result, dict):
+        return result
+    normalized = {}
+    for key, value in result.items():
+        if isinstance(value, (bytes, bytearray)):
+            name = key[:-len('_bytes')] if key.endswith('_bytes') else key
+            normalized[f'{name}_base64'] = base64.b64encode(bytes(value)).decode('ascii')
+        else:
+            normalized[key] = value
+    return normalized
+
+
+def _send_to_remote(worker, request_data):
     """Send a request to the remote app.py."""
-    if space_name not in active_connections:
-        return False
-    
-    sid = active_connections[space_name]['sid']
-    pending_results[request_data['request_id']]['status'] = 'processing'
-    
+    worker['slots_in_use'] += 1
+    _assign(worker, request_data)
+
     socketio.emit('inference_request', {
         'request_id': request_data['request_id'],
         'user': request_data['user'],
-        'data': request_data['data']
-    }, room=sid)
-    
+        'data': _payload_for_worker(worker, request_data['data'])
+    }, room=worker['sid'])
+
+    return True
+
+
+def _send_batch(worker, batch):
+    """Send several compatible requests to the remote app.py in one message."""
+    batch_id = str(uuid.uuid4())
+    worker['slots_in_use'] += 1
+    in_flight_batches[batch_id] = set()
+    for position, request_data in enumerate(batch):
+        _assign(worker, request_data, batch_id, position)
+        in_flight_batches[batch_id].add(request_data['request_id'])
+
+    socketio.emit('inference_batch', {
+        'batch_id': batch_id,
+        'requests': [{
+            'request_id': r['request_id'],
+            'user': r['user'],
+            'data': _payload_for_worker(worker, r['data'])
+        } for r in batch]
+    }, room=worker['sid'])
+
+    print(f"[WS] Dispatched batch {batch_id} ({len(batch)} requests) on space {worker['space_name']}")
     return True
 
 
-def _process_next_in_queue(space_name):
-    """Process the next request in queue after one completes."""
-    if space_name not in request_queues:
+def _schedule_flush(space_name, delay):
+    """Re-runs the dispatcher once a partially filled batch has waited long enough."""
+    if space_name in _flush_scheduled:
         return
-    
-    queue = request_queues[space_name]
-    if len(queue) > 0:
-        next_request = queue[0]
-        _send_to_remote(space_name, next_request)
-        
-        # Update queue positions for all waiting users
-        for i, req in enumerate(queue):
-            if req['request_id'] in pending_results:
-                pending_results[req['request_id']]['queue_position'] = i + 1
+    _flush_scheduled.add(space_name)
+
+    def _flush():
+        socketio.sleep(max(delay, 0))
+        with _state_lock:
+            _flush_scheduled.discard(space_name)
+            _dispatch(space_name)
+
+    socketio.start_background_task(_flush)
+
+
+def _dispatch(space_name):
+    """Hands queued requests to healthy workers until the queue or capacity runs out."""
+    queue = request_queues.get(space_name)
+    if not queue:
+        return
+    now = time.time()
+    # Batch groups still waiting to fill; their requests stay queued while
+    # everything behind them keeps flowing to idle workers
+    waiting_keys = set()
+    index = 0
+    while index < len(queue):
+        head = queue[index]
+        batch_key = head.get('batch_key')
+        if batch_key and batch_key in waiting_keys:
+            index += 1
+            continue
+        worker = _pick_worker(space_name, head, now)
+        if worker is None:
+            break
+        batch_limit = min(head.get('batch_max_size') or 1, worker['max_batch_size'])
+        if batch_limit <= 1 or not batch_key:
+            del queue[index]
+            _send_to_remote(worker, head)
+            continue
+        batch = [r for r in queue if r.get('batch_key') == batch_key][:batch_limit]
+        waited = now - head['submitted_at']
+        if len(batch) < batch_limit and waited < head['batch_max_wait']:
+            # Give compatible requests a moment to arrive before using the slot
+            _schedule_flush(space_name, head['batch_max_wait'] - waited)
+            waiting_keys.add(batch_key)
+            index += 1
+            continue
+        for r in batch:
+            queue.remove(r)
+        if len(batch) == 1:
+            _send_to_remote(worker, batch[0])
+        else:
+            _send_batch(worker, batch)
+    # Update queue positions for all waiting users
+    for i, req in enumerate(queue):
+        if req['request_id'] in pending_results:
+            pending_results[req['request_id']]['queue_position'] = i + 1
+
+
+def _notify_user(username, payload):
+    for user_sid in user_sockets.get(username, []):
+        socketio.emit('inference_complete', payload, room=user_sid)
+
+
+def _finish_request(request_id, success, result=None, error=None):
+    """Stores the final outcome of a request and pushes it to the user."""
+    pending = pending_results.get(request_id)
+    if not pending:
+        return
+    pending['status'] = 'completed' if success else 'failed'
+    pending['result'] = result if success else error
+    pending['queue_position'] = 0
+    _notify_user(pending['user'], {
+        'request_id': request_id,
+        'success': success,
+        'result': result,
+        'error': error
+    })
+
+
+def _retry_or_fail(request_data, space_name, reason):
+    """Puts a request that lost its worker back at the head of the queue, or fails it."""
+    request_id = request_data['request_id']
+    if request_data['attempts'] >= MAX_DISPATCH_ATTEMPTS:
+        print(f"[WS] Request {request_id} failed after {request_data['attempts']} attempts: {reason}")
+        _finish_request(request_id, False, error=f'推理失败（已重试 {request_data["attempts"]} 次）: {reason}')
+        return
+
+    print(f"[WS] Re-queueing request {request_id} ({reason})")
+    request_queues.setdefault(space_name, deque()).appendleft(request_data)
+    if request_id in pending_results:
+        pending_results[request_id]['status'] = 'queued'
+
+
+def _release_in_flight(request_id):
+    """Removes a request from in_flight and frees its worker slot once its batch is done."""
+    entry = in_flight.pop(request_id, None)
+    if not entry:
+        return None, None
+
+    slot_freed = True
+    batch_id = entry.get('batch_id')
+    if batch_id:
+        remaining = in_flight_batches.get(batch_id, set())
+        remaining.discard(request_id)
+        if remaining:
+            slot_freed = False
+        else:
+            in_flight_batches.pop(batch_id, None)
+
+    worker = active_connections.get(entry['space_name'], {}).get(entry['sid'])
+    if worker:
+        worker['active_requests'].discard(request_id)
+        if slot_freed:
+            worker['slots_in_use'] = max(0, worker['slots_in_use'] - 1)
+    return entry, worker
+
+
+def _remove_worker(space_name, sid, reason):
+    """Drops a worker and re-queues whatever it was running."""
+    workers = active_connections.get(space_name, {})
+    worker = workers.pop(sid, None)
+    if not workers:
+        active_connections.pop(space_name, None)
+    if not worker:
+        return
+
+    for request_id in list(worker['active_requests']):
+        entry = in_flight.pop(request_id, None)
+        if entry:
+            if entry.get('batch_id'):
+                in_flight_batches.pop(entry['batch_id'], None)
+            entry['request']['excluded_sids'].add(sid)
+            _retry_or_fail(entry['request'], space_name, reason)
+    worker['active_requests'].clear()
+    worker['slots_in_use'] = 0
+    _dispatch(space_name)
+
+
+def _monitor_tick():
+    """One pass of the health monitor: evictions, timeouts, orphaned queues."""
+    now = time.time()
+    stale_sids = []
+
+    with _state_lock:
+        # 1. Evict workers whose heartbeats stopped
+        for space_name, workers in list(active_connections.items()):
+            for sid, worker in list(workers.items()):
+                if _is_worker_stale(worker, now):
+                    print(f"[WS] Worker {sid} on space {space_name} missed heartbeats, evicting")
+                    _remove_worker(space_name, sid, '远程服务器心跳超时')
+                    stale_sids.append(sid)
+
+        # 2. Time out requests that are stuck on a worker
+        penalized_batches = set()
+        for request_id, entry in list(in_flight.items()):
+            # Batch items run one after another on the worker
+            deadline = entry['request']['timeout'] * (entry.get('batch_position', 0) + 1)
+            if now - entry['dispatched_at'] <= deadline:
+                continue
+            space_name = entry['space_name']
+            batch_id = entry.get('batch_id')
+            entry, worker = _release_in_flight(request_id)
+            if worker:
+                # A timed-out batch is one incident, not one per request
+                if not batch_id or batch_id not in penalized_batches:
+                    _record_failure(worker, 'request timeout')
+                    if batch_id:
+                        penalized_batches.add(batch_id)
+                socketio.emit('inference_cancel', {'request_id': request_id}, room=worker['sid'])
+            entry['request']['excluded_sids'].add(entry['sid'])
+            _retry_or_fail(entry['request'], space_name, '远程推理超时')
+
+        # 3. Fail queued requests for spaces that have had no worker for too long
+        for space_name, queue in list(request_queues.items()):
+            if active_connections.get(space_name):
+                for req in queue:
+                    req.pop('orphaned_at', None)
+                _dispatch(space_name)
+                continue
+            for req in list(queue):
+                orphaned_at = req.setdefault('orphaned_at', now)
+                if now - orphaned_at > ORPHANED_REQUEST_GRACE_SECONDS:
+                    queue.remove(req)
+                    _finish_request(req['request_id'], False, error='远程服务器断开连接')
+
+    for sid in stale_sids:
+        try:
+            socketio.server.disconnect(sid)
+        except Exception as e:
+            print(f"[WS] Failed to disconnect stale worker {sid}: {e}")
+
+
+def _start_health_monitor(sio):
+    """Starts the background health monitor once per process."""
+    global _monitor_started
+    if _monitor_started:
+        return
+    _monitor_started = True
+
+    def _run():
+        while True:
+            sio.sleep(MONITOR_INTERVAL_SECONDS)
+            try:
+                _monitor_tick()
+            except Exception as e:
+                print(f"[WS] Health monitor error: {e}")
+
+    sio.start_background_task(_run)
+
+
+def _find_worker_by_sid(sid):
+    for space_name, workers in active_connections.items():
+        if sid in workers:
+            return space_name, workers[sid]
+    return None, None
 
 
 def register_handlers(sio):
     """Register all WebSocket event handlers."""
-    
+
     @sio.on('connect')
     def handle_connect():
         """Handle new WebSocket connections."""
         print(f"[WS] New connection: {request.sid}")
-    
+
     @sio.on('disconnect')
     def handle_disconnect():
         """Handle WebSocket disconnections."""
         sid = request.sid
         print(f"[WS] Disconnected: {sid}")
-        
-        # Check if this was a remote app.py connection
-        for space_name, conn_info in list(active_connections.items()):
-            if conn_info['sid'] == sid:
-                del active_connections[space_name]
+
+        with _state_lock:
+            # Check if this was a remote app.py connection
+            space_name, worker = _find_worker_by_sid(sid)
+            if worker:
+                _remove_worker(space_name, sid, '远程服务器断开连接')
                 print(f"[WS] Remote disconnected from space: {space_name}")
-                
-                # Mark all pending requests for this space as failed
-                if space_name in request_queues:
-                    for req in request_queues[space_name]:
-                        if req['request_id'] in pending_results:
-                            pending_results[req['request_id']]['status'] = 'failed'
-                            pending_results[req['request_id']]['result'] = '远程服务器断开连接'
-                    request_queues[space_name].clear()
-                break
-        
-        # Check if this was a user connection
-        for username, sids in list(user_sockets.items()):
-            if sid in sids:
-                sids.remove(sid)
-                if not sids:
-                    del user_sockets[username]
-                break
-    
+
+            # Check if this was a user connection
+            for username, sids in list(user_sockets.items()):
+                if sid in sids:
+                    sids.remove(sid)
+                    if not sids:
+                        del user_sockets[username]
+                    break
+
     @sio.on('register_remote')
     def handle_register_remote(data):
         """
         Handle remote app.py registration.
-        Expected data: {"space_name": "my-space"}
+        Expected data: {"space_name": "my-space", "token": "...", "protocol_version": 2,
+                        "capabilities": {"max_batch_size": 4, "max_concurrency": 1,
+                                         "binary": True, "heartbeat_interval": 10}}
+        Capabilities are optional; the negotiated values are returned in register_result.
         """
         sid = request.sid
-        space_name = data.get('space_name', '').strip()
-        
+        data = data or {}
+        space_name = (data.get('space_name') or '').strip()
+
         if not space_name:
             emit('register_result', {'success': False, 'error': 'Space名称不能为空'})
             disconnect()
             return
-        
-        # Check if space name is already connected
-        if space_name in active_connections:
+
+        # Verify space exists in database
+        db = load_db()
+        space = find_space_by_name(db, space_name, card_type='websocket')
+
+        if not space:
             emit('register_result', {
-                'success': False, 
-                'error': f'Space "{space_name}" 已有连接，请使用不同的名称或等待现有连接断开'
+                'success': False,
+                'error': f'未找到名为 "{space_name}" 的 WebSocket 类型 Space'
             })
             disconnect()
             return
-        
-        # Verify space exists in database
-        db = load_db()
-        space_found = False
-        spaces = db.get('spaces', {})
-        for space_id in list(spaces.keys()):
-            space = spaces[space_id]
-            if space.get('name') == space_name and space.get('card_type') == 'websocket':
-                space_found = True
-                break
-        
-        if not space_found:
+
+        expected_token = space.get('auth_token')
+        if expected_token:
+            token = data.get('token') or ''
+            if not hmac.compare_digest(str(token), str(expected_token)):
+                print(f"[WS] Rejected worker {sid} for space {space_name}: invalid token")
+                emit('register_result', {'success': False, 'error': '认证失败：Token 无效'})
+                disconnect()
+                return
+        else:
+            print(f"[WS] Space {space_name} has no auth_token; accepting unauthenticated worker {sid}")
+
+        protocol_version, capabilities = _negotiate_capabilities(data)
+        if protocol_version < MIN_PROTOCOL_VERSION:
             emit('register_result', {
                 'success': False,
-                'error': f'未找到名为 "{space_name}" 的 WebSocket 类型 Space'
+                'error': f'不支持的协议版本，最低要求 {MIN_PROTOCOL_VERSION}'
             })
             disconnect()
             return
-        
-        # Register the connection
-        active_connections[space_name] = {
-            'sid': sid,
-            'connected_at': datetime.utcnow().isoformat()
-        }
-        
-        # Initialize queue
-        if space_name not in request_queues:
-            request_queues[space_name] = deque()
-        
+
+        with _state_lock:
+            # A worker re-registering on the same socket replaces its old entry
+            old_space, old_worker = _find_worker_by_sid(sid)
+            if old_worker:
+                _remove_worker(old_space, sid, '远程服务器重新注册')
+
+            # Register the connection; several workers may serve one space
+            worker = _new_worker_state(sid, space_name, protocol_version, capabilities)
+            active_connections.setdefault(space_name, {})[sid] = worker
+
+            # Initialize queue
+            if space_name not in request_queues:
+                request_queues[space_name] = deque()
+            worker_count = len(active_connections[space_name])
+
         join_room(f'space_{space_name}')
-        
+
         emit('register_result', {
             'success': True,
             'message': f'成功连接到 Space "{space_name}"',
-            'space_name': space_name
+            'space_name': space_name,
+            'workers': worker_count,
+            'protocol_version': protocol_version,
+            'capabilities': capabilities
         })
-        
-        print(f"[WS] Remote registered for space: {space_name}")
-    
+
+        print(f"[WS] Remote registered for space: {space_name} ({worker_count} worker(s), "
+              f"protocol v{protocol_version}, {capabilities})")
+
+        with _state_lock:
+            _dispatch(space_name)
+
+    @sio.on('worker_heartbeat')
+    def handle_worker_heartbeat(data):
+        """
+        Handle a periodic heartbeat from a remote worker.
+        Expected data (all optional): {"gpu_utilization": 37, "gpu_memory_used_mb": 8123,
+        "gpu_memory_total_mb": 24576, "queue_depth": 1}
+        """
+        sid = request.sid
+        with _state_lock:
+            space_name, worker = _find_worker_by_sid(sid)
+            if not worker:
+                emit('heartbeat_ack', {'success': False, 'error': '未注册的远程连接'})
+                return
+            worker['last_heartbeat'] = time.time()
+            worker['load'] = {
+                k: v for k, v in (data or {}).items()
+                if k in ('gpu_utilization', 'gpu_memory_used_mb', 'gpu_memory_total_mb', 'queue_depth')
+            }
+            _dispatch(space_name)
+
+        emit('heartbeat_ack', {'success': True, 'server_time': time.time()})
+
     @sio.on('register_user')
     def handle_register_user(data):
         """
@@ -273,61 +855,93 @@ def register_handlers(sio):
         """
         sid = request.sid
         username = data.get('username', '').strip()
-        
+
         if not username:
             emit('user_register_result', {'success': False, 'error': '用户名不能为空'})
             return
-        
-        if username not in user_sockets:
-            user_sockets[username] = []
-        
-        if sid not in user_sockets[username]:
-            user_sockets[username].append(sid)
-        
+
+        with _state_lock:
+            if username not in user_sockets:
+                user_sockets[username] = []
+
+            if sid not in user_sockets[username]:
+                user_sockets[username].append(sid)
+
         emit('user_register_result', {'success': True})
-    
+
     @sio.on('inference_result')
     def handle_inference_result(data):
         """
         Handle inference result from remote app.py.
-        Expected data: {"request_id": "...", "success": True/False, "result": {...}, "error": "..."}
+        Expected data: {"request_id": "...", "success": True/False, "result": {...}, "error": "...", "retryable": False}
+        A failed result with retryable=True (e.g. CUDA OOM) is re-dispatched to another worker.
         """
-        request_id = data.get('request_id')
-        success = data.get('success', False)
-        result = data.get('result')
-        error = data.get('error')
-        
-        if request_id not in pending_results:
-            print(f"[WS] Unknown request_id: {request_id}")
-            return
-        
-        pending = pending_results[request_id]
-        space_name = pending['space_name']
-        username = pending['user']
-        
-        # Update result status
-        pending['status'] = 'completed' if success else 'failed'
-        pending['result'] = result if success else error
-        
-        # Remove from queue
-        if space_name in request_queues:
-            queue = request_queues[space_name]
-            request_queues[space_name] = deque([r for r in queue if r['request_id'] != request_id])
-        
-        # Notify user via WebSocket if connected
-        if username in user_sockets:
-            for user_sid in user_sockets[username]:
-                sio.emit('inference_complete', {
-                    'request_id': request_id,
-                    'success': success,
-                    'result': result,
-                    'error': error
-                }, room=user_sid)
-        
-        # Process next in queue
-        _process_next_in_queue(space_name)
-        
-        print(f"[WS] Result received for request {request_id}: success={success}")
+        with _state_lock:
+            space_name = _apply_result(request.sid, data)
+            if space_name:
+                # Process next in queue
+                _dispatch(space_name)
+
+    @sio.on('inference_batch_result')
+    def handle_inference_batch_result(data):
+        """
+        Handle the results of an inference_batch from remote app.py.
+        Expected data: {"batch_id": "...", "results": [<inference_result payload>, ...]}
+        Requests missing from results stay in flight until they time out.
+        """
+        sid = request.sid
+        results = data.get('results') or []
+        space_names = set()
+        with _state_lock:
+            for item in results:
+                space_name = _apply_result(sid, item)
+                if space_name:
+                    space_names.add(space_name)
+            for space_name in space_names:
+                _dispatch(space_name)
+
+        print(f"[WS] Batch result received for batch {data.get('batch_id')}: {len(results)} item(s)")
+
+
+def _apply_result(sid, data):
+    """
+    Applies one worker result. Returns the space name, or None when the
+    result was ignored. Caller must hold _state_lock.
+    """
+    request_id = data.get('request_id')
+    success = data.get('success', False)
+    result = data.get('result')
+    error = data.get('error')
+    retryable = bool(data.get('retryable'))
+
+    entry = in_flight.get(request_id)
+    if not entry or entry['sid'] != sid:
+        # Late answer for a request that already timed out and moved on
+        print(f"[WS] Ignoring result for unknown or reassigned request_id: {request_id}")
+        return None
+
+    space_name = entry['space_name']
+    entry, worker = _release_in_flight(request_id)
+    if worker:
+        worker['last_heartbeat'] = time.time()
+
+    if success:
+        if worker:
+            _record_success(worker, time.time() - entry['dispatched_at'])
+        _finish_request(request_id, True, result=_result_for_browser(result))
+    elif retryable:
+        if worker:
+            _record_failure(worker, error)
+        entry['request']['excluded_sids'].add(sid)
+        _retry_or_fail(entry['request'], space_name, error or '远程推理失败')
+    else:
+        # Application-level failure (bad input etc.): the worker itself is fine
+        if worker:
+            worker['failures'] += 1
+        _finish_request(request_id, False, error=error)
+
+    print(f"[WS] Result received for request {request_id}: success={success}")
+    return space_name
 
 
 # HTTP Routes for user interactions
@@ -335,15 +949,15 @@ def register_handlers(sio):
 def submit_request(space_name):
     """Submit an inference request via HTTP."""
     from flask import jsonify
-    
+
     if not session.get('logged_in'):
         return jsonify({'success': False, 'error': '请先登录'}), 401
-    
+
     username = session.get('username')
     data = request.get_json() or {}
-    
+
     success, result, position = submit_inference_request(space_name, username, data)
-    
+
     if success:
         return jsonify({
             'success': True,
@@ -358,14 +972,15 @@ def submit_request(space_name):
 def get_status(space_name):
     """Get the status of a space and optionally a request."""
     from flask import jsonify
-    
+
     request_id = request.args.get('request_id')
-    
+
     response = {
         'online': is_space_online(space_name),
-        'queue_length': get_queue_length(space_name)
+        'queue_length': get_queue_length(space_name),
+        'workers': get_space_connection_info(space_name) or []
     }
-    
+
     if request_id:
         pending = get_pending_result(request_id)
         if pending:
@@ -374,7 +989,7 @@ def get_status(space_name):
                 'queue_position': pending.get('queue_position', 0),
                 'result': pending.get('result')
             }
-    
+
     return jsonify(response)
 
 
@@ -382,12 +997,12 @@ def get_status(space_name):
 def get_result(request_id):
     """Get the result of a specific request."""
     from flask import jsonify
-    
+
     pending = get_pending_result(request_id)
-    
+
     if not pending:
         return jsonify({'success': False, 'error': '请求不存在'}), 404
-    
+
     return jsonify({
         'success': True,
         'status': pending['status'],
@@ -2,92 +2,273 @@
 """
 WebSocket 上传处理端点 - 服务器端代码
 
-将此代码添加到您的 Flask 应用中，用于接收来自远程 webui.py 的 WebSocket 上传
+接收来自远程 webui.py 的 WebSocket 上传（命名空间 /ws/upload），直接以
+S3 分片上传（multipart upload）的方式写入存储，不再落地临时文件。
 
-需要安装: pip install flask-socketio
+协议:
+    start_upload    {filename, file_size, content_type}      -> ready {upload_id, part_size, max_chunk_size}
+    upload_chunk    {upload_id, offset, data: bytes, sha256}  -> chunk_ack {offset, length, received_bytes}
+    resume_upload   {upload_id}                               -> resume_state {received_ranges, ...}
+    complete_upload {upload_id}                               -> upload_complete {public_url, s3_object_name}
+    cancel_upload   {upload_id}                               -> cancelled
 
-使用方法:
-1. 将此文件导入到您的 Flask 应用
-2. 在主应用中初始化 SocketIO
-3. 配置 S3 存储桶
+- 分块以原始二进制发送，按 offset 定位写入，可乱序到达，也可以分散在多个连接上并行发送。
+- sha256 为可选的分块校验值，不匹配时返回 chunk_error，客户端重发该分块即可。
+- 上传归属于用户而不是连接：断线后使用同一 API Key 重新连接，通过 resume_upload
+  获取已接收的区间并补发缺失部分。超过 UPLOAD_TIMEOUT 无活动的上传会被中止。
+- 每个 S3 分片（part_size）收满后立即上传到 S3 并释放内存。
+- 兼容旧客户端：不带 offset 的 base64 data 会按顺序追加；start_upload 不带
+  file_size 时按流式上传处理，分块必须按顺序发送，在 complete_upload 时才确定文件大小。
+
+所有事件处理函数同时返回响应内容，客户端可以用 sio.call() 直接拿到确认。
 """
 
-import os
-import uuid
 import base64
+import hashlib
+import threading
 import time
+import uuid
 from flask import Blueprint, request, current_app
 from flask_socketio import emit, disconnect
 
-# 存储进行中的上传任务
+from .derivatives import schedule_derivatives
+
+# 存储进行中的上传任务: {upload_id: upload_info}
 active_uploads = {}
 
-# 上传超时时间（秒）
+# 已认证连接: {sid: username}（request 对象不会在事件之间保留属性）
+_sid_users = {}
+
+_uploads_lock = threading.Lock()
+
+# 上传超时时间（秒）：超过该时间没有任何分块到达则中止
 UPLOAD_TIMEOUT = 300  # 5分钟
 
+# S3 分片大小（除最后一片外，S3 要求至少 5 MiB）
+PART_SIZE = 8 * 1024 * 1024
+
+# 单个分块最大字节数
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# 每个上传最多同时缓存在内存中的分片数
+MAX_BUFFERED_PARTS = 4
+
+NAMESPACE = '/ws/upload'
+
+
+def _add_range(ranges, start, end):
+    """
+    将 [start, end) 合并进有序区间列表，返回新增的字节数。
+    ranges 会被原地更新。
+    """
+    overlap = 0
+    merged = []
+    new_start, new_end = start, end
+    for r_start, r_end in ranges:
+        if r_end < new_start or r_start > new_end:
+            merged.append([r_start, r_end])
+            continue
+        overlap += max(0, min(r_end, end) - max(r_start, start))
+        new_start = min(new_start, r_start)
+        new_end = max(new_end, r_end)
+    merged.append([new_start, new_end])
+    merged.sort()
+    ranges[:] = merged
+    return (end - start) - overlap
+
+
+def _part_bounds(upload_info, part_index):
+    start = part_index * PART_SIZE
+    end = min(start + PART_SIZE, upload_info['file_size'])
+    return start, end
+
+
+def _received_ranges(upload_info):
+    """整体已接收的字节区间（已上传的分片 + 缓存中的分片）。"""
+    ranges = []
+    for part_index in list(upload_info['uploaded_parts']) + list(upload_info['uploading_parts']):
+        start, end = _part_bounds(upload_info, part_index)
+        _add_range(ranges, start, end)
+    for part_index, part in upload_info['parts'].items():
+        base = part_index * PART_SIZE
+        for r_start, r_end in part['ranges']:
+            _add_range(ranges, base + r_start, base + r_end)
+    return ranges
+
 
 def create_ws_upload_blueprint(socketio, s3_utils):
     """
     创建 WebSocket 上传蓝图
-    
+
     Args:
         socketio: Flask-SocketIO 实例
-        s3_utils: S3 工具模块（需要有 upload_file_to_s3 和 get_public_s3_url 函数）
+        s3_utils: S3 工具模块（需要有分片上传函数和 get_public_s3_url 函数）
     """
-    
+
     ws_bp = Blueprint('ws_upload', __name__)
-    
-    @socketio.on('connect', namespace='/ws/upload')
-    def handle_connect():
-        """处理 WebSocket 连接"""
-        # 验证 API Key
+
+    def _reply(event, payload):
+        emit(event, payload)
+        return payload
+
+    def _error(message, **extra):
+        return _reply('error', dict({'status': 'error', 'error': message}, **extra))
+
+    def _get_owned_upload(upload_id):
+        """返回当前用户拥有的上传任务，否则返回 None。"""
+        user = _sid_users.get(request.sid)
+        upload_info = active_uploads.get(upload_id)
+        if not user or not upload_info or upload_info['user'] != user:
+            return None
+        return upload_info
+
+    def _flush_part(upload_info, part_index):
+        """把收满的分片上传到 S3。调用者需持有 upload_info['lock']，上传期间会释放。"""
+        part = upload_info['parts'].pop(part_index)
+        upload_info['uploading_parts'].add(part_index)
+        upload_info['lock'].release()
+        etag = None
+        try:
+            etag = s3_utils.upload_part(
+                upload_info['s3_object_name'], upload_info['multipart_id'],
+                part_index + 1, part['buffer']
+            )
+        except Exception as e:
+            print(f"[WS Upload] Part {part_index + 1} of {upload_info['s3_object_name']} failed: {e}")
+        finally:
+            upload_info['lock'].acquire()
+            upload_info['uploading_parts'].discard(part_index)
+
+        if etag:
+            upload_info['uploaded_parts'][part_index] = etag
+            return True
+        # 上传失败则放回缓存，等待客户端完成时重试
+        upload_info['parts'][part_index] = part
+        return False
+
+    def _append_stream(upload_info, data):
+        """流式上传（未知文件大小）：按顺序追加数据，每满一个分片就上传。返回错误信息或 None。"""
+        if upload_info['stream_closed']:
+            return 'Upload already completing'
+        buffer = upload_info['stream_buffer']
+        if len(upload_info['parts']) >= MAX_BUFFERED_PARTS and len(buffer) + len(data) >= PART_SIZE:
+            return 'Too many parts in flight, retry later'
+        buffer.extend(data)
+        # 先记账：上传分片时会释放锁，后续分块和 complete_upload 要看到最新的偏移
+        upload_info['received_bytes'] += len(data)
+        upload_info['next_offset'] += len(data)
+        while len(buffer) >= PART_SIZE:
+            part_index = upload_info['stream_next_part']
+            upload_info['stream_next_part'] += 1
+            upload_info['parts'][part_index] = {'buffer': buffer[:PART_SIZE], 'ranges': [[0, PART_SIZE]]}
+            del buffer[:PART_SIZE]
+            _flush_part(upload_info, part_index)
+        return None
+
+    def _close_stream(upload_info):
+        """流式上传完成时：剩余数据作为最后一个分片，并确定文件大小。"""
+        if upload_info['stream_closed']:
+            return
+        upload_info['stream_closed'] = True
+        buffer = upload_info['stream_buffer']
+        part_index = upload_info['stream_next_part']
+        if buffer or part_index == 0:
+            # 最后一个分片可以小于 5 MiB（空文件也需要一个分片）
+            upload_info['parts'][part_index] = {'buffer': bytearray(buffer), 'ranges': [[0, len(buffer)]]}
+            upload_info['stream_next_part'] += 1
+        upload_info['stream_buffer'] = bytearray()
+        upload_info['file_size'] = upload_info['received_bytes']
+
+    def _write_range(upload_info, offset, data):
+        """按 offset 写入数据（可跨分片），返回 (新增字节数, 错误信息)。"""
+        end = offset + len(data)
+        first_part = offset // PART_SIZE
+        last_part = (end - 1) // PART_SIZE
+
+        # 预先检查内存限制，避免写入一半
+        new_parts = [
+            i for i in range(first_part, last_part + 1)
+            if i not in upload_info['parts'] and i not in upload_info['uploaded_parts']
+            and i not in upload_info['uploading_parts']
+        ]
+        if len(upload_info['parts']) + len(new_parts) > MAX_BUFFERED_PARTS:
+            return 0, 'Too many parts in flight, retry later'
+
+        added = 0
+        for part_index in range(first_part, last_part + 1):
+            if part_index in upload_info['uploaded_parts'] or part_index in upload_info['uploading_parts']:
+                continue  # 重复发送的分块，已经上传过
+            part_start, part_end = _part_bounds(upload_info, part_index)
+            seg_start = max(offset, part_start)
+            seg_end = min(end, part_end)
+
+            part = upload_info['parts'].get(part_index)
+            if part is None:
+                part = {'buffer': bytearray(part_end - part_start), 'ranges': []}
+                upload_info['parts'][part_index] = part
+
+            rel_start = seg_start - part_start
+            rel_end = seg_end - part_start
+            part['buffer'][rel_start:rel_end] = data[seg_start - offset:seg_end - offset]
+            added += _add_range(part['ranges'], rel_start, rel_end)
+
+            if part['ranges'] == [[0, part_end - part_start]]:
+                _flush_part(upload_info, part_index)
+
+        return added, None
+
+    def _abort(upload_id):
+        """中止上传任务并让 S3 丢弃已上传的分片"""
+        with _uploads_lock:
+            upload_info = active_uploads.pop(upload_id, None)
+        if not upload_info:
+            return
+        try:
+            s3_utils.abort_multipart_upload(upload_info['s3_object_name'], upload_info['multipart_id'])
+        except Exception as e:
+            print(f"[WS Upload] Abort error: {e}")
+
+    @socketio.on('connect', namespace=NAMESPACE)
+    def handle_connect(auth=None):
+        """处理 WebSocket 连接，支持 Authorization 头或 auth={'api_key': ...}"""
         api_key = request.headers.get('Authorization', '').replace('Bearer ', '')
-        
+        if not api_key and isinstance(auth, dict):
+            api_key = auth.get('api_key', '')
+
         if not api_key:
             emit('error', {'message': 'Missing API key'})
             disconnect()
             return
-        
-        # 验证 API Key（您需要实现这个函数）
+
         from .database import load_db
         db = load_db()
-        
+
         user = None
         for username, user_data in db.get('users', {}).items():
             if user_data.get('api_key') == api_key:
                 user = username
                 break
-        
+
         if not user:
             emit('error', {'message': 'Invalid API key'})
             disconnect()
             return
-        
-        # 存储用户信息到会话
-        request.sid_user = user
+
+        _sid_users[request.sid] = user
         print(f"[WS Upload] User {user} connected")
         emit('connected', {'message': 'Connected successfully', 'user': user})
-    
-    @socketio.on('disconnect', namespace='/ws/upload')
+
+    @socketio.on('disconnect', namespace=NAMESPACE)
     def handle_disconnect():
-        """处理断开连接"""
-        user = getattr(request, 'sid_user', 'unknown')
+        """处理断开连接；未完成的上传保留，等待重连后续传"""
+        user = _sid_users.pop(request.sid, 'unknown')
         print(f"[WS Upload] User {user} disconnected")
-        
-        # 清理该用户未完成的上传
-        to_delete = []
-        for upload_id, upload_info in active_uploads.items():
-            if upload_info.get('user') == user:
-                to_delete.append(upload_id)
-        
-        for upload_id in to_delete:
-            cleanup_upload(upload_id)
-    
-    @socketio.on('start_upload', namespace='/ws/upload')
+
+    @socketio.on('start_upload', namespace=NAMESPACE)
     def handle_start_upload(data):
         """
         开始上传
-        
+
         期望数据:
         {
             "filename": "output.wav",
@@ -95,245 +276,284 @@ def create_ws_upload_blueprint(socketio, s3_utils):
             "content_type": "audio/wav"
         }
         """
-        user = getattr(request, 'sid_user', None)
+        user = _sid_users.get(request.sid)
         if not user:
-            emit('error', {'status': 'error', 'error': 'Not authenticated'})
-            return
-        
-        filename = data.get('filename')
-        file_size = data.get('file_size', 0)
+            return _error('Not authenticated')
+
+        filename = (data.get('filename') or '').replace('/', '_').replace('\\', '_')
+        try:
+            file_size = int(data.get('file_size') or 0)
+        except (TypeError, ValueError):
+            file_size = 0
         content_type = data.get('content_type', 'application/octet-stream')
-        
+
         if not filename:
-            emit('error', {'status': 'error', 'error': 'Missing filename'})
-            return
-        
-        # 创建上传 ID
+            return _error('Missing filename')
+        # 旧客户端不发送 file_size：按流式上传处理
+        streaming = file_size <= 0
+
+        # 生成 S3 对象名并开始分片上传
+        timestamp = time.strftime('%Y%m%d%H%M%S')
+        s3_object_name = f"{user}/{timestamp}_{filename}"
+        multipart_id = s3_utils.create_multipart_upload(s3_object_name, content_type)
+        if not multipart_id:
+            return _error('S3 multipart upload could not be started')
+
         upload_id = str(uuid.uuid4())
-        
-        # 创建临时文件路径
-        temp_dir = os.path.join(current_app.instance_path, 'ws_uploads')
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_path = os.path.join(temp_dir, f"{upload_id}_{filename}")
-        
-        # 存储上传信息
-        active_uploads[upload_id] = {
-            'user': user,
-            'filename': filename,
-            'file_size': file_size,
-            'content_type': content_type,
-            'temp_path': temp_path,
-            'received_bytes': 0,
-            'chunks': [],
-            'start_time': time.time(),
-            'file_handle': open(temp_path, 'wb')
-        }
-        
-        print(f"[WS Upload] Started upload {upload_id} for {user}: {filename} ({file_size} bytes)")
-        
-        emit('ready', {
+        with _uploads_lock:
+            active_uploads[upload_id] = {
+                'user': user,
+                'filename': filename,
+                'file_size': None if streaming else file_size,
+                'content_type': content_type,
+                's3_object_name': s3_object_name,
+                'multipart_id': multipart_id,
+                'parts': {},               # {part_index: {'buffer': bytearray, 'ranges': [[start, end], ...]}}
+                'uploading_parts': set(),
+                'uploaded_parts': {},      # {part_index: etag}
+                'received_bytes': 0,
+                'next_offset': 0,          # 旧客户端顺序追加时使用
+                'streaming': streaming,
+                'stream_buffer': bytearray(),  # 流式上传：尚未凑满一个分片的数据
+                'stream_next_part': 0,
+                'stream_closed': False,
+                'start_time': time.time(),
+                'last_activity': time.time(),
+                'lock': threading.Lock()
+            }
+
+        size_label = 'streaming' if streaming else f'{file_size} bytes'
+        print(f"[WS Upload] Started upload {upload_id} for {user}: {filename} ({size_label})")
+
+        return _reply('ready', {
             'status': 'ready',
             'upload_id': upload_id,
+            'part_size': PART_SIZE,
+            'max_chunk_size': MAX_CHUNK_SIZE,
+            'streaming': streaming,
             'message': 'Ready to receive chunks'
         })
-    
-    @socketio.on('upload_chunk', namespace='/ws/upload')
+
+    @socketio.on('upload_chunk', namespace=NAMESPACE)
     def handle_upload_chunk(data):
         """
         接收上传块
-        
+
         期望数据:
         {
             "upload_id": "xxx",
-            "chunk_index": 0,
-            "data": "base64_encoded_data",
-            "is_last": false
+            "offset": 0,
+            "data": <bytes>,
+            "sha256": "hex digest of data"   # 可选
         }
         """
         upload_id = data.get('upload_id')
-        chunk_index = data.get('chunk_index', 0)
-        chunk_data_b64 = data.get('data', '')
-        is_last = data.get('is_last', False)
-        
-        if upload_id not in active_uploads:
-            emit('error', {'status': 'error', 'error': 'Invalid upload ID'})
-            return
-        
-        upload_info = active_uploads[upload_id]
-        
-        # 检查超时
-        if time.time() - upload_info['start_time'] > UPLOAD_TIMEOUT:
-            cleanup_upload(upload_id)
-            emit('error', {'status': 'error', 'error': 'Upload timeout'})
-            return
-        
-        try:
-            # 解码 base64 数据
-            chunk_data = base64.b64decode(chunk_data_b64)
-            
-            # 写入临时文件
-            upload_info['file_handle'].write(chunk_data)
-            upload_info['received_bytes'] += len(chunk_data)
-            upload_info['chunks'].append(chunk_index)
-            
-            # 计算进度
-            progress = 0
-            if upload_info['file_size'] > 0:
-                progress = int((upload_info['received_bytes'] / upload_info['file_size']) * 100)
-            
-            emit('chunk_ack', {
-                'status': 'ok',
-                'chunk_index': chunk_index,
-                'received_bytes': upload_info['received_bytes'],
-                'progress': progress
+        upload_info = _get_owned_upload(upload_id)
+        if not upload_info:
+            return _error('Invalid upload ID', upload_id=upload_id)
+
+        chunk_data = data.get('data') or b''
+        if isinstance(chunk_data, str):
+            # 旧客户端发送 base64 字符串
+            try:
+                chunk_data = base64.b64decode(chunk_data)
+            except (ValueError, TypeError):
+                return _error('Invalid chunk encoding', upload_id=upload_id)
+        chunk_data = bytes(chunk_data)
+
+        if not chunk_data or len(chunk_data) > MAX_CHUNK_SIZE:
+            return _error(f'Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes', upload_id=upload_id)
+
+        expected_sha = data.get('sha256')
+        if expected_sha and hashlib.sha256(chunk_data).hexdigest() != expected_sha.lower():
+            return _reply('chunk_error', {
+                'status': 'checksum_mismatch',
+                'upload_id': upload_id,
+                'offset': data.get('offset'),
+                'error': 'Checksum mismatch, resend chunk'
             })
-            
-        except Exception as e:
-            emit('error', {'status': 'error', 'error': f'Chunk error: {str(e)}'})
-    
-    @socketio.on('complete_upload', namespace='/ws/upload')
+
+        with upload_info['lock']:
+            offset = data.get('offset')
+            if offset is None:
+                offset = upload_info['next_offset']
+            try:
+                offset = int(offset)
+            except (TypeError, ValueError):
+                return _error('Invalid offset', upload_id=upload_id)
+            if upload_info['streaming']:
+                if offset != upload_info['next_offset']:
+                    return _error('Streaming uploads must be sent in order', upload_id=upload_id, offset=offset)
+            elif offset < 0 or offset + len(chunk_data) > upload_info['file_size']:
+                return _error('Chunk outside of file bounds', upload_id=upload_id, offset=offset)
+
+            try:
+                if upload_info['streaming']:
+                    error = _append_stream(upload_info, chunk_data)
+                    added = 0  # _append_stream 已计入 received_bytes
+                else:
+                    added, error = _write_range(upload_info, offset, chunk_data)
+            except Exception as e:
+                return _error(f'Chunk error: {str(e)}', upload_id=upload_id, offset=offset)
+            if error:
+                return _reply('chunk_error', {
+                    'status': 'retry',
+                    'upload_id': upload_id,
+                    'offset': offset,
+                    'error': error
+                })
+
+            upload_info['received_bytes'] += added
+            upload_info['next_offset'] = max(upload_info['next_offset'], offset + len(chunk_data))
+            upload_info['last_activity'] = time.time()
+            received_bytes = upload_info['received_bytes']
+
+        # 计算进度（流式上传不知道总大小）
+        progress = 0
+        if upload_info['file_size']:
+            progress = int((received_bytes / upload_info['file_size']) * 100)
+
+        return _reply('chunk_ack', {
+            'status': 'ok',
+            'upload_id': upload_id,
+            'offset': offset,
+            'length': len(chunk_data),
+            'chunk_index': data.get('chunk_index'),
+            'received_bytes': received_bytes,
+            'progress': progress
+        })
+
+    @socketio.on('resume_upload', namespace=NAMESPACE)
+    def handle_resume_upload(data):
+        """
+        查询上传进度以便断线续传
+
+        期望数据: {"upload_id": "xxx"}
+        """
+        upload_id = data.get('upload_id')
+        upload_info = _get_owned_upload(upload_id)
+        if not upload_info:
+            return _error('Invalid upload ID', upload_id=upload_id)
+
+        with upload_info['lock']:
+            if upload_info['streaming']:
+                received = upload_info['received_bytes']
+                ranges = [[0, received]] if received else []
+            else:
+                ranges = _received_ranges(upload_info)
+            upload_info['last_activity'] = time.time()
+
+        return _reply('resume_state', {
+            'status': 'ok',
+            'upload_id': upload_id,
+            'file_size': upload_info['file_size'],
+            'part_size': PART_SIZE,
+            'max_chunk_size': MAX_CHUNK_SIZE,
+            'received_ranges': ranges,
+            'received_bytes': upload_info['received_bytes'],
+            'complete': bool(upload_info['file_size']) and ranges == [[0, upload_info['file_size']]]
+        })
+
+    @socketio.on('complete_upload', namespace=NAMESPACE)
     def handle_complete_upload(data):
         """
-        完成上传并转存到 S3
-        
+        完成上传：上传剩余分片并合并 S3 分片
+
         期望数据:
         {
             "upload_id": "xxx"
         }
         """
         upload_id = data.get('upload_id')
-        
-        if upload_id not in active_uploads:
-            emit('error', {'status': 'error', 'error': 'Invalid upload ID'})
-            return
-        
-        upload_info = active_uploads[upload_id]
-        user = upload_info['user']
-        filename = upload_info['filename']
-        temp_path = upload_info['temp_path']
-        content_type = upload_info['content_type']
-        
-        try:
-            # 关闭文件句柄
-            upload_info['file_handle'].close()
-            
-            # 生成 S3 对象名
-            timestamp = time.strftime('%Y%m%d%H%M%S')
-            s3_object_name = f"{user}/{timestamp}_{filename}"
-            
-            print(f"[WS Upload] Uploading to S3: {s3_object_name}")
-            
-            # 上传到 S3
-            success = s3_utils.upload_file_to_s3(temp_path, s3_object_name, content_type)
-            
-            if success:
-                # 获取公共 URL
-                public_url = s3_utils.get_public_s3_url(s3_object_name)
-                
-                print(f"[WS Upload] Upload complete: {public_url}")
-                
-                emit('upload_complete', {
-                    'status': 'success',
-                    'public_url': public_url,
-                    's3_object_name': s3_object_name
-                })
+        upload_info = _get_owned_upload(upload_id)
+        if not upload_info:
+            return _error('Invalid upload ID', upload_id=upload_id)
+
+        with upload_info['lock']:
+            if upload_info['streaming']:
+                _close_stream(upload_info)
             else:
-                emit('error', {'status': 'error', 'error': 'S3 upload failed'})
-            
-        except Exception as e:
-            print(f"[WS Upload] Error completing upload: {e}")
-            emit('error', {'status': 'error', 'error': str(e)})
-        
-        finally:
-            # 清理
-            cleanup_upload(upload_id)
-    
-    @socketio.on('cancel_upload', namespace='/ws/upload')
+                ranges = _received_ranges(upload_info)
+                if ranges != [[0, upload_info['file_size']]]:
+                    return _error('Upload incomplete', upload_id=upload_id, received_ranges=ranges)
+            if upload_info['uploading_parts']:
+                return _reply('chunk_error', {
+                    'status': 'retry',
+                    'upload_id': upload_id,
+                    'error': 'Parts still uploading, retry complete_upload shortly'
+                })
+
+            # 重试之前上传失败的分片
+            for part_index in list(upload_info['parts'].keys()):
+                if not _flush_part(upload_info, part_index):
+                    return _error(f'S3 part {part_index + 1} upload failed, retry complete_upload',
+                                  upload_id=upload_id)
+            parts = {index + 1: etag for index, etag in upload_info['uploaded_parts'].items()}
+
+        s3_object_name = upload_info['s3_object_name']
+        print(f"[WS Upload] Completing S3 multipart upload: {s3_object_name} ({len(parts)} parts)")
+
+        if not s3_utils.complete_multipart_upload(s3_object_name, upload_info['multipart_id'], parts):
+            return _error('S3 upload failed', upload_id=upload_id)
+
+        with _uploads_lock:
+            active_uploads.pop(upload_id, None)
+
+        # 获取公共 URL
+        public_url = s3_utils.get_public_s3_url(s3_object_name)
+        print(f"[WS Upload] Upload complete: {public_url}")
+        schedule_derivatives(current_app._get_current_object(), s3_object_name)
+
+        return _reply('upload_complete', {
+            'status': 'success',
+            'upload_id': upload_id,
+            'public_url': public_url,
+            's3_object_name': s3_object_name
+        })
+
+    @socketio.on('cancel_upload', namespace=NAMESPACE)
     def handle_cancel_upload(data):
         """取消上传"""
         upload_id = data.get('upload_id')
-        
-        if upload_id in active_uploads:
-            cleanup_upload(upload_id)
-            emit('cancelled', {'status': 'cancelled', 'upload_id': upload_id})
-        else:
-            emit('error', {'status': 'error', 'error': 'Invalid upload ID'})
-    
-    def cleanup_upload(upload_id):
-        """清理上传任务"""
-        if upload_id not in active_uploads:
-            return
-        
-        upload_info = active_uploads[upload_id]
-        
-        try:
-            # 关闭文件句柄
-            if upload_info.get('file_handle'):
-                try:
-                    upload_info['file_handle'].close()
-                except:
-                    pass
-            
-            # 删除临时文件
-            temp_path = upload_info.get('temp_path')
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-        except Exception as e:
-            print(f"[WS Upload] Cleanup error: {e}")
-        
-        finally:
-            del active_uploads[upload_id]
-    
+
+        if _get_owned_upload(upload_id):
+            _abort(upload_id)
+            return _reply('cancelled', {'status': 'cancelled', 'upload_id': upload_id})
+        return _error('Invalid upload ID', upload_id=upload_id)
+
     # 定期清理超时的上传
     def cleanup_expired_uploads():
-        """清理超时的上传任务"""
+        """中止长时间没有活动的上传任务（需要在 app context 中调用）"""
         current_time = time.time()
-        to_delete = []
-        
-        for upload_id, upload_info in active_uploads.items():
-            if current_time - upload_info['start_time'] > UPLOAD_TIMEOUT:
-                to_delete.append(upload_id)
-        
+        to_delete = [
+            upload_id for upload_id, upload_info in list(active_uploads.items())
+            if current_time - upload_info['last_activity'] > UPLOAD_TIMEOUT
+        ]
+
         for upload_id in to_delete:
-            print(f"[WS Upload] Cleaning up expired upload: {upload_id}")
-            cleanup_upload(upload_id)
-    
+            print(f"[WS Upload] Aborting expired upload: {upload_id}")
+            _abort(upload_id)
+
     return ws_bp, cleanup_expired_uploads
 
 
-# ===== 集成示例 =====
-"""
-在您的 Flask 应用 __init__.py 中添加以下代码:
-
-from flask import Flask
-from flask_socketio import SocketIO
-from .ws_upload_handler import create_ws_upload_blueprint
-from . import s3_utils
-
-socketio = SocketIO()
-
-def create_app():
-    app = Flask(__name__)
-    
-    # 初始化 SocketIO
-    socketio.init_app(app, cors_allowed_origins="*")
-    
-    # 创建 WebSocket 上传蓝图
-    ws_bp, cleanup_func = create_ws_upload_blueprint(socketio, s3_utils)
-    app.register_blueprint(ws_bp)
-    
-    # 设置定期清理任务
-    import threading
+_cleanup_started = False
+
+
+def start_expired_upload_cleanup(app, socketio, cleanup_func, interval=60):
+    """每个进程只启动一次的后台清理任务"""
+    global _cleanup_started
+    if _cleanup_started:
+        return
+    _cleanup_started = True
+
     def periodic_cleanup():
-        import time
         while True:
-            time.sleep(60)  # 每分钟检查一次
-            with app.app_context():
-                cleanup_func()
-    
-    cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-    cleanup_thread.start()
-    
-    return app
-"""
+            socketio.sleep(interval)  # 每分钟检查一次
+            try:
+                with app.app_context():
+                    cleanup_func()
+            except Exception as e:
+                print(f"[WS Upload] Cleanup error: {e}")
+
+    socketio.start_background_task(periodic_cleanup)
@@ -1,5 +1,18 @@
+import os
+
+# Green thread libraries must patch the stdlib before anything else is imported
+# (importing the project package would already pull in Flask and threading).
+ASYNC_MODE = (os.environ.get('SOCKETIO_ASYNC_MODE') or 'threading').strip().lower()
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
 from project import create_app
 from project.database import init_db, backup_db
+from project.api import sweep_expired_modal_drive_shares
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
 
@@ -9,13 +22,18 @@ app = create_app()
 with app.app_context():
     init_db()
 
-# Scheduler for automatic database backups
+# Scheduler for automatic database backups and share link expiry
 def run_backup():
     with app.app_context():
         backup_db()
 
+def run_share_sweep():
+    with app.app_context():
+        sweep_expired_modal_drive_shares()
+
 scheduler = BackgroundScheduler()
 scheduler.add_job(func=run_backup, trigger="interval", days=1)
+scheduler.add_job(func=run_share_sweep, trigger="interval", minutes=10)
 scheduler.start()
 
 # Shut down the scheduler when exiting the app
@@ -24,4 +42,8 @@ atexit.register(lambda: scheduler.shutdown())
 if __name__ == '__main__':
     # Use SocketIO's run method for WebSocket support
     socketio = app.socketio
-    socketio.run(app, host='0.0.0.0', port=5001, debug=False, allow_unsafe_werkzeug=True)
+    if app.config.get('SOCKETIO_ASYNC_MODE') == 'threading':
+        socketio.run(app, host='0.0.0.0', port=5001, debug=False, allow_unsafe_werkzeug=True)
+    else:
+        # eventlet/gevent ship their own production WSGI servers
+        socketio.run(app, host='0.0.0.0', port=5001, debug=False)
@@ -6,41 +6,50 @@ import sys
 # --- Standard Client Setup ---
 sio = socketio.Client()
 
+PROTOCOL_VERSION = 2
+
 @sio.event
 def connect():
-    print("Connection established. Sending authentication...")
-    # Once connected, we send our credentials
-    sio.emit('authenticate', {
+    print("Connection established. Registering as worker...")
+    # Once connected, we send our credentials and capabilities
+    sio.emit('register_remote', {
         'space_name': ARGS.space_name,
-        'token': ARGS.token
-    }, namespace='/workers')
+        'token': ARGS.token,
+        'protocol_version': PROTOCOL_VERSION,
+        'capabilities': {
+            'max_concurrency': 1,
+            'max_batch_size': 1,
+            'binary': False
+        }
+    })
 
 @sio.event
 def disconnect():
     print("Disconnected from server.")
 
-# --- Custom Namespace Events ---
+# --- Worker Protocol Events ---
 
-@sio.on('auth_response', namespace='/workers')
-def on_auth_response(data):
-    """Handle the server's response to our authentication attempt."""
+@sio.on('register_result')
+def on_register_result(data):
+    """Handle the server's response to our registration attempt."""
     if data.get('success'):
-        print(f"Successfully authenticated as worker for space: '{ARGS.space_name}'")
+        print(f"Successfully registered as worker for space: '{ARGS.space_name}'")
+        print(f"Protocol v{data.get('protocol_version')}, capabilities: {data.get('capabilities')}")
         print("Waiting for tasks...")
     else:
-        print(f"Authentication failed: {data.get('message')}")
+        print(f"Registration failed: {data.get('error')}")
         print("Disconnecting.")
         sio.disconnect()
         sys.exit(1) # Exit with an error code
 
-@sio.on('new_task', namespace='/workers')
-def on_new_task(data):
+@sio.on('inference_request')
+def on_inference_request(data):
     """Handle a new task received from the server."""
-    task_id = data.get('task_id')
-    inputs = data.get('inputs', {})
+    request_id = data.get('request_id')
+    inputs = data.get('data', {})
     print(f"\n--- Received New Task ---")
-    print(f"  Task ID: {task_id}")
-    print(f"  Inputs: {inputs}")
+    print(f"  Request ID: {request_id}")
+    print(f"  Inputs: {str(inputs)[:200]}")
 
     # Simulate processing time
     processing_time = 10
@@ -52,22 +61,22 @@ def on_new_task(data):
 
     # Prepare the result
     result = {
-        'text': f"Processed result for prompt: '{inputs.get('text', 'N/A')}'",
+        'text': f"Processed result for prompt: '{inputs.get('prompt', 'N/A')}'",
         'output_files': []
     }
 
     # If there was an image input, pretend we generated an image output
-    if 'image_url' in inputs:
+    if 'image' in inputs:
         result['image_url'] = 'https://i.imgur.com/g27tN6s.jpeg' # A placeholder image
 
     print(f"Sending result back to server...")
 
     # Send the result back
-    sio.emit('task_result', {
-        'task_id': data.get('task_id'),
-        'user_sid': data.get('user_sid'),
+    sio.emit('inference_result', {
+        'request_id': request_id,
+        'success': True,
         'result': result
-    }, namespace='/workers')
+    })
 
     print("Result sent. Waiting for next task...")
 
@@ -81,7 +90,7 @@ if __name__ == '__main__':
 
     try:
         # Connect to the server
-        sio.connect(ARGS.host, namespaces=['/workers'])
+        sio.connect(ARGS.host)
 
         # Wait for events
         sio.wait()
@@ -0,0 +1,80 @@
+"""
+Key failover in NetMindClient._run_with_failover for keys that ran out of
+credit: a 402 and an insufficient_quota 429 must blacklist the key and move
+the request on to the next one, while an ordinary 429 only cools it down.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('openai')
+from openai import APIStatusError, RateLimitError
+
+from project import netmind_proxy
+from project.netmind_proxy import NetMindClient
+
+
+def _response(status_code):
+    return SimpleNamespace(status_code=status_code, headers={}, request=None)
+
+
+def _run(monkeypatch, error):
+    monkeypatch.setattr(netmind_proxy, 'save_db', lambda db: None)
+    client = NetMindClient()
+    calls = []
+
+    def make_start(key, endpoint):
+        def start():
+            calls.append(key)
+            if key == 'dead-key':
+                raise error
+            return 'ok'
+        return start
+
+    settings = {'keys': ['dead-key', 'live-key']}
+    # Make sure the exhausted key is tried first
+    client.scheduler.pick = lambda candidates, exclude=None: candidates[0]
+    try:
+        result = client._run_with_failover(
+            {}, settings, ['dead-key', 'live-key'], ['https://netmind.example/v1'],
+            make_start, stream=False, first_token_timeout=None, hedge_delay=None
+        )
+    finally:
+        del client.scheduler.pick
+        client.scheduler.forget('dead-key')
+        client.scheduler.forget('live-key')
+    return result, calls, settings
+
+
+def test_402_blacklists_key_and_fails_over(monkeypatch):
+    error = APIStatusError('Payment Required', response=_response(402), body=None)
+    result, calls, settings = _run(monkeypatch, error)
+    assert result == 'ok'
+    assert calls == ['dead-key', 'live-key']
+    assert settings['blacklist'] == ['dead-key']
+
+
+def test_insufficient_quota_429_blacklists_key_and_fails_over(monkeypatch):
+    error = RateLimitError(
+        "Error code: 429 - {'error': {'code': 'insufficient_quota'}}",
+        response=_response(429), body={'error': {'code': 'insufficient_quota'}}
+    )
+    result, calls, settings = _run(monkeypatch, error)
+    assert result == 'ok'
+    assert calls == ['dead-key', 'live-key']
+    assert settings['blacklist'] == ['dead-key']
+
+
+def test_rate_limit_429_cools_down_without_blacklisting(monkeypatch):
+    message = 'Rate limit / quota exceeded, retry later'
+    error = RateLimitError(message, response=_response(429), body={'error': {'message': message}})
+    cooled = []
+    monkeypatch.setattr(
+        NetMindClient().scheduler, 'observe',
+        lambda key, started_at, error=None: cooled.append(key) if error is not None else None
+    )
+    result, calls, settings = _run(monkeypatch, error)
+    assert result == 'ok'
+    assert calls == ['dead-key', 'live-key']
+    assert 'blacklist' not in settings
+    assert cooled == ['dead-key']
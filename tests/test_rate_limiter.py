@@ -0,0 +1,90 @@
+"""
+GCRA rate limiter (project/rate_limiter.py) on the memory and SQLite backends:
+burst allowance, rejection with retry_after/remaining, recovery after the
+emission interval, all-or-nothing multi-bucket hits and failing open.
+"""
+import pytest
+
+from project import rate_limiter
+from project.rate_limiter import MemoryBackend, RateLimit, RateLimiter, SQLiteBackend
+
+NOW = 1000.0
+# 3 requests per 60 s: one request is emitted every 20 s
+LIMIT = RateLimit(key='user:alice', max_requests=3, window_seconds=60)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend()
+    return SQLiteBackend(str(tmp_path / 'rate_limits.sqlite'))
+
+
+def test_burst_up_to_max_requests(backend):
+    remaining = []
+    for _ in range(3):
+        (result,) = backend.hit([LIMIT], NOW)
+        assert result.allowed
+        remaining.append(result.remaining)
+    assert remaining == [2, 1, 0]
+
+
+def test_rejection_reports_retry_after_and_remaining(backend):
+    for _ in range(3):
+        backend.hit([LIMIT], NOW)
+    (result,) = backend.hit([LIMIT], NOW + 5)
+    assert not result.allowed
+    assert result.remaining == 0
+    assert result.retry_after == pytest.approx(15)
+    assert result.reset_after == pytest.approx(55)
+    assert result.headers()['Retry-After'] == '15'
+
+
+def test_recovers_after_emission_interval(backend):
+    for _ in range(3):
+        backend.hit([LIMIT], NOW)
+    assert not backend.hit([LIMIT], NOW + 19.9)[0].allowed
+    (result,) = backend.hit([LIMIT], NOW + 20)
+    assert result.allowed
+    assert result.remaining == 0
+    # After a full idle window the whole burst is available again
+    (result,) = backend.hit([LIMIT], NOW + 20 + 60)
+    assert result.allowed
+    assert result.remaining == 2
+
+
+def test_denied_hit_does_not_consume_other_buckets(backend):
+    strict = RateLimit(key='model:m', max_requests=1, window_seconds=60)
+    loose = RateLimit(key='user:bob', max_requests=3, window_seconds=60)
+    assert all(r.allowed for r in backend.hit([strict, loose], NOW))
+    results = backend.hit([strict, loose], NOW)
+    assert not results[0].allowed
+    # The loose bucket was not charged for the rejected request
+    assert backend.hit([loose], NOW)[0].remaining == 1
+
+
+def test_sqlite_buckets_are_shared_between_backends(tmp_path):
+    path = str(tmp_path / 'rate_limits.sqlite')
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    for _ in range(3):
+        first.hit([LIMIT], NOW)
+    assert not second.hit([LIMIT], NOW)[0].allowed
+
+
+def test_limiter_returns_most_restrictive_result(monkeypatch, backend):
+    monkeypatch.setattr(rate_limiter.time, 'time', lambda: NOW)
+    limiter = RateLimiter(backend)
+    strict = RateLimit(key='model:m', max_requests=1, window_seconds=60)
+    assert limiter.hit([LIMIT, strict]).remaining == 0
+    denied = limiter.hit([LIMIT, strict])
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(60)
+    assert limiter.hit([]) is None
+
+
+def test_backend_errors_fail_open():
+    class BrokenBackend:
+        def hit(self, limits, now):
+            raise RuntimeError('database is locked')
+
+    assert RateLimiter(BrokenBackend()).hit([LIMIT]) is None
@@ -0,0 +1,107 @@
+"""
+Share-link storage (project/share_store.py): the expiry sweeper and its
+interaction with re-sharing a path while a sweep is running.
+"""
+import time
+
+import pytest
+
+from project import share_store
+
+
+@pytest.fixture(autouse=True)
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'database.sqlite')
+    monkeypatch.setattr(share_store, 'get_db_path', lambda: path)
+    return path
+
+
+def _share(token, relative_path, expires_at, username='alice'):
+    return {
+        'token': token,
+        'username': username,
+        'relative_path': relative_path,
+        'remote_path': f'/users/{username}/{relative_path}',
+        'filename': relative_path.rsplit('/', 1)[-1],
+        'public_url': f'https://drive.example/share/{token}',
+        'created_at': time.time(),
+        'expires_at': expires_at,
+    }
+
+
+def _reshare(relative_path, duration=3600, username='alice'):
+    """What the share endpoints do: pick the token, then save the new row."""
+    existing = share_store.find_share_by_path(username, relative_path)
+    token, replaced = share_store.choose_share_token(existing)
+    share_store.save_shares([_share(token, relative_path, int(time.time()) + duration, username)])
+    return token, replaced
+
+
+def test_sweep_removes_only_expired_shares():
+    now = int(time.time())
+    share_store.save_shares([
+        _share('old', 'a.txt', now - 10),
+        _share('live', 'b.txt', now + 3600),
+        _share('forever', 'c.txt', None),
+    ])
+    revoked = []
+    removed = share_store.sweep_expired_shares(lambda tokens: revoked.extend(tokens) or tokens)
+    assert removed == 1
+    assert revoked == ['old']
+    assert sorted(s['token'] for s in share_store.list_user_shares('alice')) == ['forever', 'live']
+
+
+def test_failed_remote_revoke_keeps_row_for_next_sweep():
+    share_store.save_shares([_share('old', 'a.txt', int(time.time()) - 10)])
+    assert share_store.sweep_expired_shares(lambda tokens: []) == 0
+    assert share_store.get_share('old') is not None
+    assert share_store.sweep_expired_shares(lambda tokens: tokens) == 1
+    assert share_store.get_share('old') is None
+
+
+def test_reshare_during_sweep_keeps_new_link():
+    share_store.save_shares([_share('old', 'a.txt', int(time.time()) - 10)])
+    revoked = []
+    new_tokens = []
+
+    def remote_delete(tokens):
+        # The user re-shares the expired file while the sweeper is revoking it
+        new_tokens.append(_reshare('a.txt'))
+        revoked.extend(tokens)
+        return tokens
+
+    share_store.sweep_expired_shares(remote_delete)
+    (new_token, replaced), = new_tokens
+    assert replaced == 'old'
+    assert new_token != 'old'
+    assert revoked == ['old']  # the sweeper never touched the new link
+    share = share_store.find_share_by_path('alice', 'a.txt')
+    assert share['token'] == new_token
+    assert share['expires_at'] > time.time()
+
+
+def test_reshare_of_live_link_keeps_token_and_survives_sweep():
+    share_store.save_shares([_share('live', 'a.txt', int(time.time()) + 60)])
+    token, replaced = _reshare('a.txt', duration=7200)
+    assert (token, replaced) == ('live', None)
+    assert share_store.sweep_expired_shares(lambda tokens: pytest.fail('nothing should be revoked')) == 0
+    assert share_store.get_share('live')['expires_at'] > time.time() + 3600
+
+
+def test_delete_with_expired_before_keeps_extended_rows():
+    now = int(time.time())
+    share_store.save_shares([_share('a', 'a.txt', now - 10), _share('b', 'b.txt', now + 3600)])
+    assert share_store.delete_shares(['a', 'b'], expired_before=now) == 1
+    assert share_store.get_share('b') is not None
+
+
+def test_migrate_json_shares_keeps_newest_per_path():
+    db = {'modal_drive_shares': {
+        't1': {'username': 'alice', 'relative_path': 'a.txt', 'created_at': 1, 'expires_at': 10},
+        't2': {'username': 'alice', 'relative_path': 'a.txt', 'created_at': 2, 'expires_at': 20},
+        'bad': {'username': '', 'relative_path': 'x'},
+    }}
+    assert share_store.migrate_json_shares(db)
+    assert 'modal_drive_shares' not in db
+    assert share_store.find_share_by_path('alice', 'a.txt')['token'] == 't2'
+    assert share_store.get_share('t1') is None
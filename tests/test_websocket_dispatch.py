@@ -0,0 +1,197 @@
+"""
+Request dispatch in project/websocket_server.py: batching of compatible
+requests (without holding up the rest of the queue), per-item answers and
+timeouts inside a batch, and failover through the worker circuit breaker.
+"""
+import time
+
+import pytest
+
+pytest.importorskip('flask_socketio')
+
+from project import websocket_server as ws
+
+SPACE = 'tts'
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, payload, room=None):
+        self.emitted.append((event, payload, room))
+
+    def start_background_task(self, func):
+        self.tasks.append(func)
+
+    def sleep(self, seconds):
+        pass
+
+    def sent(self, event):
+        return [(payload, room) for name, payload, room in self.emitted if name == event]
+
+
+@pytest.fixture
+def sio(monkeypatch):
+    fake = FakeSocketIO()
+    monkeypatch.setattr(ws, 'socketio', fake)
+    for name in ('active_connections', 'request_queues', 'in_flight', 'in_flight_batches',
+                 'pending_results', 'user_sockets'):
+        monkeypatch.setattr(ws, name, {})
+    monkeypatch.setattr(ws, '_flush_scheduled', set())
+    space = {'id': 's1', 'name': SPACE, 'ws_batch_max_size': 2, 'ws_batch_max_wait_ms': 10000,
+             'ws_request_timeout_seconds': 10}
+    monkeypatch.setattr(ws, 'load_db', lambda: {'spaces': {'s1': space}})
+    monkeypatch.setattr(ws, 'find_space_by_name', lambda db, name: space if name == SPACE else None)
+    return fake
+
+
+def _add_worker(sid, max_concurrency=1, max_batch_size=4):
+    worker = ws._new_worker_state(sid, SPACE, 2, {
+        'max_batch_size': max_batch_size,
+        'max_concurrency': max_concurrency,
+        'binary': False,
+        'heartbeat_interval': None,
+    })
+    ws.active_connections.setdefault(SPACE, {})[sid] = worker
+    return worker
+
+
+def _queue(request_id, batch_key=None, batch_max_size=1, waited=0.0):
+    request_data = {
+        'request_id': request_id,
+        'user': 'alice',
+        'data': {'prompt': request_id},
+        'submitted_at': time.time() - waited,
+        'timeout': 10,
+        'attempts': 0,
+        'excluded_sids': set(),
+        'batch_max_size': batch_max_size,
+        'batch_max_wait': 5.0,
+        'batch_key': batch_key,
+    }
+    ws.request_queues.setdefault(SPACE, ws.deque()).append(request_data)
+    ws.pending_results[request_id] = {'space_name': SPACE, 'user': 'alice', 'status': 'queued',
+                                      'result': None, 'queue_position': 0}
+    return request_data
+
+
+def _submit(prompt, voice='a'):
+    ok, request_id, _ = ws.submit_inference_request(SPACE, 'alice', {'prompt': prompt, 'voice': voice})
+    assert ok
+    return request_id
+
+
+def _dispatch_batch(sio, worker):
+    first, second = _submit('one'), _submit('two')
+    (payload, room), = sio.sent('inference_batch')
+    assert room == worker['sid']
+    return payload['batch_id'], first, second
+
+
+def test_compatible_requests_share_a_batch(sio):
+    worker = _add_worker('w1')
+    first = _submit('one')
+    # Alone in its group: held back for the batch window
+    assert not sio.sent('inference_request') and len(sio.tasks) == 1
+    second = _submit('two')
+    (payload, _), = sio.sent('inference_batch')
+    assert [r['request_id'] for r in payload['requests']] == [first, second]
+    assert worker['slots_in_use'] == 1
+    assert [ws.in_flight[r]['batch_position'] for r in (first, second)] == [0, 1]
+
+
+def test_waiting_batch_does_not_block_other_requests(sio):
+    _add_worker('w1', max_concurrency=3)
+    _queue('held', batch_key='voice-a', batch_max_size=2)
+    _queue('plain')
+    _queue('ready', batch_key='voice-b', batch_max_size=2, waited=6.0)
+    ws._dispatch(SPACE)
+    assert [p['request_id'] for p, _ in sio.sent('inference_request')] == ['plain', 'ready']
+    assert [r['request_id'] for r in ws.request_queues[SPACE]] == ['held']
+    assert ws.pending_results['held']['queue_position'] == 1
+    assert SPACE in ws._flush_scheduled
+
+    # Once the window has passed the lone request goes out by itself
+    ws.request_queues[SPACE][0]['submitted_at'] -= 6.0
+    ws._dispatch(SPACE)
+    assert ws.in_flight['held']['sid'] == 'w1'
+
+
+def test_batch_items_answer_individually(sio):
+    worker = _add_worker('w1')
+    batch_id, first, second = _dispatch_batch(sio, worker)
+
+    assert ws._apply_result('w1', {'request_id': first, 'success': True, 'result': {'text': 'one'}}) == SPACE
+    assert ws.pending_results[first]['status'] == 'completed'
+    assert ws.pending_results[second]['status'] == 'processing'
+    # The batch still occupies the worker until its last item is answered
+    assert worker['slots_in_use'] == 1 and batch_id in ws.in_flight_batches
+
+    ws._apply_result('w1', {'request_id': second, 'success': True, 'result': {'text': 'two'}})
+    assert ws.pending_results[second]['status'] == 'completed'
+    assert worker['slots_in_use'] == 0 and batch_id not in ws.in_flight_batches
+
+
+def test_batch_timeouts_scale_with_position(sio):
+    worker = _add_worker('w1')
+    _, first, second = _dispatch_batch(sio, worker)
+    for request_id in (first, second):
+        ws.in_flight[request_id]['dispatched_at'] -= 15  # past 1x but within 2x the timeout
+
+    ws._monitor_tick()
+    assert first not in ws.in_flight
+    assert [r['request_id'] for r in ws.request_queues[SPACE]] == [first]
+    assert ws.in_flight[second]['sid'] == 'w1'
+    assert sio.sent('inference_cancel') == [({'request_id': first}, 'w1')]
+    assert worker['consecutive_failures'] == 1
+
+
+def test_circuit_opens_after_repeated_failures_and_probes_after_cooldown(sio):
+    worker = _add_worker('w1', max_concurrency=2)
+    now = time.time()
+    for _ in range(ws.CIRCUIT_FAILURE_THRESHOLD - 1):
+        ws._record_failure(worker, 'boom')
+    assert worker['circuit'] == 'closed'
+    ws._record_failure(worker, 'boom')
+    assert worker['circuit'] == 'open'
+    assert not ws._worker_can_accept(worker, now)
+
+    later = now + ws.CIRCUIT_COOLDOWN_SECONDS + 1
+    assert ws._worker_can_accept(worker, later)
+    assert worker['circuit'] == 'half_open'
+    worker['slots_in_use'] = 1
+    assert not ws._worker_can_accept(worker, later)  # one probe at a time
+
+    # A failed probe re-opens the circuit straight away; a success closes it
+    ws._record_failure(worker, 'still broken')
+    assert worker['circuit'] == 'open'
+    worker['circuit'] = 'half_open'
+    ws._record_success(worker, 0.5)
+    assert worker['circuit'] == 'closed' and worker['consecutive_failures'] == 0
+
+
+def test_timed_out_request_fails_over_to_another_worker(sio):
+    _add_worker('w1')
+    _add_worker('w2')
+    _queue('job')
+    ws._dispatch(SPACE)
+    first_sid = ws.in_flight['job']['sid']
+    ws.in_flight['job']['dispatched_at'] -= 11
+
+    ws._monitor_tick()
+    assert ws.in_flight['job']['sid'] != first_sid
+    assert ws.in_flight['job']['request']['attempts'] == 2
+    assert ws.active_connections[SPACE][first_sid]['failures'] == 1
+
+
+def test_retryable_failures_give_up_after_max_attempts(sio):
+    _add_worker('w1', max_concurrency=2)
+    _queue('job')
+    ws._dispatch(SPACE)
+    for _ in range(ws.MAX_DISPATCH_ATTEMPTS):
+        ws._apply_result('w1', {'request_id': 'job', 'success': False, 'retryable': True, 'error': 'OOM'})
+        ws._dispatch(SPACE)
+    assert ws.pending_results['job']['status'] == 'failed'
+    assert 'job' not in ws.in_flight and not ws.request_queues[SPACE]
@@ -0,0 +1,172 @@
+"""
+/ws/upload handlers (project/ws_upload_handler.py) against a stubbed
+s3_utils: offset-addressed and out-of-order chunks, duplicates, the
+MAX_BUFFERED_PARTS back-pressure, resume after a reconnect, and the
+streaming mode used when start_upload has no file_size.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('flask_socketio')
+
+from project import database
+from project import ws_upload_handler as ws
+
+PART_SIZE = 10
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event, namespace=None):
+        def register(func):
+            self.handlers[event] = func
+            return func
+        return register
+
+
+class FakeS3:
+    def __init__(self):
+        self.parts = {}
+        self.completed = None
+        self.fail_next = []
+
+    def create_multipart_upload(self, object_name, content_type=None):
+        return 'multipart-1'
+
+    def upload_part(self, object_name, upload_id, part_number, data):
+        if self.fail_next:
+            raise self.fail_next.pop(0)
+        self.parts[part_number] = bytes(data)
+        return f'etag-{part_number}'
+
+    def complete_multipart_upload(self, object_name, upload_id, parts):
+        self.completed = dict(parts)
+        return True
+
+    def abort_multipart_upload(self, object_name, upload_id):
+        return True
+
+    def get_public_s3_url(self, object_name):
+        return f'https://s3.example/{object_name}'
+
+    def body(self):
+        return b''.join(self.parts[n] for n in sorted(self.parts))
+
+
+@pytest.fixture
+def upload(monkeypatch):
+    monkeypatch.setattr(ws, 'PART_SIZE', PART_SIZE)
+    monkeypatch.setattr(ws, 'MAX_CHUNK_SIZE', 4)
+    monkeypatch.setattr(ws, 'MAX_BUFFERED_PARTS', 3)
+    monkeypatch.setattr(ws, 'emit', lambda *args, **kwargs: None)
+    monkeypatch.setattr(ws, 'disconnect', lambda: None)
+    monkeypatch.setattr(ws, 'schedule_derivatives', lambda app, key: None)
+    monkeypatch.setattr(ws, 'current_app', SimpleNamespace(_get_current_object=lambda: None))
+    monkeypatch.setattr(ws, 'request', SimpleNamespace(sid='sid-1', headers={}))
+    monkeypatch.setattr(database, 'load_db', lambda: {'users': {'alice': {'api_key': 'key-a'}}})
+    monkeypatch.setattr(ws, 'active_uploads', {})
+    monkeypatch.setattr(ws, '_sid_users', {})
+
+    sio, s3 = FakeSocketIO(), FakeS3()
+    ws.create_ws_upload_blueprint(sio, s3)
+    handlers = sio.handlers
+    handlers['connect']({'api_key': 'key-a'})
+    return SimpleNamespace(handlers=handlers, s3=s3)
+
+
+def _reconnect(upload, sid):
+    upload.handlers['disconnect']()
+    ws.request.sid = sid
+    upload.handlers['connect']({'api_key': 'key-a'})
+
+
+def _send(upload, upload_id, offset, data):
+    return upload.handlers['upload_chunk']({'upload_id': upload_id, 'offset': offset, 'data': data})
+
+
+DATA = bytes(range(25))
+
+
+def test_out_of_order_and_duplicate_chunks(upload):
+    upload_id = upload.handlers['start_upload']({'filename': 'a.bin', 'file_size': len(DATA)})['upload_id']
+    offsets = [20, 4, 0, 8, 16, 12, 24]
+    for offset in offsets:
+        assert _send(upload, upload_id, offset, DATA[offset:offset + 4])['status'] == 'ok'
+    # Resending a chunk of an already uploaded part is acknowledged but not counted twice
+    ack = _send(upload, upload_id, 0, DATA[0:4])
+    assert ack['status'] == 'ok'
+    assert ack['received_bytes'] == len(DATA)
+
+    done = upload.handlers['complete_upload']({'upload_id': upload_id})
+    assert done['status'] == 'success'
+    assert upload.s3.completed == {1: 'etag-1', 2: 'etag-2', 3: 'etag-3'}
+    assert upload.s3.body() == DATA
+
+
+def test_too_many_buffered_parts_asks_client_to_retry(upload, monkeypatch):
+    monkeypatch.setattr(ws, 'MAX_BUFFERED_PARTS', 2)
+    upload_id = upload.handlers['start_upload']({'filename': 'a.bin', 'file_size': len(DATA)})['upload_id']
+    assert _send(upload, upload_id, 0, DATA[0:1])['status'] == 'ok'
+    assert _send(upload, upload_id, 10, DATA[10:11])['status'] == 'ok'
+    reply = _send(upload, upload_id, 20, DATA[20:21])
+    assert reply['status'] == 'retry'
+    assert ws.active_uploads[upload_id]['received_bytes'] == 2
+
+
+def test_resume_after_reconnect(upload):
+    upload_id = upload.handlers['start_upload']({'filename': 'a.bin', 'file_size': len(DATA)})['upload_id']
+    for offset in (0, 4, 8, 16):
+        _send(upload, upload_id, offset, DATA[offset:offset + 4])
+
+    _reconnect(upload, 'sid-2')
+    state = upload.handlers['resume_upload']({'upload_id': upload_id})
+    assert state['received_ranges'] == [[0, 12], [16, 20]]
+    assert not state['complete']
+
+    for offset in (12, 20, 24):
+        _send(upload, upload_id, offset, DATA[offset:offset + 4])
+    assert upload.handlers['resume_upload']({'upload_id': upload_id})['complete']
+    assert upload.handlers['complete_upload']({'upload_id': upload_id})['status'] == 'success'
+    assert upload.s3.body() == DATA
+
+
+def test_upload_belongs_to_its_user(upload, monkeypatch):
+    upload_id = upload.handlers['start_upload']({'filename': 'a.bin', 'file_size': len(DATA)})['upload_id']
+    monkeypatch.setattr(database, 'load_db', lambda: {'users': {'bob': {'api_key': 'key-b'}}})
+    upload.handlers['disconnect']()
+    ws.request.sid = 'sid-bob'
+    upload.handlers['connect']({'api_key': 'key-b'})
+    assert upload.handlers['resume_upload']({'upload_id': upload_id})['error'] == 'Invalid upload ID'
+
+
+def test_streaming_upload_without_file_size(upload):
+    ready = upload.handlers['start_upload']({'filename': 'a.bin'})
+    assert ready['streaming']
+    upload_id = ready['upload_id']
+    # Legacy clients send no offset; chunks are appended in order
+    for start in range(0, len(DATA), 4):
+        reply = upload.handlers['upload_chunk']({'upload_id': upload_id, 'data': DATA[start:start + 4]})
+        assert reply['status'] == 'ok'
+    assert upload.s3.parts.keys() == {1, 2}  # full parts go out before completion
+
+    out_of_order = _send(upload, upload_id, 0, DATA[0:4])
+    assert out_of_order['error'] == 'Streaming uploads must be sent in order'
+
+    done = upload.handlers['complete_upload']({'upload_id': upload_id})
+    assert done['status'] == 'success'
+    assert upload.s3.completed == {1: 'etag-1', 2: 'etag-2', 3: 'etag-3'}
+    assert upload.s3.body() == DATA
+
+
+def test_failed_part_is_kept_and_retried_on_complete(upload):
+    upload.s3.fail_next.append(ConnectionError('endpoint unreachable'))
+    upload_id = upload.handlers['start_upload']({'filename': 'a.bin', 'file_size': len(DATA)})['upload_id']
+    for offset in range(0, len(DATA), 4):
+        assert _send(upload, upload_id, offset, DATA[offset:offset + 4])['status'] == 'ok'
+    assert 1 not in upload.s3.parts
+
+    assert upload.handlers['complete_upload']({'upload_id': upload_id})['status'] == 'success'
+    assert upload.s3.body() == DATA
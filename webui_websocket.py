@@ -12,74 +12,125 @@ WebSocket 优势：
 
 import json
 import os
-import base64
 import asyncio
 import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 
 # WebSocket 相关
 try:
-    import websocket
+    import socketio
     WEBSOCKET_AVAILABLE = True
 except ImportError:
     WEBSOCKET_AVAILABLE = False
-    print("⚠️ websocket-client not installed. Run: pip install websocket-client")
+    print("⚠️ python-socketio not installed. Run: pip install python-socketio[client]")
 
+import hashlib
 import requests  # 备用 HTTP 方式
 
 # ===== WebSocket 上传配置 =====
 # 替换为您的实际值
-WEBSOCKET_URL = "wss://your-website.com/ws/upload"  # WebSocket 端点
+WEBSOCKET_URL = "https://your-website.com"  # 网站地址（Socket.IO 命名空间 /ws/upload）
 RELAY_API_URL = "https://your-website.com/api/relay-to-s3"  # HTTP 备用端点
 API_KEY = "YOUR_API_KEY_HERE"  # 在您的网站个人资料页面获取
 
-# 分块大小 (64KB)
-CHUNK_SIZE = 64 * 1024
+UPLOAD_NAMESPACE = '/ws/upload'
+
+# 分块大小 (512KB)，服务器会在 ready 中告知上限
+CHUNK_SIZE = 512 * 1024
+
+# 并行上传使用的连接数
+UPLOAD_CONNECTIONS = 2
+
+# 单个分块的最大重试次数
+CHUNK_RETRIES = 3
 
 # 线程池执行器，用于异步上传
 executor = ThreadPoolExecutor(max_workers=2)
 
 
 class WebSocketUploader:
-    """WebSocket 文件上传器"""
+    """
+    WebSocket 文件上传器
+
+    分块以二进制发送并带 sha256 校验，按 offset 分布到多个连接上并行上传。
+    上传失败时保留 upload_id，下次调用会通过 resume_upload 只补传缺失的部分。
+    """
     
-    def __init__(self, ws_url, api_key):
+    def __init__(self, ws_url, api_key, connections=UPLOAD_CONNECTIONS):
         self.ws_url = ws_url
         self.api_key = api_key
-        self.ws = None
+        self.connections = max(1, connections)
+        self.clients = []
         self.connected = False
-        self.upload_result = None
-        self.upload_complete = threading.Event()
+        # {file_path: upload_id}，用于断点续传
+        self.pending_uploads = {}
         
+    def _new_client(self):
+        client = socketio.Client(reconnection=False)
+        client.connect(
+            self.ws_url,
+            namespaces=[UPLOAD_NAMESPACE],
+            headers={'Authorization': f'Bearer {self.api_key}'},
+            auth={'api_key': self.api_key},
+            transports=['websocket'],
+            wait_timeout=30
+        )
+        return client
+    
     def connect(self):
-        """建立 WebSocket 连接"""
-        if self.connected and self.ws:
+        """建立 WebSocket 连接（多个连接用于并行上传）"""
+        self.clients = [c for c in self.clients if c.connected]
+        if len(self.clients) >= self.connections:
+            self.connected = True
             return True
             
         try:
-            # 创建 WebSocket 连接，带认证头
-            self.ws = websocket.create_connection(
-                self.ws_url,
-                header=[f"Authorization: Bearer {self.api_key}"],
-                timeout=30
-            )
+            while len(self.clients) < self.connections:
+                self.clients.append(self._new_client())
             self.connected = True
-            print(f"✅ WebSocket connected to {self.ws_url}")
+            print(f"✅ WebSocket connected to {self.ws_url} ({len(self.clients)} connections)")
             return True
         except Exception as e:
             print(f"❌ WebSocket connection failed: {e}")
-            self.connected = False
-            return False
+            self.connected = bool(self.clients)
+            return self.connected
     
     def disconnect(self):
         """关闭 WebSocket 连接"""
-        if self.ws:
+        for client in self.clients:
             try:
-                self.ws.close()
+                client.disconnect()
             except:
                 pass
-            self.ws = None
-            self.connected = False
+        self.clients = []
+        self.connected = False
+    
+    def _call(self, event, data, client_index=0, timeout=120):
+        client = self.clients[client_index % len(self.clients)]
+        return client.call(event, data, namespace=UPLOAD_NAMESPACE, timeout=timeout) or {}
+    
+    def _send_chunk(self, file_path, upload_id, offset, length, client_index):
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read(length)
+        digest = hashlib.sha256(chunk).hexdigest()
+        
+        for attempt in range(CHUNK_RETRIES):
+            try:
+                ack = self._call('upload_chunk', {
+                    'upload_id': upload_id,
+                    'offset': offset,
+                    'data': chunk,
+                    'sha256': digest
+                }, client_index + attempt)
+            except Exception as e:
+                ack = {'status': 'error', 'error': str(e)}
+            if ack.get('status') == 'ok':
+                return True
+            print(f"⚠️ Chunk @{offset} attempt {attempt + 1} failed: {ack.get('error')}")
+            time.sleep(0.5 * (attempt + 1))
+        return False
     
     def upload_file(self, file_path, object_name=None):
         """
@@ -102,68 +153,59 @@ class WebSocketUploader:
         
         try:
             file_size = os.path.getsize(file_path)
-            print(f"📤 Uploading {object_name} ({file_size} bytes) via WebSocket...")
+            missing = [[0, file_size]]
+            chunk_size = CHUNK_SIZE
             
-            # 发送开始上传消息
-            start_msg = {
-                "action": "start_upload",
-                "filename": object_name,
-                "file_size": file_size,
-                "content_type": self._get_content_type(file_path)
-            }
-            self.ws.send(json.dumps(start_msg))
+            upload_id = self.pending_uploads.get(file_path)
+            if upload_id:
+                # 断点续传：只发送服务器缺失的区间
+                state = self._call('resume_upload', {'upload_id': upload_id})
+                if state.get('status') == 'ok':
+                    missing = self._missing_ranges(state.get('received_ranges') or [], file_size)
+                    chunk_size = min(chunk_size, state.get('max_chunk_size') or chunk_size)
+                    print(f"🔁 Resuming {object_name}: {file_size - state.get('received_bytes', 0)} bytes left")
+                else:
+                    upload_id = None
             
-            # 等待服务器确认
-            response = json.loads(self.ws.recv())
-            if response.get("status") != "ready":
-                print(f"❌ Server not ready: {response.get('error', 'Unknown error')}")
-                return None
+            if not upload_id:
+                print(f"📤 Uploading {object_name} ({file_size} bytes) via WebSocket...")
+                response = self._call('start_upload', {
+                    'filename': object_name,
+                    'file_size': file_size,
+                    'content_type': self._get_content_type(file_path)
+                })
+                if response.get("status") != "ready":
+                    print(f"❌ Server not ready: {response.get('error', 'Unknown error')}")
+                    return None
+                upload_id = response.get("upload_id")
+                chunk_size = min(chunk_size, response.get('max_chunk_size') or chunk_size)
+                self.pending_uploads[file_path] = upload_id
+                print(f"📋 Upload ID: {upload_id}")
             
-            upload_id = response.get("upload_id")
-            print(f"📋 Upload ID: {upload_id}")
+            chunks = []
+            for start, end in missing:
+                for offset in range(start, end, chunk_size):
+                    chunks.append((offset, min(chunk_size, end - offset)))
             
-            # 分块读取并发送文件
-            chunk_index = 0
-            with open(file_path, 'rb') as f:
-                while True:
-                    chunk = f.read(CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    
-                    # 将二进制数据编码为 base64
-                    chunk_b64 = base64.b64encode(chunk).decode('utf-8')
-                    
-                    chunk_msg = {
-                        "action": "upload_chunk",
-                        "upload_id": upload_id,
-                        "chunk_index": chunk_index,
-                        "data": chunk_b64,
-                        "is_last": len(chunk) < CHUNK_SIZE
-                    }
-                    self.ws.send(json.dumps(chunk_msg))
-                    
-                    # 等待确认
-                    ack = json.loads(self.ws.recv())
-                    if ack.get("status") != "ok":
-                        print(f"❌ Chunk {chunk_index} failed: {ack.get('error')}")
-                        return None
-                    
-                    chunk_index += 1
-                    progress = min(100, int((chunk_index * CHUNK_SIZE / file_size) * 100))
-                    print(f"   Progress: {progress}%", end='\r')
+            # 多个连接并行发送分块
+            with ThreadPoolExecutor(max_workers=len(self.clients) * 2) as pool:
+                results = list(pool.map(
+                    lambda item: self._send_chunk(file_path, upload_id, item[1][0], item[1][1], item[0]),
+                    enumerate(chunks)
+                ))
+            if not all(results):
+                print(f"❌ {results.count(False)} chunk(s) failed; call again to resume")
+                return None
             
-            print()  # 换行
+            # 发送完成消息（服务器可能还在把最后的分片写入 S3）
+            for attempt in range(5):
+                result = self._call('complete_upload', {'upload_id': upload_id})
+                if result.get("status") != "retry":
+                    break
+                time.sleep(1)
             
-            # 发送完成消息
-            complete_msg = {
-                "action": "complete_upload",
-                "upload_id": upload_id
-            }
-            self.ws.send(json.dumps(complete_msg))
-            
-            # 等待最终结果
-            result = json.loads(self.ws.recv())
             if result.get("status") == "success":
+                self.pending_uploads.pop(file_path, None)
                 public_url = result.get("public_url")
                 print(f"✅ Upload successful: {public_url}")
                 return public_url
@@ -176,6 +218,19 @@ class WebSocketUploader:
             self.disconnect()
             return None
     
+    @staticmethod
+    def _missing_ranges(received_ranges, file_size):
+        """根据服务器已接收的区间计算缺失区间"""
+        missing = []
+        cursor = 0
+        for start, end in sorted(received_ranges):
+            if start > cursor:
+                missing.append([cursor, start])
+            cursor = max(cursor, end)
+        if cursor < file_size:
+            missing.append([cursor, file_size])
+        return missing
+    
     def _get_content_type(self, file_path):
         """根据文件扩展名获取 MIME 类型"""
         ext = os.path.splitext(file_path)[1].lower()